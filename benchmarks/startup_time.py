@@ -0,0 +1,108 @@
+"""
+Measures wall time of codepass invocations which must not reach the model:
+--version, all scores disabled and a run where no file changed since the
+last report. Run with `python benchmarks/startup_time.py`, the process exits
+with 1 when the median of any scenario exceeds the budget.
+"""
+
+from argparse import ArgumentParser
+from json import dumps
+from statistics import median
+from tempfile import TemporaryDirectory
+
+import hashlib
+import os
+import subprocess
+import sys
+import time
+
+SAMPLE_FILE_COUNT = 50
+SAMPLE_CODE = "def sample_{index}(value):\n    return value * {index}\n"
+
+
+def write_unchanged_project(project_dir: str) -> None:
+    files = []
+    for index in range(SAMPLE_FILE_COUNT):
+        file_path = f"sample_{index}.py"
+        code = SAMPLE_CODE.format(index=index)
+        with open(os.path.join(project_dir, file_path), "w") as f:
+            f.write(code)
+        files.append(
+            {
+                "file_path": file_path,
+                "hash": hashlib.md5(code.encode()).hexdigest(),
+                "line_count": 2,
+                "a_score": 1.0,
+            }
+        )
+
+    with open(os.path.join(project_dir, "codepass.report.json"), "w") as f:
+        f.write(dumps({"file_count": len(files), "a_score": 1.0, "files": files}))
+
+
+def measure(args, cwd: str, env: dict, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "codepass", *args],
+            cwd=cwd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - started_at)
+    return median(timings) * 1000
+
+
+def main():
+    parser = ArgumentParser(description="Measure codepass startup time")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    env = {
+        key: value for key, value in os.environ.items() if key != "CODEPASS_OPEN_AI_KEY"
+    }
+    repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [repository_root, env.get("PYTHONPATH")])
+    )
+
+    with TemporaryDirectory() as project_dir:
+        write_unchanged_project(project_dir)
+        sample_files = [f"sample_{index}.py" for index in range(SAMPLE_FILE_COUNT)]
+
+        scenarios = {
+            "python interpreter": None,
+            "--version": ["--version"],
+            "--no-a-score --no-b-score": ["--no-a-score", "--no-b-score"],
+            "nothing changed": ["--no-improvement-suggestions", *sample_files],
+        }
+
+        interpreter_time = 0
+        exceeded = False
+        for name, scenario_args in scenarios.items():
+            if scenario_args is None:
+                timings = []
+                for _ in range(args.repeat):
+                    started_at = time.perf_counter()
+                    subprocess.run([sys.executable, "-c", "pass"], env=env)
+                    timings.append(time.perf_counter() - started_at)
+                interpreter_time = median(timings) * 1000
+                print(f"{name:30} {interpreter_time:8.1f} ms")
+                continue
+
+            elapsed = measure(scenario_args, project_dir, env, args.repeat)
+            status = "ok" if elapsed <= args.budget_ms else "over budget"
+            exceeded = exceeded or elapsed > args.budget_ms
+            print(
+                f"{name:30} {elapsed:8.1f} ms"
+                f" (+{elapsed - interpreter_time:.1f} ms over interpreter) {status}"
+            )
+
+    sys.exit(1 if exceeded else 0)
+
+
+if __name__ == "__main__":
+    main()
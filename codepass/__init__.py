@@ -0,0 +1,7 @@
+def __getattr__(name: str):
+    # the library API is imported on first use, the CLI does not load it
+    if name == "evaluate":
+        from codepass.api import evaluate
+
+        return evaluate
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,190 @@
+from dataclasses import replace
+from threading import Lock
+from typing import AsyncIterator, Callable, Dict, List, Mapping, Optional
+
+import asyncio
+
+from codepass.deduplicate import group_by_hash
+from codepass.endpoint_pool import EndpointPool, create_endpoint_pool
+from codepass.file_report import FileReport
+from codepass.get_config import CodepassConfig, enabled_score_names, get_config
+from codepass.read_code_files import CodeFile, source_code_file
+from codepass.scores.evaluate_a_score import AScoreEvaluationResult
+from codepass.scores.suggest_improvements import ImprovementSuggestionResult
+from codepass.utils import partition
+
+# one pool per set of endpoints, so every call of evaluate shares the token
+# budgets of the endpoints, the model clients are shared by llm.model
+endpoint_pools: Dict[tuple, EndpointPool] = {}
+endpoint_pools_lock = Lock()
+
+
+def shared_endpoint_pool(config: CodepassConfig) -> EndpointPool:
+    key = (
+        tuple(
+            (
+                endpoint.api_key_env,
+                endpoint.base_url,
+                endpoint.token_rate_limit,
+                endpoint.weight,
+            )
+            for endpoint in config.endpoints
+        ),
+        config.sample_count,
+    )
+    with endpoint_pools_lock:
+        if key not in endpoint_pools:
+            endpoint_pools[key] = create_endpoint_pool(config)
+        return endpoint_pools[key]
+
+
+def score_name(result) -> str:
+    return "a_score" if isinstance(result, AScoreEvaluationResult) else "b_score"
+
+
+class FileResults:
+    """
+    Results of the evaluated files, passed on as one report entry per file
+    once every enabled score and, when one is needed, the improvement
+    suggestion of the file has arrived. Identical files get a copy.
+    """
+
+    def __init__(
+        self,
+        config: CodepassConfig,
+        code_files: List[CodeFile],
+        twin_paths: Dict[str, List[str]],
+        on_file_reports: Callable[[List[FileReport]], None],
+    ):
+        self.config = config
+        self.code_files = {file.path: file for file in code_files}
+        self.twin_paths = twin_paths
+        self.on_file_reports = on_file_reports
+        self.score_names = set(enabled_score_names(config))
+        self.lock = Lock()
+        self.scores: Dict[str, list] = {file.path: [] for file in code_files}
+        self.suggestions: Dict[str, ImprovementSuggestionResult] = {}
+
+    def _is_complete(self, file_path: str) -> bool:
+        from codepass.main import is_improvement_needed
+
+        scores = self.scores[file_path]
+        if set(score_name(result) for result in scores) != self.score_names:
+            return False
+
+        return (
+            not self.config.improvement_suggestions_enabled
+            or file_path in self.suggestions
+            or not any(is_improvement_needed(self.config, result) for result in scores)
+        )
+
+    def _file_reports(self, file_path: str) -> List[FileReport]:
+        code_file = self.code_files[file_path]
+        suggestion = self.suggestions.get(file_path)
+        file_reports = []
+        for path in [file_path] + self.twin_paths.get(file_path, []):
+            file_report = FileReport(path, code_file.hash)
+            for result in self.scores[file_path]:
+                file_report.add_data(replace(result, file_path=path), self.config)
+            if suggestion is not None:
+                file_report.add_improvement_suggestions(suggestion)
+            file_reports.append(file_report)
+        return file_reports
+
+    def add(self, result):
+        with self.lock:
+            file_path = result.file_path
+            if file_path not in self.scores:
+                return
+            if isinstance(result, ImprovementSuggestionResult):
+                self.suggestions[file_path] = result
+            else:
+                self.scores[file_path].append(result)
+            if not self._is_complete(file_path):
+                return
+
+            file_reports = self._file_reports(file_path)
+            del self.scores[file_path]
+
+        self.on_file_reports(file_reports)
+
+    def remaining(self) -> List[FileReport]:
+        """
+        Report entries of the files still missing a result, e.g. when a
+        task failed, with whatever arrived for them.
+        """
+        with self.lock:
+            file_reports = [
+                file_report
+                for file_path in self.scores
+                for file_report in self._file_reports(file_path)
+            ]
+            self.scores.clear()
+        return file_reports
+
+
+async def evaluate(
+    files: Mapping[str, str], config: Optional[CodepassConfig] = None
+) -> AsyncIterator[FileReport]:
+    """
+    Evaluates the sources of files, keyed by file path, and yields the
+    report entry of every file as soon as it is complete. Large files come
+    first. Nothing is read from or written to disk, besides
+    codepass.config.yaml when no config is given, and nothing is printed.
+    The token budgets and model clients are kept between calls. Batch mode,
+    function reuse and the run level options of the CLI, like deadline or
+    fail fast, do not apply. Requests already scheduled are still sent
+    when the iteration is stopped early.
+    """
+    from codepass.llm.model import configure_http_client
+    from codepass.main import run_evaluation
+
+    if config is None:
+        config = get_config([])
+    # results are passed on while they arrive, batch jobs return them at once
+    config = replace(config, batch_enabled=False)
+    endpoint_pool = shared_endpoint_pool(config)
+    configure_http_client(config.http_connections)
+
+    code_files = [source_code_file(path, source) for path, source in files.items()]
+    code_files = [file for file in code_files if file.size > 0]
+    (accepted_files, large_files) = partition(
+        code_files,
+        lambda file: file.token_count < config.max_context_size,
+    )
+
+    for large_file in large_files:
+        file_report = FileReport(large_file.path, large_file.hash)
+        file_report.mark_as_large(large_file, config)
+        yield file_report
+
+    (evaluated_files, twin_paths) = group_by_hash(accepted_files)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    file_results = FileResults(
+        config,
+        evaluated_files,
+        twin_paths,
+        lambda file_reports: loop.call_soon_threadsafe(queue.put_nowait, file_reports),
+    )
+
+    evaluation = loop.run_in_executor(
+        None,
+        lambda: run_evaluation(
+            endpoint_pool,
+            evaluated_files,
+            config,
+            on_final_result=file_results.add,
+            show_progress=False,
+        ),
+    )
+    # scheduled after the results passed on by the evaluation thread
+    evaluation.add_done_callback(lambda _: queue.put_nowait(None))
+
+    while (file_reports := await queue.get()) is not None:
+        for file_report in file_reports:
+            yield file_report
+
+    await evaluation
+    for file_report in file_results.remaining():
+        yield file_report
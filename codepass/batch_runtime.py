@@ -0,0 +1,310 @@
+from dataclasses import dataclass
+from json import dumps, loads
+from typing import Dict, List, Optional
+
+from codepass.read_code_files import CodeFile
+
+import os
+import tempfile
+import time
+
+A_SCORE = "a_score"
+B_SCORE = "b_score"
+IMPROVEMENT_SUGGESTION = "improvement_suggestion"
+
+BATCH_MAX_REQUESTS = 50000
+# input files of the batch API are limited to 200 MB, kept below it
+BATCH_MAX_BYTES = 190 * 1000 * 1000
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+MESSAGE_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+
+@dataclass
+class BatchTask:
+    kind: str
+    code_file: CodeFile
+    model_name: str
+
+
+@dataclass
+class BatchTaskKind:
+    prompt: any
+    parser: any
+    build_result: callable
+    build_error_result: callable
+    build_samples_result: Optional[callable] = None
+
+
+def batch_task_kinds() -> Dict[str, BatchTaskKind]:
+    from codepass.llm.model import (
+        file_a_score_prompt,
+        file_b_score_prompt,
+        improvement_suggestion_model_prompt,
+    )
+    from codepass.llm.a_score_parser import file_a_score_parser
+    from codepass.llm.b_score_parser import file_b_score_parser
+    from codepass.llm.improvement_suggestion_parser import (
+        improvement_suggestion_parser,
+    )
+    from codepass.scores.evaluate_a_score import (
+        a_score_evaluation_result,
+        a_score_error_result,
+        a_score_samples_result,
+    )
+    from codepass.scores.evaluate_b_score import (
+        b_score_evaluation_result,
+        b_score_error_result,
+        b_score_samples_result,
+    )
+    from codepass.scores.suggest_improvements import (
+        improvement_suggestion_result,
+        improvement_suggestion_error_result,
+    )
+
+    return {
+        A_SCORE: BatchTaskKind(
+            file_a_score_prompt(),
+            file_a_score_parser,
+            a_score_evaluation_result,
+            a_score_error_result,
+            a_score_samples_result,
+        ),
+        B_SCORE: BatchTaskKind(
+            file_b_score_prompt(),
+            file_b_score_parser,
+            b_score_evaluation_result,
+            b_score_error_result,
+            b_score_samples_result,
+        ),
+        IMPROVEMENT_SUGGESTION: BatchTaskKind(
+            improvement_suggestion_model_prompt(),
+            improvement_suggestion_parser,
+            improvement_suggestion_result,
+            improvement_suggestion_error_result,
+        ),
+    }
+
+
+def batch_request(
+    custom_id: str, task: BatchTask, task_kind: BatchTaskKind, sample_count: int
+) -> dict:
+    from codepass.llm.model import TEMPERATURE, TOP_P, SEED, SAMPLING_TEMPERATURE
+
+    messages = task_kind.prompt.format_messages(
+        code=task.code_file.load_code(),
+        error_recovery_instructions="",
+    )
+
+    body = {
+        "model": task.model_name,
+        "messages": [
+            {"role": MESSAGE_ROLES[message.type], "content": message.content}
+            for message in messages
+        ],
+        "temperature": TEMPERATURE,
+        "top_p": TOP_P,
+        "seed": SEED,
+    }
+    if sample_count > 1 and task_kind.build_samples_result is not None:
+        body["n"] = sample_count
+        body["temperature"] = SAMPLING_TEMPERATURE
+
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_URL,
+        "body": body,
+    }
+
+
+def read_batch_output(content: str) -> Dict[str, List[str] | Exception]:
+    outputs = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+
+        output = loads(line)
+        response = output.get("response") or {}
+        error = output.get("error")
+
+        if error is None and response.get("status_code") == 200:
+            body = response["body"]
+            outputs[output["custom_id"]] = [
+                choice["message"]["content"] for choice in body["choices"]
+            ]
+        else:
+            message = (error or {}).get("message") or dumps(response.get("body"))
+            outputs[output["custom_id"]] = Exception(message)
+
+    return outputs
+
+
+class BatchRuntime:
+    """
+    Evaluates tasks through the provider's batch API instead of realtime
+    requests: all requests are written to a JSONL file, submitted as a batch
+    job, polled until the job is finished and parsed into the same results
+    the realtime evaluators return.
+    """
+
+    def __init__(self, endpoint, poll_interval: float, sample_count: int = 1):
+        self.endpoint = endpoint
+        self.poll_interval = poll_interval
+        self.sample_count = sample_count
+        self._tasks: List[BatchTask] = []
+
+    def add_task(self, kind: str, code_file: CodeFile, model_name: str):
+        self._tasks.append(BatchTask(kind, code_file, model_name))
+
+    def _submit_file(self, client, batch_file, request_count: int) -> str:
+        batch_file.close()
+        try:
+            with open(batch_file.name, "rb") as f:
+                input_file = client.files.create(file=f, purpose="batch")
+        finally:
+            os.remove(batch_file.name)
+
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=BATCH_COMPLETION_WINDOW,
+        )
+        print(f"Submitted batch {batch.id} with {request_count} requests")
+        return batch.id
+
+    def _submit(
+        self, client, task_kinds, read_errors: Dict[str, Exception]
+    ) -> List[str]:
+        """
+        Submits the tasks as batch jobs, a new job is started before one
+        would exceed the request count or input file size limit. Tasks of
+        files which can no longer be read get their error in read_errors.
+        """
+        batch_ids = []
+        batch_file = None
+        (request_count, byte_count) = (0, 0)
+        try:
+            for index, task in enumerate(self._tasks):
+                try:
+                    request = batch_request(
+                        str(index), task, task_kinds[task.kind], self.sample_count
+                    )
+                except (OSError, UnicodeDecodeError) as e:
+                    read_errors[str(index)] = Exception(f"File could not be read: {e}")
+                    continue
+                line = dumps(request) + "\n"
+                line_bytes = len(line.encode())
+
+                if batch_file is not None and (
+                    request_count == BATCH_MAX_REQUESTS
+                    or byte_count + line_bytes > BATCH_MAX_BYTES
+                ):
+                    batch_ids.append(
+                        self._submit_file(client, batch_file, request_count)
+                    )
+                    batch_file = None
+
+                if batch_file is None:
+                    batch_file = tempfile.NamedTemporaryFile(
+                        "w", suffix=".jsonl", encoding="utf-8", delete=False
+                    )
+                    (request_count, byte_count) = (0, 0)
+
+                batch_file.write(line)
+                request_count += 1
+                byte_count += line_bytes
+
+            if batch_file is not None:
+                batch_ids.append(self._submit_file(client, batch_file, request_count))
+                batch_file = None
+        finally:
+            # a failed submission leaves no request file behind
+            if batch_file is not None:
+                batch_file.close()
+                os.remove(batch_file.name)
+
+        return batch_ids
+
+    def _await_batch(
+        self, client, batch_id: str
+    ) -> Dict[str, List[str] | Exception]:
+        batch = client.batches.retrieve(batch_id)
+        while batch.status not in BATCH_FINAL_STATUSES:
+            time.sleep(self.poll_interval)
+            batch = client.batches.retrieve(batch_id)
+            if batch.request_counts is not None:
+                print(
+                    f"Batch {batch_id}: {batch.status}"
+                    f" {batch.request_counts.completed + batch.request_counts.failed}"
+                    f"/{batch.request_counts.total}"
+                )
+
+        outputs = {}
+        for file_id in [batch.output_file_id, batch.error_file_id]:
+            if file_id is not None:
+                outputs.update(read_batch_output(client.files.content(file_id).text))
+
+        if batch.status != "completed":
+            print(f"Batch {batch_id} finished with status {batch.status}")
+
+        return outputs
+
+    def _build_result(
+        self, task: BatchTask, task_kind: BatchTaskKind, output: List[str]
+    ):
+        from langchain_core.exceptions import OutputParserException
+        from codepass.llm.output_repair import parse_with_repair
+
+        parsed_outputs = []
+        parsing_errors = []
+        for content in output:
+            try:
+                parsed_outputs.append(parse_with_repair(task_kind.parser, content))
+            except OutputParserException as e:
+                parsing_errors.append(e)
+
+        if len(parsed_outputs) == 0:
+            return task_kind.build_error_result(
+                task.code_file,
+                f"Parsing of output formatting failed: {parsing_errors[0]}"
+                if parsing_errors
+                else "Missing batch output",
+            )
+
+        if len(output) > 1 and task_kind.build_samples_result is not None:
+            return task_kind.build_samples_result(task.code_file, parsed_outputs)
+
+        return task_kind.build_result(task.code_file, parsed_outputs[0])
+
+    def run_tasks(self) -> list:
+        from codepass.llm.model import get_open_ai_client
+
+        if len(self._tasks) == 0:
+            return []
+
+        client = get_open_ai_client(self.endpoint)
+        task_kinds = batch_task_kinds()
+
+        outputs: Dict[str, List[str] | Exception] = {}
+        batch_ids = self._submit(client, task_kinds, outputs)
+
+        for batch_id in batch_ids:
+            outputs.update(self._await_batch(client, batch_id))
+
+        results = []
+        for index, task in enumerate(self._tasks):
+            task_kind = task_kinds[task.kind]
+            output = outputs.get(str(index), Exception("Missing batch output"))
+
+            if isinstance(output, Exception):
+                result = task_kind.build_error_result(task.code_file, str(output))
+            else:
+                result = self._build_result(task, task_kind, output)
+
+            if hasattr(result, "model_name"):
+                result.model_name = task.model_name
+            results.append(result)
+
+        return results
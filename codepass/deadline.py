@@ -0,0 +1,55 @@
+from bisect import insort
+from threading import Lock
+from typing import List
+
+from codepass.read_code_files import CodeFile
+from codepass.scheduler import REQUEST_OVERHEAD_SECONDS, request_seconds
+
+import time
+
+# time left after the last answer to combine, print and save the report
+REPORT_RESERVE_SECONDS = 5
+# latencies vary, the slow end of the observed ones is expected
+LATENCY_PERCENTILE = 0.9
+
+
+class Deadline:
+    """
+    Decides whether a request can still be answered before the deadline,
+    leaving time to save the report. Latency is predicted from the answers
+    observed so far, scaled by request size, and from a rough model of the
+    generation speed until the first answer arrives.
+    """
+
+    def __init__(self, deadline_at: float, sample_count: int = 1):
+        self.deadline_at = deadline_at
+        self.sample_count = sample_count
+        self.lock = Lock()
+        # kept sorted, so the percentile is read without sorting again
+        self.seconds_per_token: List[float] = []
+
+    def observe(self, code_file: CodeFile, seconds: float):
+        with self.lock:
+            insort(
+                self.seconds_per_token,
+                max(seconds - REQUEST_OVERHEAD_SECONDS, 0)
+                / max(code_file.token_count, 1),
+            )
+
+    def predicted_seconds(self, code_file: CodeFile) -> float:
+        with self.lock:
+            if len(self.seconds_per_token) == 0:
+                return request_seconds(code_file, self.sample_count)
+            observed = self.seconds_per_token
+            slow = observed[int((len(observed) - 1) * LATENCY_PERCENTILE)]
+
+        return REQUEST_OVERHEAD_SECONDS + slow * code_file.token_count
+
+    def remaining_seconds(self) -> float:
+        return self.deadline_at - REPORT_RESERVE_SECONDS - time.time()
+
+    def slack_seconds(self, code_file: CodeFile) -> float:
+        return self.remaining_seconds() - self.predicted_seconds(code_file)
+
+    def allows(self, code_file: CodeFile) -> bool:
+        return self.slack_seconds(code_file) >= 0
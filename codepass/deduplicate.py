@@ -0,0 +1,38 @@
+from dataclasses import replace
+from typing import Dict, List, Tuple
+
+from codepass.read_code_files import CodeFile
+
+
+def group_by_hash(
+    code_files: List[CodeFile],
+) -> Tuple[List[CodeFile], Dict[str, List[str]]]:
+    """
+    Keeps one file per content hash, the first one by path. Returns the
+    files to evaluate and the paths of the identical files per kept path.
+    """
+    kept_files: Dict[str, CodeFile] = {}
+    twin_paths: Dict[str, List[str]] = {}
+    for code_file in sorted(code_files, key=lambda file: file.path):
+        kept_file = kept_files.get(code_file.hash)
+        if kept_file is None:
+            kept_files[code_file.hash] = code_file
+            twin_paths[code_file.path] = []
+        else:
+            twin_paths[kept_file.path].append(code_file.path)
+
+    return (list(kept_files.values()), twin_paths)
+
+
+def fan_out_results(results: List, twin_paths: Dict[str, List[str]]) -> List:
+    """
+    Copies every result to the identical files of the evaluated one.
+    """
+    fanned_out_results = []
+    for result in results:
+        fanned_out_results.append(result)
+        fanned_out_results += [
+            replace(result, file_path=twin_path)
+            for twin_path in twin_paths.get(result.file_path, [])
+        ]
+    return fanned_out_results
@@ -0,0 +1,311 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Pattern, Tuple
+
+import os
+import re
+
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+# version control data and codepass' own outputs are never evaluated
+ALWAYS_SKIPPED_DIRECTORIES = {".git", "codepass.history"}
+ALWAYS_SKIPPED_FILES = {"codepass.report.json", "codepass.functions.json"}
+GITIGNORE_FILE = ".gitignore"
+
+
+def translate_glob(pattern: str) -> str:
+    """
+    Translates a glob into a regular expression matching '/' separated
+    paths: '*' and '?' stay inside one path segment, '**' spans any number
+    of segments, including none.
+    """
+    regex = ""
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            regex += "(?:.*/)?"
+            index += 3
+        elif pattern.startswith("/**", index) and index + 3 == len(pattern):
+            regex += "(?:/.*)?"
+            index += 3
+        elif pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+        elif char == "*":
+            regex += "[^/]*"
+            index += 1
+        elif char == "?":
+            regex += "[^/]"
+            index += 1
+        elif char == "[":
+            closing_index = pattern.find("]", index + 2)
+            if closing_index == -1:
+                regex += re.escape(char)
+                index += 1
+            else:
+                characters = pattern[index + 1 : closing_index]
+                if characters.startswith("!"):
+                    characters = "^" + characters[1:]
+                regex += f"[{characters}]"
+                index = closing_index + 1
+        else:
+            regex += re.escape(char)
+            index += 1
+    return regex
+
+
+def normalize_path(file_path: str) -> str:
+    return os.path.normpath(file_path).replace(os.sep, "/")
+
+
+def glob_root(pattern: str) -> str:
+    segments = []
+    for segment in pattern.split("/"):
+        if GLOB_CHARACTERS.search(segment):
+            break
+        segments.append(segment)
+    return "/".join(segments) or "."
+
+
+@dataclass
+class GitignoreRule:
+    pattern: Pattern
+    negated: bool
+    directory_only: bool
+
+
+def parse_gitignore_rule(line: str) -> Optional[GitignoreRule]:
+    line = line.rstrip("\n").rstrip()
+    if line == "" or line.startswith("#"):
+        return None
+
+    negated = line.startswith("!")
+    if negated or line.startswith("\\"):
+        line = line[1:]
+
+    directory_only = line.endswith("/")
+    line = line.rstrip("/")
+    if line == "":
+        return None
+
+    # without an inner slash a pattern matches at any depth
+    if "/" in line:
+        regex = translate_glob(line.lstrip("/"))
+    else:
+        regex = "(?:.*/)?" + translate_glob(line)
+
+    return GitignoreRule(re.compile(regex + "$"), negated, directory_only)
+
+
+class FileDiscovery:
+    """
+    Resolves the configured paths (files, directories or globs) into the
+    list of files to evaluate with a single directory walk. Exclude globs
+    and .gitignore rules are compiled once, excluded directories are not
+    entered at all.
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        ignore_patterns: List[str],
+        use_gitignore: bool = True,
+    ):
+        self.paths = paths
+        self.use_gitignore = use_gitignore
+
+        exclude_regex = "|".join(
+            f"(?:{translate_glob(normalize_path(pattern))})"
+            for pattern in ignore_patterns
+        )
+        self._exclude = re.compile(f"(?:{exclude_regex})$") if exclude_regex else None
+        self._gitignore_rules: Dict[str, List[GitignoreRule]] = {}
+
+        # explicit files keep the spelling they were given with, so report
+        # entries stay keyed the same way as before
+        self._file_paths: Dict[str, str] = {}
+        self._directories = []
+        self._globs = []
+        for path in paths:
+            normalized_path = normalize_path(path)
+            if GLOB_CHARACTERS.search(normalized_path):
+                self._globs.append(
+                    (
+                        glob_root(normalized_path),
+                        re.compile(translate_glob(normalized_path) + "$"),
+                    )
+                )
+            elif os.path.isdir(normalized_path):
+                self._directories.append(normalized_path)
+            else:
+                self._file_paths[normalized_path] = path
+
+    def _read_gitignore_rules(self, directory: str) -> List[GitignoreRule]:
+        if directory not in self._gitignore_rules:
+            rules = []
+            try:
+                with open(os.path.join(directory, GITIGNORE_FILE)) as f:
+                    rules = [
+                        rule
+                        for rule in map(parse_gitignore_rule, f)
+                        if rule is not None
+                    ]
+            except (FileNotFoundError, NotADirectoryError, UnicodeDecodeError):
+                pass
+            self._gitignore_rules[directory] = rules
+        return self._gitignore_rules[directory]
+
+    def _is_gitignored(self, path: str, is_directory: bool) -> bool:
+        if path.startswith("../") or os.path.isabs(path):
+            return False
+
+        is_ignored = False
+        segments = path.split("/")
+        for depth in range(len(segments)):
+            directory = "/".join(segments[:depth]) or "."
+            relative_path = "/".join(segments[depth:])
+            for rule in self._read_gitignore_rules(directory):
+                if rule.directory_only and not is_directory:
+                    continue
+                if rule.pattern.match(relative_path):
+                    is_ignored = not rule.negated
+        return is_ignored
+
+    def is_excluded(self, path: str, is_directory: bool = False) -> bool:
+        if self._exclude is not None and (
+            self._exclude.match(path)
+            or (is_directory and self._exclude.match(path + "/"))
+        ):
+            return True
+
+        return self.use_gitignore and self._is_gitignored(path, is_directory)
+
+    def _walk(self, root: str, with_directories: bool = False):
+        """
+        Yields the files found by a walk from root and, with_directories,
+        the directories it enters, root included, as (path, is_directory).
+        """
+        directories = [root]
+        while directories:
+            directory = directories.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+            if with_directories:
+                yield (directory, True)
+
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                path = entry.name if directory == "." else f"{directory}/{entry.name}"
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in ALWAYS_SKIPPED_DIRECTORIES:
+                        continue
+                    if not self.is_excluded(path, is_directory=True):
+                        directories.append(path)
+                elif (
+                    entry.is_file()
+                    and entry.name not in ALWAYS_SKIPPED_FILES
+                    and not self.is_excluded(path)
+                ):
+                    yield (path, False)
+
+    def _walk_files(self, root: str) -> List[str]:
+        return [path for path, _ in self._walk(root)]
+
+    def discover(self) -> List[str]:
+        discovered = dict.fromkeys(
+            path
+            for normalized_path, path in self._file_paths.items()
+            if self._exclude is None or not self._exclude.match(normalized_path)
+        )
+
+        for directory in self._directories:
+            discovered.update(dict.fromkeys(self._walk_files(directory)))
+
+        for root, pattern in self._globs:
+            discovered.update(
+                dict.fromkeys(
+                    path for path in self._walk_files(root) if pattern.match(path)
+                )
+            )
+
+        return list(discovered)
+
+    def _is_entered(self, directory: str, root: str) -> bool:
+        """
+        Whether a walk from root enters directory and every one on the way.
+        """
+        segments = directory.split("/")
+        root_depth = 0 if root == "." else len(root.split("/"))
+        for depth in range(root_depth + 1, len(segments) + 1):
+            if segments[depth - 1] in ALWAYS_SKIPPED_DIRECTORIES:
+                return False
+            if self.is_excluded("/".join(segments[:depth]), is_directory=True):
+                return False
+        return True
+
+    def _walk_roots(self, path: str) -> List[str]:
+        return [
+            directory
+            for directory in self._directories + [root for root, _ in self._globs]
+            if directory in (".", path) or path.startswith(directory + "/")
+        ]
+
+    def includes(self, file_path: str) -> bool:
+        """
+        Whether discover would return the file, e.g. one created while
+        watching.
+        """
+        path = normalize_path(file_path)
+
+        if path in self._file_paths:
+            return self._exclude is None or not self._exclude.match(path)
+
+        parent = os.path.dirname(path) or "."
+        roots = [
+            directory
+            for directory in self._directories
+            if directory == "." or path.startswith(directory + "/")
+        ] + [root for root, pattern in self._globs if pattern.match(path)]
+
+        return (
+            any(self._is_entered(parent, root) for root in roots)
+            and os.path.basename(path) not in ALWAYS_SKIPPED_FILES
+            and not self.is_excluded(path)
+        )
+
+    def enters(self, directory: str) -> bool:
+        """
+        Whether discover walks through the directory, e.g. one created
+        while watching.
+        """
+        path = normalize_path(directory)
+        return any(self._is_entered(path, root) for root in self._walk_roots(path))
+
+    def walk(self, directory: str) -> Tuple[List[str], List[str]]:
+        """
+        Directories entered and files found by a walk from the directory.
+        """
+        (directories, file_paths) = ([], [])
+        for path, is_directory in self._walk(
+            normalize_path(directory), with_directories=True
+        ):
+            (directories if is_directory else file_paths).append(path)
+        return (directories, file_paths)
+
+    def watched_directories(self) -> List[str]:
+        """
+        Every directory discover walks through and the directories of the
+        explicit files.
+        """
+        return [
+            *(
+                directory
+                for root in self._directories + [root for root, _ in self._globs]
+                for directory in self.walk(root)[0]
+            ),
+            *set(os.path.dirname(path) or "." for path in self._file_paths),
+        ]
+
+
+def create_file_discovery(config) -> FileDiscovery:
+    return FileDiscovery(config.paths, config.ignore_files, config.gitignore_enabled)
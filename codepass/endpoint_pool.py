@@ -0,0 +1,264 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import count
+from threading import Condition, Event, Lock, local
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+import heapq
+import time
+
+from codepass import trace
+from codepass.read_code_files import CodeFile
+from codepass.token_budget_estimator import TokenBudgetEstimator
+
+if TYPE_CHECKING:
+    # imported where used, the timeout estimate depends on modules which
+    # import the pool
+    from codepass.request_timeout import RequestTimeouts
+
+MAX_FAILURE_BACKOFF_SECONDS = 60
+
+
+class EvaluationCancelled(Exception):
+    pass
+
+
+@dataclass
+class Endpoint:
+    name: str
+    api_key_env: str
+    base_url: Optional[str]
+    weight: float
+    token_budget_estimator: TokenBudgetEstimator
+
+    failure_count: int = 0
+    failed_until: float = 0
+
+    def is_available(self, current_time: float) -> bool:
+        return self.failed_until <= current_time
+
+    def priority(self) -> float:
+        return self.token_budget_estimator.remaining_budget() * self.weight
+
+
+class EndpointPool:
+    """
+    Spreads requests over several API keys or OpenAI compatible endpoints,
+    each with its own token budget. A request goes to the available endpoint
+    with the largest weighted remaining budget, endpoints which return errors
+    are put aside with an exponential back off. Budget is granted in the
+    order of request priorities, so the dispatch plan is kept even though
+    requests wait on many threads.
+    """
+
+    def __init__(
+        self, endpoints: List[Endpoint], timeouts: Optional["RequestTimeouts"] = None
+    ):
+        from codepass.request_timeout import RequestTimeouts
+
+        self.endpoints = endpoints
+        self.timeouts = timeouts if timeouts is not None else RequestTimeouts()
+        self.mutex = Lock()
+        self.cancelled = Event()
+        self.queue = Lock()
+        # priority, arrival and the condition the waiting request sleeps on,
+        # only the head of the queue is woken when it changes
+        self._waiting: List[Tuple[int, int, Condition]] = []
+        self._arrivals = count()
+        self._dispatch = local()
+        self.deadline = None
+        # counters for the progress display
+        self.in_flight_count = 0
+        self.retry_count = 0
+        self.latency_total = 0.0
+        self.latency_count = 0
+
+    def _reserve_budget(self, code: CodeFile) -> Tuple[Optional[Endpoint], float]:
+        with self.mutex:
+            current_time = time.time()
+            available_endpoints = [
+                endpoint
+                for endpoint in self.endpoints
+                if endpoint.is_available(current_time)
+            ]
+
+            if len(available_endpoints) == 0:
+                recovery_time = min(endpoint.failed_until for endpoint in self.endpoints)
+                return (None, recovery_time - current_time)
+
+            available_endpoints.sort(key=lambda endpoint: endpoint.priority(), reverse=True)
+
+            delays = []
+            for endpoint in available_endpoints:
+                delay = endpoint.token_budget_estimator.reserveBudget(code)
+                if delay == 0:
+                    return (endpoint, 0)
+                delays.append(delay)
+
+            return (None, min(delays))
+
+    @contextmanager
+    def prioritized(self, priority: int):
+        """
+        Requests made by the current thread within the block wait for budget
+        behind requests of a lower priority value.
+        """
+        self._dispatch.priority = priority
+        try:
+            yield
+        finally:
+            self._dispatch.priority = 0
+
+    def await_budget(self, code: CodeFile) -> Endpoint:
+        waiter = Condition(self.queue)
+        entry = (getattr(self._dispatch, "priority", 0), next(self._arrivals), waiter)
+        with trace.span(trace.QUEUE_WAIT, code.path), self.queue:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    if self.cancelled.is_set():
+                        raise EvaluationCancelled()
+
+                    if self.deadline is not None and not self.deadline.allows(code):
+                        raise EvaluationCancelled()
+
+                    if self._waiting[0] is not entry:
+                        waiter.wait()
+                        continue
+
+                    (endpoint, delay) = self._reserve_budget(code)
+
+                    if endpoint is not None:
+                        return endpoint
+
+                    if self.deadline is not None:
+                        # wake up once the request can not make it anymore
+                        delay = min(delay, self.deadline.slack_seconds(code))
+
+                    waiter.wait(float(max(delay, 0.1)))
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                if len(self._waiting) > 0:
+                    self._waiting[0][2].notify()
+
+    def cancel(self):
+        """
+        Makes requests waiting for budget, and all later ones, raise
+        EvaluationCancelled. Requests already sent are not interrupted.
+        """
+        self.cancelled.set()
+        with self.queue:
+            for _, _, waiter in self._waiting:
+                waiter.notify()
+
+    def resume(self):
+        self.cancelled.clear()
+
+    def set_deadline(self, deadline):
+        """
+        Requests which are not predicted to be answered before the deadline
+        raise EvaluationCancelled instead of being sent.
+        """
+        self.deadline = deadline
+
+    def request_timeout(self, code: CodeFile, retry: int = 0) -> float:
+        """
+        Timeout of a request, see RequestTimeouts, which ends no later than
+        the deadline, so the report is still saved in time.
+        """
+        timeout = self.timeouts.timeout_seconds(code, retry)
+        if self.deadline is not None:
+            timeout = min(timeout, max(self.deadline.remaining_seconds(), 0.1))
+        return timeout
+
+    def allows_retry(self, seconds: float) -> bool:
+        """
+        Whether a request which took seconds already may be sent again
+        before the deadline.
+        """
+        return self.deadline is None or self.deadline.remaining_seconds() >= seconds
+
+    @contextmanager
+    def in_flight(self):
+        """
+        Counts the request sent within the block as in flight.
+        """
+        with self.mutex:
+            self.in_flight_count += 1
+        try:
+            yield
+        finally:
+            with self.mutex:
+                self.in_flight_count -= 1
+
+    def record_retry(self):
+        with self.mutex:
+            self.retry_count += 1
+
+    def queued_count(self) -> int:
+        return len(self._waiting)
+
+    def mean_latency(self) -> Optional[float]:
+        with self.mutex:
+            if self.latency_count == 0:
+                return None
+            return self.latency_total / self.latency_count
+
+    def window_usage(self) -> Tuple[int, int]:
+        """
+        Tokens sent over the last minute and the limit of all endpoints.
+        """
+        return (
+            sum(e.token_budget_estimator.window_usage() for e in self.endpoints),
+            sum(e.token_budget_estimator.token_budget for e in self.endpoints),
+        )
+
+    def observe_latency(self, code: CodeFile, seconds: float):
+        with self.mutex:
+            self.latency_total += seconds
+            self.latency_count += 1
+        self.timeouts.observe(code, seconds)
+        if self.deadline is not None:
+            self.deadline.observe(code, seconds)
+
+    def push_external_costs(self, token_count: int, endpoint: Endpoint):
+        endpoint.token_budget_estimator.push_external_costs(token_count)
+
+    def report_success(self, endpoint: Endpoint):
+        with self.mutex:
+            endpoint.failure_count = 0
+
+    def report_failure(self, endpoint: Endpoint):
+        with self.mutex:
+            endpoint.failure_count += 1
+            backoff_seconds = min(
+                2**endpoint.failure_count, MAX_FAILURE_BACKOFF_SECONDS
+            )
+            endpoint.failed_until = time.time() + backoff_seconds
+
+    def has_alternative(self, endpoint: Endpoint) -> bool:
+        with self.mutex:
+            current_time = time.time()
+            return any(
+                other is not endpoint and other.is_available(current_time)
+                for other in self.endpoints
+            )
+
+
+def create_endpoint_pool(config) -> EndpointPool:
+    from codepass.request_timeout import RequestTimeouts
+
+    return EndpointPool(
+        [
+            Endpoint(
+                name=f"{index}:{endpoint.base_url or 'default'}:{endpoint.api_key_env}",
+                api_key_env=endpoint.api_key_env,
+                base_url=endpoint.base_url,
+                weight=endpoint.weight,
+                token_budget_estimator=TokenBudgetEstimator(endpoint.token_rate_limit),
+            )
+            for index, endpoint in enumerate(config.endpoints)
+        ],
+        RequestTimeouts(config.sample_count),
+    )
@@ -0,0 +1,290 @@
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from itertools import permutations
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from colorama import Fore
+
+from codepass.file_report import FileReport
+from codepass.get_config import CodepassConfig, enabled_score_names
+from codepass.read_code_files import CodeFile
+from codepass.scores.evaluate_a_score import AScoreEvaluationResult
+from codepass.scores.evaluate_b_score import BScoreEvaluationResult
+
+# a file A score is a line weighted mean of function scores within 1..5,
+# a B score sums up to five layer impacts of at most 1
+SCORE_RANGES = {"a_score": (1, 5), "b_score": (0, 5)}
+# lines left over after removing items, from float rounding
+EPSILON = 1e-9
+
+
+@dataclass
+class WeightedScore:
+    score_low: float
+    score_high: float
+    weight_low: float
+    weight_high: float
+
+
+def ratio_bound(
+    line_sum: float,
+    lines: float,
+    extra_lines: List[Tuple[float, float]],
+    maximize: bool,
+) -> float:
+    """
+    Extreme of the line weighted mean when the items, counted with their
+    smallest weight in line_sum and lines, may take more lines. extra_lines
+    holds the extra lines per score, most extreme score first, they are
+    added as long as that moves the mean further.
+    """
+    if not maximize and lines == 0:
+        # nothing scored yet, a project without scored lines aggregates to 0
+        return 0
+
+    for score, extra_weight in extra_lines:
+        if lines > 0:
+            mean = line_sum / lines
+            if (score <= mean) if maximize else (score >= mean):
+                break
+        line_sum += score * extra_weight
+        lines += extra_weight
+
+    return line_sum / lines if lines > 0 else 0
+
+
+class RunningBounds:
+    """
+    Sums of one score over the items of the changed files, updated as the
+    items change. Settled scores are kept as the lines at their smallest
+    weight plus the extra lines per distinct score, pending scores as their
+    lines only, so the bounds cost a pass over the distinct scores.
+    """
+
+    def __init__(
+        self, score_range: Tuple[float, float], line_sum: float, lines: float
+    ):
+        self.score_range = score_range
+        self.line_sum = line_sum
+        self.lines = lines
+        self.pending_lines = 0.0
+        self.extra_lines: Dict[float, float] = {}
+        self.scores: List[float] = []
+
+    def update(self, item: Optional[WeightedScore], sign: int):
+        """
+        Adds the item with a sign of 1, removes it with a sign of -1.
+        """
+        if item is None:
+            return
+
+        if item.score_low != item.score_high:
+            # pending, at its smallest weight of 0 it does not count
+            self.pending_lines += sign * item.weight_high
+            return
+
+        self.line_sum += sign * item.score_low * item.weight_low
+        self.lines += sign * item.weight_low
+        extra_weight = item.weight_high - item.weight_low
+        if extra_weight <= 0:
+            return
+
+        score = item.score_low
+        if score not in self.extra_lines:
+            insort(self.scores, score)
+            self.extra_lines[score] = 0.0
+        self.extra_lines[score] += sign * extra_weight
+        if self.extra_lines[score] <= EPSILON:
+            del self.extra_lines[score]
+            del self.scores[bisect_left(self.scores, score)]
+
+    def bounds(self) -> Tuple[float, float]:
+        (score_low, score_high) = self.score_range
+        ascending = [(score, self.extra_lines[score]) for score in self.scores]
+        descending = ascending[::-1]
+        if self.pending_lines > EPSILON:
+            # the ends of the score range come before every settled score
+            ascending.insert(0, (score_low, self.pending_lines))
+            descending.insert(0, (score_high, self.pending_lines))
+        return (
+            ratio_bound(self.line_sum, self.lines, ascending, maximize=False),
+            ratio_bound(self.line_sum, self.lines, descending, maximize=True),
+        )
+
+
+def line_count_range(
+    line_counts: List[Optional[int]], max_line_count: int
+) -> Tuple[float, float]:
+    """
+    Range of the line count a changed file ends up with in the report.
+    FileReport.add_data averages the line count of every score result into
+    the previous value in the order the results arrive, pending results can
+    count anything between no lines and the whole file.
+    """
+    low = high = None
+    for order in permutations(line_counts):
+        (order_low, order_high) = (0.0, 0.0)
+        for line_count in order:
+            order_low = (order_low + (line_count or 0)) / 2
+            order_high = (
+                order_high + (max_line_count if line_count is None else line_count)
+            ) / 2
+        low = order_low if low is None else min(low, order_low)
+        high = order_high if high is None else max(high, order_high)
+    return (low, high)
+
+
+class FailFastGate:
+    """
+    Keeps lower and upper bounds of the aggregated scores while results
+    arrive, unchanged files count with their cached scores. Once every
+    enabled score is certain to pass, or one is certain to fail, the
+    remaining evaluations are cancelled.
+    """
+
+    def __init__(
+        self,
+        config: CodepassConfig,
+        changed_files: List[CodeFile],
+        large_files: List[CodeFile],
+        report_files: Dict[str, FileReport],
+    ):
+        self.config = config
+        self.score_names = enabled_score_names(config)
+        self.thresholds = {
+            "a_score": config.a_score_threshold,
+            "b_score": config.b_score_threshold,
+        }
+        self.lock = Lock()
+        self.verdict: Optional[bool] = None
+        self.failed_score_name: Optional[str] = None
+
+        self.max_line_counts = {
+            code_file.path: code_file.line_count for code_file in changed_files
+        }
+        self.line_counts: Dict[str, Dict[str, int]] = {
+            path: {} for path in self.max_line_counts
+        }
+        self.scores: Dict[str, Dict[str, float]] = {
+            path: {} for path in self.max_line_counts
+        }
+        # identical files are evaluated once, a result counts for all of them
+        self.hash_paths: Dict[str, List[str]] = {}
+        for code_file in changed_files:
+            self.hash_paths.setdefault(code_file.hash, []).append(code_file.path)
+        self.path_hashes = {
+            code_file.path: code_file.hash for code_file in changed_files
+        }
+
+        # unchanged files do not move, their sums are computed once, too
+        # large files are reset to 0 and do not count
+        skipped_paths = set(self.max_line_counts) | set(
+            code_file.path for code_file in large_files
+        )
+        self.running_bounds: Dict[str, RunningBounds] = {}
+        for score_name in self.score_names:
+            (line_sum, lines) = (0.0, 0.0)
+            for path, file_report in report_files.items():
+                score = getattr(file_report, score_name, 0)
+                if path not in skipped_paths and score > 0:
+                    line_sum += score * file_report.line_count
+                    lines += file_report.line_count
+            self.running_bounds[score_name] = RunningBounds(
+                SCORE_RANGES[score_name], line_sum, lines
+            )
+
+        self.items: Dict[str, Dict[str, Optional[WeightedScore]]] = {}
+        for path in self.max_line_counts:
+            self._update_items(path)
+
+    def _is_final(self, result) -> bool:
+        escalation_model_name = self.config.escalation_model_name
+        if escalation_model_name is None or result.model_name == escalation_model_name:
+            return True
+
+        from codepass.main import is_escalation_needed
+
+        return not is_escalation_needed(self.config, result)
+
+    def _add_result(self, result) -> bool:
+        if isinstance(result, AScoreEvaluationResult):
+            (score_name, score) = ("a_score", result.a_score)
+        elif isinstance(result, BScoreEvaluationResult):
+            (score_name, score) = ("b_score", result.b_score)
+        else:
+            return False
+
+        if result.file_path not in self.scores or not self._is_final(result):
+            return False
+
+        for path in self.hash_paths[self.path_hashes[result.file_path]]:
+            self.scores[path][score_name] = score
+            self.line_counts[path][score_name] = result.line_count
+            self._update_items(path)
+        return True
+
+    def _file_items(self, path: str) -> Dict[str, Optional[WeightedScore]]:
+        line_counts = self.line_counts[path]
+        (weight_low, weight_high) = line_count_range(
+            [line_counts.get(name, None) for name in self.score_names],
+            max(self.max_line_counts[path], *line_counts.values(), 0),
+        )
+
+        items = {}
+        for score_name in self.score_names:
+            (score_low, score_high) = SCORE_RANGES[score_name]
+            score = self.scores[path].get(score_name, None)
+            if score is None:
+                # a failed evaluation scores 0 and does not count at all
+                items[score_name] = WeightedScore(score_low, score_high, 0, weight_high)
+            elif score > 0:
+                items[score_name] = WeightedScore(score, score, weight_low, weight_high)
+            else:
+                items[score_name] = None
+        return items
+
+    def _update_items(self, path: str):
+        previous_items = self.items.get(path, {})
+        self.items[path] = self._file_items(path)
+        for score_name, running_bounds in self.running_bounds.items():
+            running_bounds.update(previous_items.get(score_name), -1)
+            running_bounds.update(self.items[path][score_name], 1)
+
+    def bounds(self, score_name: str) -> Tuple[float, float]:
+        return self.running_bounds[score_name].bounds()
+
+    def _settle_verdict(self) -> Optional[bool]:
+        passed_score_count = 0
+        for score_name in self.score_names:
+            (low, high) = self.bounds(score_name)
+            if round(low, 1) > self.thresholds[score_name]:
+                self.failed_score_name = score_name
+                return False
+            if round(high, 1) <= self.thresholds[score_name]:
+                passed_score_count += 1
+
+        if passed_score_count == len(self.score_names):
+            return True
+
+        return None
+
+    def wrap(self, parallel_runtime, on_result=None):
+        def on_gated_result(result):
+            if on_result is not None:
+                on_result(result)
+
+            with self.lock:
+                if self.verdict is not None or not self._add_result(result):
+                    return
+                self.verdict = self._settle_verdict()
+                if self.verdict is None:
+                    return
+
+            print(
+                Fore.YELLOW
+                + "\nThreshold verdict is certain, cancelling the remaining evaluations"
+            )
+            parallel_runtime.cancel_pending()
+
+        return on_gated_result
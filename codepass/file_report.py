@@ -39,13 +39,32 @@ class FileReport:
             self.a_score = report.a_score
             if config.details_enabled:
                 self.a_score_details = report.details
+            if config.escalation_model_name is not None:
+                self.a_score_model = report.model_name
         else:
             self.b_score = report.b_score
             if config.details_enabled:
                 self.b_score_details = report.details
+            if config.escalation_model_name is not None:
+                self.b_score_model = report.model_name
 
         self._add_error_message(report)
 
+    def add_screening_data(
+        self,
+        report: AScoreEvaluationResult | BScoreEvaluationResult,
+    ):
+        screening = {"model": report.model_name}
+        if report.error_message:
+            screening["error_message"] = report.error_message
+
+        if isinstance(report, AScoreEvaluationResult):
+            screening["a_score"] = report.a_score
+            self.a_score_screening = screening
+        else:
+            screening["b_score"] = report.b_score
+            self.b_score_screening = screening
+
     def mark_as_large(
         self,
         code_file: CodeFile,
@@ -61,17 +80,16 @@ class FileReport:
             self.error_message = "File is too large to evaluate"
 
         if config.improvement_suggestions_enabled:
-            line_count = len(code_file.code.split("\n"))
             self.add_improvement_suggestions(
                 ImprovementSuggestionResult(
                     file_path=self.file_path,
                     start_line=0,
-                    end_line=line_count,
+                    end_line=code_file.line_count,
                     improvement_suggestion="Break down, the file is to large",
                 )
             )
 
-        self.line_count = code_file.code.count("\n")
+        self.line_count = code_file.line_count - 1
 
     def load_from_dict(data: dict):
         try:
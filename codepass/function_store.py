@@ -0,0 +1,152 @@
+from dataclasses import dataclass
+from json import dumps, loads
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from codepass.scores.function_fingerprint import (
+    FunctionSpan,
+    SIMHASH_BITS,
+    hamming_distance,
+)
+
+FUNCTION_STORE_PATH = "codepass.functions.json"
+FUNCTION_STORE_VERSION = 1
+
+
+@dataclass
+class FunctionEntry:
+    fingerprint: str
+    simhash: int
+    factors: Dict[str, float]
+
+
+def simhash_bands(simhash: int, band_count: int) -> List[Tuple[int, int]]:
+    """
+    Splits the SimHash into band_count bands of about the same width, each
+    keyed by its index.
+    """
+    bands = []
+    for band in range(band_count):
+        start = band * SIMHASH_BITS // band_count
+        end = (band + 1) * SIMHASH_BITS // band_count
+        bands.append((band, simhash >> start & ((1 << (end - start)) - 1)))
+    return bands
+
+
+class FunctionStore:
+    """
+    Factor scores of functions evaluated before, per model and score, keyed
+    by the fingerprint of their normalised syntax tree. Functions which are
+    not known exactly are matched by SimHash similarity, candidates are
+    looked up by SimHash bands instead of comparing with every entry.
+    """
+
+    def __init__(self, path: str, similarity_threshold: float):
+        self.path = path
+        self.max_distance = int((1 - similarity_threshold) * SIMHASH_BITS)
+        # near matches share at least one band as long as they differ in
+        # fewer bits than there are bands
+        self.band_count = min(self.max_distance + 1, SIMHASH_BITS)
+        self.lock = Lock()
+        self.has_changes = False
+        self.entries: Dict[Tuple[str, str], Dict[str, FunctionEntry]] = {}
+        self.bands: Dict[Tuple[str, str, int, int], List[FunctionEntry]] = {}
+
+    def _index(self, model_name: str, score_name: str, entry: FunctionEntry):
+        self.entries.setdefault((model_name, score_name), {})[entry.fingerprint] = entry
+        for band in simhash_bands(entry.simhash, self.band_count):
+            self.bands.setdefault((model_name, score_name, *band), []).append(entry)
+
+    def find(
+        self, model_name: str, score_name: str, span: FunctionSpan
+    ) -> Optional[Dict[str, float]]:
+        with self.lock:
+            exact = self.entries.get((model_name, score_name), {}).get(
+                span.fingerprint
+            )
+            if exact is not None:
+                return exact.factors
+
+            if self.max_distance < SIMHASH_BITS:
+                candidates = [
+                    entry
+                    for band in simhash_bands(span.simhash, self.band_count)
+                    for entry in self.bands.get((model_name, score_name, *band), [])
+                ]
+            else:
+                # a similarity of 0 matches functions without any common band
+                candidates = self.entries.get((model_name, score_name), {}).values()
+
+            (best, best_distance) = (None, self.max_distance + 1)
+            for entry in candidates:
+                distance = hamming_distance(entry.simhash, span.simhash)
+                if distance < best_distance:
+                    (best, best_distance) = (entry, distance)
+
+            return best.factors if best is not None else None
+
+    def add(
+        self,
+        model_name: str,
+        score_name: str,
+        span: FunctionSpan,
+        factors: Dict[str, float],
+    ):
+        with self.lock:
+            known = self.entries.get((model_name, score_name), {})
+            if span.fingerprint in known:
+                known[span.fingerprint].factors = factors
+            else:
+                self._index(
+                    model_name,
+                    score_name,
+                    FunctionEntry(span.fingerprint, span.simhash, factors),
+                )
+            self.has_changes = True
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return
+
+        if data.get("version") != FUNCTION_STORE_VERSION:
+            return
+
+        for model_name, scores in data.get("functions", {}).items():
+            for score_name, entries in scores.items():
+                for fingerprint, simhash, factors in entries:
+                    self._index(
+                        model_name,
+                        score_name,
+                        FunctionEntry(fingerprint, int(simhash, 16), factors),
+                    )
+
+    def save(self):
+        with self.lock:
+            if not self.has_changes:
+                return
+
+            functions = {}
+            for (model_name, score_name), entries in self.entries.items():
+                functions.setdefault(model_name, {})[score_name] = [
+                    [entry.fingerprint, format(entry.simhash, "x"), entry.factors]
+                    for entry in entries.values()
+                ]
+            self.has_changes = False
+
+        with open(self.path, "w") as f:
+            f.write(
+                dumps({"version": FUNCTION_STORE_VERSION, "functions": functions})
+            )
+
+
+def create_function_store(config) -> Optional[FunctionStore]:
+    if not config.function_reuse_enabled:
+        return None
+
+    function_store = FunctionStore(FUNCTION_STORE_PATH, config.function_similarity)
+    if not config.clear:
+        function_store.load()
+    return function_store
@@ -2,13 +2,22 @@ from argparse import ArgumentParser, BooleanOptionalAction, Namespace
 from yaml import safe_load
 
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
-from glob import glob
+from codepass.shard import parse_shard
+from codepass.utils import parse_duration
 
 from sys import argv
 
 
+@dataclass
+class EndpointConfig:
+    api_key_env: str
+    base_url: Optional[str]
+    token_rate_limit: int
+    weight: float
+
+
 @dataclass
 class CodepassConfig:
     paths: List[str]
@@ -26,13 +35,60 @@ class CodepassConfig:
     token_rate_limit: int
     model_name: str
     print_version: bool
+    watch_debounce: float
+    escalation_model_name: Optional[str]
+    escalation_margin: float
+    endpoints: List[EndpointConfig]
+    batch_enabled: bool
+    batch_poll_interval: float
+    shard: Optional[Tuple[int, int]]
+    gitignore_enabled: bool
+    gate_paths: List[str]
+    history_path: Optional[str]
+    sample_count: int
+    fail_fast: bool
+    max_tokens: Optional[int]
+    max_cost: Optional[float]
+    model_prices: Dict[str, Tuple[float, float]]
+    dry_run: bool
+    deadline_seconds: Optional[float]
+    function_reuse_enabled: bool
+    function_similarity: float
+    http_connections: int
+    trace_path: Optional[str]
+
+
+def enabled_score_names(config: CodepassConfig) -> List[str]:
+    score_names = []
+    if config.a_score_enabled:
+        score_names.append("a_score")
+    if config.b_score_enabled:
+        score_names.append("b_score")
+    return score_names
+
+
+def load_endpoints(
+    endpoints_config: List[dict], token_rate_limit: int
+) -> List[EndpointConfig]:
+    if len(endpoints_config) == 0:
+        endpoints_config = [{}]
+
+    return [
+        EndpointConfig(
+            api_key_env=endpoint.get("api_key_env", "CODEPASS_OPEN_AI_KEY"),
+            base_url=endpoint.get("base_url", None),
+            token_rate_limit=endpoint.get("token_rate_limit", token_rate_limit),
+            weight=endpoint.get("weight", 1),
+        )
+        for endpoint in endpoints_config
+    ]
 
 
-def find_ignore_files(ignore_paths: List[str]) -> List[str]:
-    ignore_files = []
-    for path in ignore_paths:
-        ignore_files += glob(path, recursive=True)
-    return ignore_files
+def load_model_prices(model_prices_config: dict) -> Dict[str, Tuple[float, float]]:
+    return {
+        model_name: (price.get("input", 0), price.get("output", 0))
+        for model_name, price in model_prices_config.items()
+    }
 
 
 def load_config_file() -> dict:
@@ -43,7 +99,7 @@ def load_config_file() -> dict:
         return {}
 
 
-def parser_args(default_config: dict) -> Namespace:
+def parser_args(default_config: dict, args: List[str]) -> Namespace:
     parser = ArgumentParser(
         description="Analyze code complexity and abstraction levels"
     )
@@ -148,28 +204,188 @@ def parser_args(default_config: dict) -> Namespace:
         default=False,
     )
 
+    parser.add_argument(
+        "-n",
+        "--samples",
+        help="Number of completions requested per evaluation in one call, function scores are aggregated by median",
+        type=int,
+        default=default_config.get("samples", 1),
+    )
+    parser.add_argument(
+        "-em",
+        "--escalation-model",
+        help="Stronger OpenAI model to re-score files close to a threshold or failed with the main model",
+        type=str,
+        default=default_config.get("escalation_model", None),
+    )
+    parser.add_argument(
+        "-emr",
+        "--escalation-margin",
+        help="Distance from a score threshold within which files are re-scored by the escalation model",
+        type=float,
+        default=default_config.get("escalation_margin", 0.3),
+    )
+    parser.add_argument(
+        "-ba",
+        "--batch",
+        help="Submit evaluations through the batch API instead of realtime requests",
+        type=bool,
+        action=BooleanOptionalAction,
+        default=default_config.get("batch_enabled", False),
+    )
+    parser.add_argument(
+        "-bp",
+        "--batch-poll-interval",
+        help="Seconds between batch job status checks",
+        type=float,
+        default=default_config.get("batch_poll_interval", 30),
+    )
+    parser.add_argument(
+        "-s",
+        "--shard",
+        help="Evaluate only the i-th of n weight balanced shards, e.g. 2/16",
+        type=parse_shard,
+        default=None,
+    )
+    parser.add_argument(
+        "-gi",
+        "--gitignore",
+        help="Skip files ignored by .gitignore when walking directories",
+        type=bool,
+        action=BooleanOptionalAction,
+        default=default_config.get("gitignore_enabled", True),
+    )
+    parser.add_argument(
+        "-mt",
+        "--max-tokens",
+        help="Estimated token cap of a run, changed files which do not fit keep their previous scores",
+        type=int,
+        default=default_config.get("max_tokens", None),
+    )
+    parser.add_argument(
+        "-mx",
+        "--max-cost",
+        help="Estimated cost cap of a run in USD, changed files which do not fit keep their previous scores",
+        type=float,
+        default=default_config.get("max_cost", None),
+    )
+    parser.add_argument(
+        "-dr",
+        "--dry-run",
+        help="Print the predicted wall time and token usage of the evaluation without running it",
+        action=BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "-dl",
+        "--deadline",
+        help="Time limit of the run, e.g. 10m, requests which would not be answered in time are skipped and their files keep previous scores",
+        type=parse_duration,
+        default=default_config.get("deadline", None),
+    )
+    parser.add_argument(
+        "-fr",
+        "--function-reuse",
+        help="Reuse factor scores of identical or near identical functions evaluated before, only Python files are split into functions",
+        action=BooleanOptionalAction,
+        default=default_config.get("function_reuse_enabled", False),
+    )
+    parser.add_argument(
+        "-fs",
+        "--function-similarity",
+        help="Similarity of normalised functions from which earlier factor scores are reused, between 0 and 1",
+        type=float,
+        default=default_config.get("function_similarity", 0.9),
+    )
+    parser.add_argument(
+        "-hc",
+        "--http-connections",
+        help="Size of the keep-alive connection pool shared by all requests",
+        type=int,
+        default=default_config.get("http_connections", 100),
+    )
+    parser.add_argument(
+        "-tr",
+        "--trace",
+        help="Write the time every file spends in each stage of the run to a Chrome trace event file, e.g. codepass.trace.json",
+        type=str,
+        default=default_config.get("trace", None),
+    )
+    parser.add_argument(
+        "-ff",
+        "--fail-fast",
+        help="Stop evaluating as soon as the threshold check can not change anymore",
+        type=bool,
+        action=BooleanOptionalAction,
+        default=default_config.get("fail_fast", False),
+    )
+    parser.add_argument(
+        "-g",
+        "--gate-path",
+        help="Apply the score thresholds to a directory instead of the whole project, can be repeated",
+        type=str,
+        action="append",
+        default=None,
+    )
+    parser.add_argument(
+        "-hi",
+        "--history",
+        help="Append the scores of the run to a history directory keyed by the current commit",
+        type=str,
+        nargs="?",
+        const="codepass.history",
+        default=default_config.get("history_path", None),
+    )
+    parser.add_argument(
+        "-wd",
+        "--watch-debounce",
+        help="Seconds of inactivity to wait for before re-scoring in watch mode",
+        type=float,
+        default=default_config.get("watch_debounce", 0.3),
+    )
+
     parser.add_argument("paths", nargs="*", type=str)
 
-    return parser.parse_args(argv[1:])
+    return parser.parse_args(args)
 
 
 def validate_config(config: CodepassConfig):
-    if config.max_context_size > config.token_rate_limit:
+    if any(
+        config.max_context_size > endpoint.token_rate_limit
+        for endpoint in config.endpoints
+    ):
         print("Token rate limit should be higher that max context size")
         exit(2)
 
 
-def get_config() -> CodepassConfig:
+def validate_batch_options(args):
+    # batch jobs are submitted at once and answered at once, nothing can be
+    # cancelled or skipped while they run, and every file is sent whole
+    ignored_options = [
+        option
+        for option, is_set in [
+            ("--fail-fast", args.fail_fast),
+            ("--deadline", args.deadline is not None),
+            ("--function-reuse", args.function_reuse),
+        ]
+        if is_set
+    ]
+    if args.batch and ignored_options:
+        print(f"--batch can not be combined with {', '.join(ignored_options)}")
+        exit(2)
+
+
+def get_config(cli_args: Optional[List[str]] = None) -> CodepassConfig:
     config_file = load_config_file()
 
-    args = parser_args(config_file)
+    args = parser_args(config_file, argv[1:] if cli_args is None else cli_args)
+    validate_batch_options(args)
 
-    ignore_files = find_ignore_files(config_file.get("ignore_files", []))
     file_paths = args.paths if args.paths else config_file.get("paths", [])
 
     return CodepassConfig(
         paths=file_paths,
-        ignore_files=ignore_files,
+        ignore_files=config_file.get("ignore_files", []),
         a_score_enabled=args.a_score,
         b_score_enabled=args.b_score,
         print_improvement_suggestions=args.print_improvement_suggestions,
@@ -183,4 +399,27 @@ def get_config() -> CodepassConfig:
         token_rate_limit=args.token_rate_limit,
         model_name=args.model,
         print_version=args.version,
+        watch_debounce=args.watch_debounce,
+        escalation_model_name=args.escalation_model,
+        escalation_margin=args.escalation_margin,
+        endpoints=load_endpoints(
+            config_file.get("endpoints", []), args.token_rate_limit
+        ),
+        batch_enabled=args.batch,
+        batch_poll_interval=args.batch_poll_interval,
+        shard=args.shard,
+        gitignore_enabled=args.gitignore,
+        gate_paths=args.gate_path or config_file.get("gate_paths", []),
+        history_path=args.history,
+        sample_count=max(args.samples, 1),
+        fail_fast=args.fail_fast,
+        max_tokens=args.max_tokens,
+        max_cost=args.max_cost,
+        model_prices=load_model_prices(config_file.get("model_prices", {})),
+        dry_run=args.dry_run,
+        deadline_seconds=args.deadline,
+        function_reuse_enabled=args.function_reuse,
+        function_similarity=min(max(args.function_similarity, 0), 1),
+        http_connections=args.http_connections,
+        trace_path=args.trace,
     )
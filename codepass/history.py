@@ -0,0 +1,427 @@
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from json import dumps, loads
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from colorama import Fore
+
+import os
+import subprocess
+import time
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+
+DEFAULT_HISTORY_PATH = "codepass.history"
+PATHS_FILE = "paths.txt"
+SNAPSHOTS_FILE = "snapshots.jsonl"
+ROWS_FILE = "rows.bin"
+SCORE_NAMES = ["a_score", "b_score"]
+# line count of a row marking a file or directory which was removed
+REMOVED_LINE_COUNT = -1
+
+
+def row_dtype():
+    import numpy as np
+
+    return np.dtype(
+        [
+            ("path_id", "<u4"),
+            ("line_count", "<f4"),
+            ("a_score", "<f4"),
+            ("b_score", "<f4"),
+        ]
+    )
+
+
+def directory_key(directory: str) -> str:
+    # directories are kept next to files, the trailing slash tells them apart
+    return directory.rstrip("/") + "/"
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def resolve_commit(ref: str) -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        # not a git ref, it may still be a recorded commit prefix
+        return ref
+
+
+@dataclass
+class Snapshot:
+    commit: str
+    recorded_at: float
+    row_offset: int
+    row_count: int
+    a_score: Optional[float]
+    b_score: Optional[float]
+
+
+@dataclass
+class ScoreState:
+    """
+    Scores of every path at one snapshot, indexed by path id. Paths which
+    did not exist at that point have `present` unset.
+    """
+
+    present: "ndarray"
+    line_count: "ndarray"
+    scores: Dict[str, "ndarray"]
+
+
+class HistoryStore:
+    """
+    Append-only history of per-file and per-directory scores keyed by
+    commit. Paths are interned once in paths.txt, every recorded run adds a
+    line to snapshots.jsonl and only the rows which differ from the previous
+    snapshot to rows.bin, a packed array of fixed size records. The state at
+    any snapshot is the last row of every path up to it.
+    """
+
+    def __init__(self, history_path: str):
+        self.history_path = history_path
+        self.paths: List[str] = []
+        self.path_ids: Dict[str, int] = {}
+        self.snapshots: List[Snapshot] = []
+
+        try:
+            with open(self._file(PATHS_FILE)) as f:
+                for path in f.read().splitlines():
+                    self._intern(path)
+            with open(self._file(SNAPSHOTS_FILE)) as f:
+                self.snapshots = [
+                    Snapshot(**loads(line)) for line in f.read().splitlines() if line
+                ]
+        except FileNotFoundError:
+            pass
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.history_path, name)
+
+    def _intern(self, path: str) -> int:
+        if path not in self.path_ids:
+            self.path_ids[path] = len(self.paths)
+            self.paths.append(path)
+        return self.path_ids[path]
+
+    def _rows(self, snapshot_count: int) -> "ndarray":
+        import numpy as np
+
+        if snapshot_count == 0:
+            return np.zeros(0, dtype=row_dtype())
+
+        last_snapshot = self.snapshots[snapshot_count - 1]
+        return np.fromfile(
+            self._file(ROWS_FILE),
+            dtype=row_dtype(),
+            count=last_snapshot.row_offset + last_snapshot.row_count,
+        )
+
+    def state(self, snapshot_index: int) -> ScoreState:
+        import numpy as np
+
+        rows = self._rows(snapshot_index + 1)
+        path_count = len(self.paths)
+
+        # rows are in recording order, later rows of a path overwrite earlier
+        latest = np.full(path_count, -1, dtype=np.int64)
+        latest[rows["path_id"]] = np.arange(len(rows))
+        has_row = latest >= 0
+        latest_rows = rows[latest[has_row]]
+
+        line_count = np.full(path_count, np.nan, dtype=np.float32)
+        line_count[has_row] = latest_rows["line_count"]
+
+        scores = {}
+        for score_name in SCORE_NAMES:
+            scores[score_name] = np.full(path_count, np.nan, dtype=np.float32)
+            scores[score_name][has_row] = latest_rows[score_name]
+
+        return ScoreState(
+            present=has_row & (line_count != REMOVED_LINE_COUNT),
+            line_count=line_count,
+            scores=scores,
+        )
+
+    def _report_rows(self, report: dict) -> "ndarray":
+        import numpy as np
+
+        entries = [
+            (file["file_path"], file) for file in report.get("files", [])
+        ] + [
+            (directory_key(directory), scores)
+            for directory, scores in report.get("directories", {}).items()
+        ]
+
+        rows = np.zeros(len(entries), dtype=row_dtype())
+        rows["path_id"] = [self._intern(path) for path, _ in entries]
+        rows["line_count"] = [entry.get("line_count", 0) for _, entry in entries]
+        for score_name in SCORE_NAMES:
+            rows[score_name] = [
+                entry.get(score_name, np.nan) for _, entry in entries
+            ]
+        return rows
+
+    def append(self, commit: str, report: dict) -> Snapshot:
+        import numpy as np
+
+        previous_paths_count = len(self.paths)
+        previous_state = (
+            self.state(len(self.snapshots) - 1) if self.snapshots else None
+        )
+        rows = self._report_rows(report)
+
+        if previous_state is not None:
+            path_ids = rows["path_id"]
+            is_known = path_ids < len(previous_state.present)
+            known_ids = path_ids[is_known]
+
+            is_changed = np.ones(len(rows), dtype=bool)
+            is_unchanged = previous_state.present[known_ids] & (
+                previous_state.line_count[known_ids] == rows["line_count"][is_known]
+            )
+            for score_name in SCORE_NAMES:
+                previous_scores = previous_state.scores[score_name][known_ids]
+                scores = rows[score_name][is_known]
+                is_unchanged &= (previous_scores == scores) | (
+                    np.isnan(previous_scores) & np.isnan(scores)
+                )
+            is_changed[is_known] = ~is_unchanged
+
+            is_removed = previous_state.present.copy()
+            is_removed[path_ids[is_known]] = False
+            removed_rows = np.zeros(int(is_removed.sum()), dtype=row_dtype())
+            removed_rows["path_id"] = np.flatnonzero(is_removed)
+            removed_rows["line_count"] = REMOVED_LINE_COUNT
+            for score_name in SCORE_NAMES:
+                removed_rows[score_name] = np.nan
+
+            rows = np.concatenate([rows[is_changed], removed_rows])
+
+        os.makedirs(self.history_path, exist_ok=True)
+
+        row_offset = (
+            self.snapshots[-1].row_offset + self.snapshots[-1].row_count
+            if self.snapshots
+            else 0
+        )
+        with open(self._file(ROWS_FILE), "ab") as f:
+            # drop rows of a run which was interrupted before its snapshot
+            f.truncate(row_offset * row_dtype().itemsize)
+            rows.tofile(f)
+
+        with open(self._file(PATHS_FILE), "a") as f:
+            f.writelines(path + "\n" for path in self.paths[previous_paths_count:])
+
+        snapshot = Snapshot(
+            commit=commit,
+            recorded_at=time.time(),
+            row_offset=row_offset,
+            row_count=len(rows),
+            a_score=report.get("a_score", None),
+            b_score=report.get("b_score", None),
+        )
+        with open(self._file(SNAPSHOTS_FILE), "a") as f:
+            f.write(dumps(snapshot.__dict__) + "\n")
+        self.snapshots.append(snapshot)
+
+        return snapshot
+
+    def find_snapshot(self, ref: str) -> int:
+        commit = resolve_commit(ref)
+        for index in reversed(range(len(self.snapshots))):
+            if self.snapshots[index].commit.startswith(commit):
+                return index
+        raise ValueError(f"No recorded run for {ref}")
+
+
+def record_history(history_path: str, report: dict):
+    commit = current_commit()
+    if commit is None:
+        print(Fore.YELLOW + "Not a git repository, the run is not added to history")
+        return
+
+    snapshot = HistoryStore(history_path).append(commit, report)
+    print(
+        Fore.GREEN + "History:",
+        f"{snapshot.row_count} changed entries recorded for {commit[:10]}",
+    )
+
+
+@dataclass
+class Regression:
+    path: str
+    previous_score: float
+    score: float
+
+
+def top_regressions(
+    store: HistoryStore,
+    since_index: int,
+    until_index: int,
+    score_name: str,
+    limit: int,
+    directories_only: bool = False,
+) -> List[Regression]:
+    import numpy as np
+
+    since_state = store.state(since_index)
+    until_state = store.state(until_index)
+
+    previous_scores = np.full(len(store.paths), np.nan, dtype=np.float32)
+    previous_scores[: len(since_state.present)] = np.where(
+        since_state.present, since_state.scores[score_name], np.nan
+    )
+    scores = np.where(until_state.present, until_state.scores[score_name], np.nan)
+
+    is_directory = np.array([path.endswith("/") for path in store.paths], dtype=bool)
+    differences = scores - previous_scores
+    candidates = np.flatnonzero(
+        (differences > 0) & (is_directory == directories_only)
+    )
+    order = candidates[np.argsort(-differences[candidates], kind="stable")][:limit]
+
+    return [
+        Regression(
+            path=store.paths[path_id],
+            previous_score=round(float(previous_scores[path_id]), 1),
+            score=round(float(scores[path_id]), 1),
+        )
+        for path_id in order
+    ]
+
+
+@dataclass
+class TrendPoint:
+    commit: str
+    recorded_at: float
+    score: Optional[float]
+
+
+def score_trend(store: HistoryStore, path: str, score_name: str) -> List[TrendPoint]:
+    import numpy as np
+
+    path_id = store.path_ids.get(path, store.path_ids.get(directory_key(path)))
+    if path_id is None:
+        raise ValueError(f"{path} is not in the history")
+
+    rows = store._rows(len(store.snapshots))
+    row_offsets = np.array([snapshot.row_offset for snapshot in store.snapshots])
+    path_rows = np.flatnonzero(rows["path_id"] == path_id)
+    row_snapshots = np.searchsorted(row_offsets, path_rows, side="right") - 1
+
+    # a snapshot without a row for the path keeps the score of the one before
+    latest_row = np.full(len(store.snapshots), -1, dtype=np.int64)
+    latest_row[row_snapshots] = path_rows
+    latest_row = np.maximum.accumulate(latest_row)
+
+    trend = []
+    for snapshot, row_index in zip(store.snapshots, latest_row):
+        row = rows[row_index] if row_index >= 0 else None
+        is_present = row is not None and row["line_count"] != REMOVED_LINE_COUNT
+        score = float(row[score_name]) if is_present else None
+        trend.append(
+            TrendPoint(
+                commit=snapshot.commit,
+                recorded_at=snapshot.recorded_at,
+                score=None if score is None or np.isnan(score) else round(score, 1),
+            )
+        )
+    return trend
+
+
+def run_history(args: List[str]):
+    parser = ArgumentParser(
+        prog="codepass history",
+        description="Query scores recorded with --history",
+    )
+    parser.add_argument(
+        "-p",
+        "--history-path",
+        help="Directory of the history",
+        type=str,
+        default=DEFAULT_HISTORY_PATH,
+    )
+    parser.add_argument(
+        "--score",
+        help="Score to query",
+        choices=SCORE_NAMES,
+        default="a_score",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    regressions_parser = commands.add_parser(
+        "regressions", help="Paths whose score grew the most since a commit or tag"
+    )
+    regressions_parser.add_argument("--since", type=str, required=True)
+    regressions_parser.add_argument("--until", type=str, default=None)
+    regressions_parser.add_argument("-n", "--limit", type=int, default=20)
+    regressions_parser.add_argument(
+        "-d",
+        "--directories",
+        help="List directories instead of files",
+        action="store_true",
+    )
+
+    trend_parser = commands.add_parser(
+        "trend", help="Score of a file or directory in every recorded run"
+    )
+    trend_parser.add_argument("path", type=str)
+
+    history_args = parser.parse_args(args)
+    store = HistoryStore(history_args.history_path)
+
+    if len(store.snapshots) == 0:
+        print(Fore.YELLOW + f"No runs recorded in {history_args.history_path}")
+        return
+
+    try:
+        if history_args.command == "regressions":
+            since_index = store.find_snapshot(history_args.since)
+            until_index = (
+                len(store.snapshots) - 1
+                if history_args.until is None
+                else store.find_snapshot(history_args.until)
+            )
+            regressions = top_regressions(
+                store,
+                since_index,
+                until_index,
+                history_args.score,
+                history_args.limit,
+                history_args.directories,
+            )
+            if len(regressions) == 0:
+                print(Fore.GREEN + "No regressions")
+            for regression in regressions:
+                print(
+                    Fore.YELLOW + regression.path,
+                    f"{regression.previous_score} -> {regression.score}",
+                )
+        else:
+            for point in score_trend(store, history_args.path, history_args.score):
+                recorded_at = time.strftime(
+                    "%Y-%m-%d %H:%M", time.localtime(point.recorded_at)
+                )
+                score = "-" if point.score is None else point.score
+                print(point.commit[:10], recorded_at, score)
+    except ValueError as e:
+        print(Fore.RED + str(e))
+        exit(2)
@@ -0,0 +1,178 @@
+from dataclasses import replace
+from typing import Any, Callable, Optional
+
+from codepass.read_code_files import (
+    CodeFile,
+    add_line_numbers,
+    estimate_token_count,
+)
+from codepass import trace
+
+import time
+
+MAX_RETRIES = 7
+# the parsing error is only a hint for the fix, long ones are cut
+MAX_FIX_ERROR_CHARACTERS = 1000
+TIMEOUT_ERROR_MESSAGE = (
+    "Timeout error. API is not available or file is to complex to analyse"
+)
+
+
+class ModelInvocationError(Exception):
+    pass
+
+
+def load_source(code_file: CodeFile) -> str:
+    """
+    Source of the file, a file removed or no longer readable since it was
+    found fails its evaluation instead of the run.
+    """
+    try:
+        return code_file.load_source()
+    except (OSError, UnicodeDecodeError) as e:
+        raise ModelInvocationError(f"File could not be read: {e}") from e
+
+
+def request_output_fix(
+    code_file: CodeFile, model_name: str, endpoint_pool, error
+) -> Optional[Any]:
+    """
+    Sends a malformed output, without the code, back to the model to fix
+    its formatting. Returns the parsed result, None when the fix did not
+    work out and the file has to be evaluated again.
+    """
+    from langchain_core.exceptions import OutputParserException
+    from openai import APIError
+    from codepass.llm.model import output_fix_model, thread_request_timeout
+
+    inputs = {
+        "output": error.llm_output,
+        "format_instructions": error.format_instructions,
+        "error": str(error)[:MAX_FIX_ERROR_CHARACTERS],
+    }
+    # the budget is reserved for the size of the fix request
+    fix_request = replace(
+        code_file, size=estimate_token_count("".join(inputs.values()))
+    )
+    with trace.span(trace.OUTPUT_FIX):
+        endpoint = endpoint_pool.await_budget(fix_request)
+        timeout = endpoint_pool.request_timeout(fix_request)
+        try:
+            with thread_request_timeout(timeout):
+                fixed = output_fix_model(model_name, endpoint).invoke(
+                    inputs, trace.chain_config()
+                )
+            return error.parse_fixed(fixed.content)
+        except (APIError, OutputParserException):
+            return None
+
+
+def invoke_model(
+    code_file: CodeFile,
+    build_model: Callable,
+    model_name: str,
+    endpoint_pool,
+    code: Optional[str] = None,
+) -> Any:
+    """
+    Sends the code file, or the given part of its line numbered code, to a
+    model built by build_model on one of the pool endpoints and returns the
+    parsed output. Malformed output is repaired locally, then sent back
+    alone to be fixed, and only then the code is sent again with extra
+    instructions. Timeouts depend on the request size and are retried with
+    a longer one. Failing endpoints are replaced by another one from the
+    pool. Raises ModelInvocationError when no result
+    can be obtained.
+    """
+    from langchain_core.exceptions import OutputParserException
+    from openai import (
+        APIConnectionError,
+        APITimeoutError,
+        AuthenticationError,
+        InternalServerError,
+        PermissionDeniedError,
+        RateLimitError,
+    )
+    from codepass.endpoint_pool import EvaluationCancelled
+    from codepass.llm.model import thread_request_timeout
+    from codepass.llm.output_repair import MalformedOutputError
+    from codepass.request_timeout import MAX_TIMEOUT_RETRIES
+
+    error_recovery_instructions = ""
+    timeout_retry = 0
+    retry_reason = None
+    for attempt in range(MAX_RETRIES):
+        if attempt > 0:
+            endpoint_pool.record_retry()
+        # every attempt is one span of the file, the stages nest in it
+        with trace.traced_file(code_file.path), trace.span(
+            trace.REQUEST if attempt == 0 else trace.RETRY,
+            attempt=attempt,
+            reason=retry_reason,
+        ):
+            endpoint = endpoint_pool.await_budget(code_file)
+            timeout = endpoint_pool.request_timeout(code_file, timeout_retry)
+            with trace.span(trace.READ):
+                inputs = {
+                    "code": (
+                        code
+                        if code is not None
+                        else add_line_numbers(load_source(code_file))
+                    ),
+                    "error_recovery_instructions": error_recovery_instructions,
+                }
+            sent_at = time.time()
+            try:
+                with endpoint_pool.in_flight(), thread_request_timeout(timeout):
+                    output = build_model(model_name, endpoint).invoke(
+                        inputs, trace.chain_config()
+                    )
+                endpoint_pool.report_success(endpoint)
+                endpoint_pool.observe_latency(code_file, time.time() - sent_at)
+                return output
+            except OutputParserException as e:
+                retry_reason = type(e).__name__
+                if isinstance(e, MalformedOutputError):
+                    output = request_output_fix(
+                        code_file, model_name, endpoint_pool, e
+                    )
+                    if output is not None:
+                        return output
+
+                if error_recovery_instructions == "":
+                    error_recovery_instructions = (
+                        "Be very careful in output formatting!"
+                    )
+                else:
+                    error_recovery_instructions = f"Parsing of output formatting already due to {str(e)}, please, avoid this issue again!"
+            except RateLimitError as e:
+                retry_reason = type(e).__name__
+                endpoint_pool.push_external_costs(code_file.token_count, endpoint)
+            except APITimeoutError as e:
+                retry_reason = type(e).__name__
+                # a retry which can not be answered before the deadline is
+                # skipped, the file keeps its previous scores
+                is_in_time = endpoint_pool.allows_retry(timeout)
+                is_retried = timeout_retry < MAX_TIMEOUT_RETRIES and is_in_time
+                endpoint_pool.timeouts.record_timeout(is_retried)
+                if not is_in_time:
+                    raise EvaluationCancelled()
+                if not is_retried:
+                    raise ModelInvocationError(
+                        f"{TIMEOUT_ERROR_MESSAGE}, no answer within {round(timeout)}s"
+                    )
+                timeout_retry += 1
+            except (
+                APIConnectionError,
+                AuthenticationError,
+                InternalServerError,
+                PermissionDeniedError,
+            ) as e:
+                retry_reason = type(e).__name__
+                endpoint_pool.report_failure(endpoint)
+                if not endpoint_pool.has_alternative(endpoint):
+                    raise ModelInvocationError(str(e))
+            except Exception as e:
+                raise ModelInvocationError(str(e))
+
+    raise ModelInvocationError(error_recovery_instructions)
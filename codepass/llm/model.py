@@ -1,90 +1,430 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.utils.utils import convert_to_secret_str
-from langchain_core.runnables import RunnableSerializable
-
-from codepass.llm.estimate_a_score_prompt import estimate_a_score_prompt
-from codepass.llm.estimate_b_score_prompt import estimate_b_score_prompt
-
-from codepass.llm.a_score_parser import file_a_score_parser
-from codepass.llm.b_score_parser import file_b_score_parser
-
-from codepass.llm.improvement_suggestion_parser import improvement_suggestion_parser
-from codepass.llm.improvement_suggestion_prompt import (
-    improvement_suggestion_prompt,
-)
-from threading import Lock
-from typing import Any
+from contextlib import contextmanager
+from functools import cache
+from threading import Lock, Thread, local
+from typing import Any, Callable, List, TYPE_CHECKING
 
 import os
+import time
 
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableSerializable
+    from langchain_core.prompts import ChatPromptTemplate
+    from codepass.endpoint_pool import Endpoint
 
-model_access_mutex = Lock()
-OPEN_AI_API_KEY_STR = os.getenv("CODEPASS_OPEN_AI_KEY")
-
-if OPEN_AI_API_KEY_STR is None:
-    raise ValueError("CODEPASS_OPEN_AI_KEY is not set")
+# langchain and openai are imported lazily, so runs which do not reach
+# the model (--version, unchanged files) do not pay their import time
 
-OPEN_AI_API_KEY = convert_to_secret_str(OPEN_AI_API_KEY_STR)
+model_access_mutex = Lock()
 TEMPERATURE = 0.0
 TOP_P = 1
 SEED = 3415322
+# several completions of one prompt are only useful if they can differ
+SAMPLING_TEMPERATURE = 0.7
 MAX_REQUEST_TIMEOUT = 60
+DEFAULT_API_KEY_ENV = "CODEPASS_OPEN_AI_KEY"
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_HTTP_CONNECTIONS = 100
+HTTP_KEEPALIVE_SECONDS = 60
 models_map = {}
+# prompt templates do not depend on the model, chains are built once per
+# model, endpoint and sample count
+prompts_map = {}
+chains_map = {}
+http_client = None
+http_connection_limit = DEFAULT_HTTP_CONNECTIONS
+# timeout of requests sent by the current thread
+thread_request = local()
+
+
+def get_open_ai_api_key(api_key_env: str = DEFAULT_API_KEY_ENV):
+    from langchain_core.utils.utils import convert_to_secret_str
+
+    open_ai_api_key_str = os.getenv(api_key_env)
+
+    if open_ai_api_key_str is None:
+        raise ValueError(f"{api_key_env} is not set")
+
+    return convert_to_secret_str(open_ai_api_key_str)
+
 
+def configure_http_client(connection_limit: int):
+    """
+    Sets the size of the keep-alive connection pool shared by every model,
+    has to be called before the first request.
+    """
+    global http_connection_limit
+    http_connection_limit = max(connection_limit, 1)
+
+
+@contextmanager
+def thread_request_timeout(seconds: float):
+    """
+    Requests sent by the current thread within the block time out after
+    seconds instead of MAX_REQUEST_TIMEOUT. Models and chains are shared,
+    so the timeout is applied by the HTTP client. The retries of the
+    OpenAI client share the time, so a request ends in time, e.g. before
+    the deadline.
+    """
+    thread_request.expires_at = time.monotonic() + seconds
+    try:
+        yield
+    finally:
+        thread_request.expires_at = None
+
+
+@cache
+def request_timeout_client_class():
+    """
+    HTTP client which applies the timeout of the sending thread, see
+    thread_request_timeout.
+    """
+    import httpx
+
+    class RequestTimeoutClient(httpx.Client):
+        def send(self, request, **kwargs):
+            expires_at = getattr(thread_request, "expires_at", None)
+            if expires_at is not None:
+                timeout = expires_at - time.monotonic()
+                if timeout <= 0:
+                    raise httpx.TimeoutException("Request timed out", request=request)
+                request.extensions["timeout"] = httpx.Timeout(
+                    timeout, pool=None
+                ).as_dict()
+            return super().send(request, **kwargs)
+
+    return RequestTimeoutClient
+
+
+def get_http_client():
+    """
+    One HTTP client for all models and endpoints, so connections are kept
+    alive and reused across requests instead of being opened per model.
+    Requests beyond the pool size wait for a free connection.
+    """
+    global http_client
+    if http_client is not None:
+        return http_client
+
+    import httpx
 
-def get_llm_model(model_name: str):
     with model_access_mutex:
-        if model_name not in models_map:
-            models_map[model_name] = ChatOpenAI(
+        if http_client is None:
+            http_client = request_timeout_client_class()(
+                limits=httpx.Limits(
+                    max_connections=http_connection_limit,
+                    max_keepalive_connections=http_connection_limit,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+                ),
+                timeout=httpx.Timeout(MAX_REQUEST_TIMEOUT, pool=None),
+            )
+        return http_client
+
+
+def get_llm_model(model_name: str, endpoint: "Endpoint"):
+    from langchain_openai import ChatOpenAI
+
+    client = get_http_client()
+    model_key = (model_name, endpoint.name)
+    with model_access_mutex:
+        if model_key not in models_map:
+            models_map[model_key] = ChatOpenAI(
                 model=model_name,
-                api_key=OPEN_AI_API_KEY,
+                api_key=get_open_ai_api_key(endpoint.api_key_env),
+                base_url=endpoint.base_url,
                 temperature=TEMPERATURE,
                 seed=SEED,
                 top_p=1,
                 timeout=MAX_REQUEST_TIMEOUT,
+                http_client=client,
             )
 
-        return models_map[model_name]
+        return models_map[model_key]
+
+
+def get_open_ai_client(endpoint: "Endpoint"):
+    from openai import OpenAI
+
+    return OpenAI(
+        api_key=get_open_ai_api_key(endpoint.api_key_env).get_secret_value(),
+        base_url=endpoint.base_url,
+        timeout=MAX_REQUEST_TIMEOUT,
+        http_client=get_http_client(),
+    )
+
+
+def cached(cache: dict, key, build: Callable[[], Any]) -> Any:
+    # building twice in a race is harmless, the first one is kept
+    if key not in cache:
+        value = build()
+        with model_access_mutex:
+            cache.setdefault(key, value)
+    return cache[key]
+
+
+def warm_up_endpoints(endpoints: List["Endpoint"]):
+    """
+    Imports the model libraries, builds the prompt templates and opens a
+    keep-alive connection to every endpoint. Runs in the background while
+    files are read, failures are left for the real requests to report.
+    """
+
+    def warm_up():
+        try:
+            file_a_score_prompt()
+            file_b_score_prompt()
+            improvement_suggestion_model_prompt()
+            client = get_http_client()
+        except Exception:
+            return
+
+        for endpoint in endpoints:
+            api_key = os.getenv(endpoint.api_key_env)
+            if api_key is None:
+                continue
+            # the same fallback the OpenAI client uses
+            base_url = (
+                endpoint.base_url or os.getenv("OPENAI_BASE_URL") or DEFAULT_BASE_URL
+            )
+            try:
+                client.get(
+                    f"{base_url.rstrip('/')}/models",
+                    headers={"Authorization": f"Bearer {api_key}"},
+                )
+            except Exception:
+                pass
+
+    thread = Thread(target=warm_up, daemon=True)
+    thread.start()
+    return thread
+
+
+def sampling_model(llm_model, parser, sample_count: int):
+    """
+    Asks for sample_count completions of the prompt in one request, so the
+    prompt tokens are charged once, and parses every one of them. Samples
+    with broken formatting are repaired locally or dropped as long as at
+    least one is usable.
+    """
+    from langchain_core.exceptions import OutputParserException
+    from langchain_core.runnables import RunnableLambda
+    from codepass.llm.output_repair import parse_with_repair
+
+    def sample(prompt_value, config):
+        # callbacks of the chain, e.g. of --trace, see the request as well
+        result = llm_model.generate(
+            [prompt_value.to_messages()],
+            callbacks=config.get("callbacks"),
+            n=sample_count,
+            temperature=SAMPLING_TEMPERATURE,
+        )
+
+        outputs = []
+        errors = []
+        for generation in result.generations[0]:
+            try:
+                # a fixed sample stands for the whole set when none parses
+                outputs += parse_with_repair(
+                    parser, generation.text, lambda output: [output]
+                )
+            except OutputParserException as e:
+                errors.append(e)
+
+        if len(outputs) == 0:
+            raise errors[0]
+
+        return outputs
+
+    return RunnableLambda(sample)
+
 
+def streaming_model(llm_model, parser, list_field: str, function_class):
+    """
+    Streams the answer and parses the function list while it arrives, see
+    stream_functions. Long answers keep the connection busy, so they are
+    not cut by the request timeout as long as tokens keep coming.
+    """
+    from langchain_core.runnables import RunnableLambda
+    from codepass.llm.stream_parser import stream_functions
 
-def file_a_score_model(model_name: str) -> RunnableSerializable[dict, Any]:
-    llm_model = get_llm_model(model_name)
-    return (
-        ChatPromptTemplate.from_template(
+    return RunnableLambda(
+        lambda prompt_value: stream_functions(
+            llm_model, prompt_value, list_field, function_class, parser
+        )
+    )
+
+
+def file_a_score_prompt() -> "ChatPromptTemplate":
+    from langchain_core.prompts import ChatPromptTemplate
+    from codepass.llm.estimate_a_score_prompt import estimate_a_score_prompt
+    from codepass.llm.a_score_parser import file_a_score_parser
+
+    return cached(
+        prompts_map,
+        "file_a_score",
+        lambda: ChatPromptTemplate.from_template(
             estimate_a_score_prompt,
             partial_variables={
                 "format_instructions": file_a_score_parser.get_format_instructions()
             },
-        )
-        | llm_model
-        | file_a_score_parser
+        ),
+    )
+
+
+def file_a_score_model(
+    model_name: str, endpoint: "Endpoint", sample_count: int = 1
+) -> "RunnableSerializable[dict, Any]":
+    from codepass.llm.a_score_parser import file_a_score_parser
+    from codepass.llm.output_repair import repairing_parser
+
+    def build():
+        llm_model = get_llm_model(model_name, endpoint)
+        if sample_count > 1:
+            return file_a_score_prompt() | sampling_model(
+                llm_model, file_a_score_parser, sample_count
+            )
+        return file_a_score_prompt() | llm_model | repairing_parser(file_a_score_parser)
+
+    return cached(
+        chains_map, ("a_score", model_name, endpoint.name, sample_count), build
     )
 
 
-def file_b_score_model(model_name: str) -> RunnableSerializable[dict, Any]:
-    llm_model = get_llm_model(model_name)
-    return (
-        ChatPromptTemplate.from_template(
+def file_a_score_stream_model(
+    model_name: str, endpoint: "Endpoint"
+) -> "RunnableSerializable[dict, Any]":
+    from codepass.llm.a_score_parser import (
+        FunctionAScoreEvaluation,
+        file_a_score_parser,
+    )
+
+    return cached(
+        chains_map,
+        ("a_score_stream", model_name, endpoint.name),
+        lambda: file_a_score_prompt()
+        | streaming_model(
+            get_llm_model(model_name, endpoint),
+            file_a_score_parser,
+            "function_complexities",
+            FunctionAScoreEvaluation,
+        ),
+    )
+
+
+def file_b_score_prompt() -> "ChatPromptTemplate":
+    from langchain_core.prompts import ChatPromptTemplate
+    from codepass.llm.estimate_b_score_prompt import estimate_b_score_prompt
+    from codepass.llm.b_score_parser import file_b_score_parser
+
+    return cached(
+        prompts_map,
+        "file_b_score",
+        lambda: ChatPromptTemplate.from_template(
             estimate_b_score_prompt,
             partial_variables={
                 "format_instructions": file_b_score_parser.get_format_instructions()
             },
-        )
-        | llm_model
-        | file_b_score_parser
+        ),
+    )
+
+
+def file_b_score_model(
+    model_name: str, endpoint: "Endpoint", sample_count: int = 1
+) -> "RunnableSerializable[dict, Any]":
+    from codepass.llm.b_score_parser import file_b_score_parser
+    from codepass.llm.output_repair import repairing_parser
+
+    def build():
+        llm_model = get_llm_model(model_name, endpoint)
+        if sample_count > 1:
+            return file_b_score_prompt() | sampling_model(
+                llm_model, file_b_score_parser, sample_count
+            )
+        return file_b_score_prompt() | llm_model | repairing_parser(file_b_score_parser)
+
+    return cached(
+        chains_map, ("b_score", model_name, endpoint.name, sample_count), build
+    )
+
+
+def file_b_score_stream_model(
+    model_name: str, endpoint: "Endpoint"
+) -> "RunnableSerializable[dict, Any]":
+    from codepass.llm.b_score_parser import (
+        FunctionBScoreEvaluation,
+        file_b_score_parser,
+    )
+
+    return cached(
+        chains_map,
+        ("b_score_stream", model_name, endpoint.name),
+        lambda: file_b_score_prompt()
+        | streaming_model(
+            get_llm_model(model_name, endpoint),
+            file_b_score_parser,
+            "function_abstraction_level_evaluations",
+            FunctionBScoreEvaluation,
+        ),
+    )
+
+
+def output_fix_model_prompt() -> "ChatPromptTemplate":
+    from langchain_core.prompts import ChatPromptTemplate
+    from codepass.llm.output_fix_prompt import output_fix_prompt
+
+    return cached(
+        prompts_map,
+        "output_fix",
+        lambda: ChatPromptTemplate.from_template(output_fix_prompt),
     )
 
 
-def improvement_suggestion_model(model_name: str) -> RunnableSerializable[dict, Any]:
-    llm_model = get_llm_model(model_name)
-    return (
-        ChatPromptTemplate.from_template(
+def output_fix_model(
+    model_name: str, endpoint: "Endpoint"
+) -> "RunnableSerializable[dict, Any]":
+    """
+    Asks the model to fix the formatting of an output it gave before, only
+    the output is sent, not the code.
+    """
+    return cached(
+        chains_map,
+        ("output_fix", model_name, endpoint.name),
+        lambda: output_fix_model_prompt() | get_llm_model(model_name, endpoint),
+    )
+
+
+def improvement_suggestion_model_prompt() -> "ChatPromptTemplate":
+    from langchain_core.prompts import ChatPromptTemplate
+    from codepass.llm.improvement_suggestion_prompt import (
+        improvement_suggestion_prompt,
+    )
+    from codepass.llm.improvement_suggestion_parser import (
+        improvement_suggestion_parser,
+    )
+
+    return cached(
+        prompts_map,
+        "improvement_suggestion",
+        lambda: ChatPromptTemplate.from_template(
             improvement_suggestion_prompt,
             partial_variables={
                 "format_instructions": improvement_suggestion_parser.get_format_instructions()
             },
-        )
-        | llm_model
-        | improvement_suggestion_parser
+        ),
+    )
+
+
+def improvement_suggestion_model(
+    model_name: str, endpoint: "Endpoint"
+) -> "RunnableSerializable[dict, Any]":
+    from codepass.llm.improvement_suggestion_parser import (
+        improvement_suggestion_parser,
+    )
+    from codepass.llm.output_repair import repairing_parser
+
+    return cached(
+        chains_map,
+        ("improvement_suggestion", model_name, endpoint.name),
+        lambda: improvement_suggestion_model_prompt()
+        | get_llm_model(model_name, endpoint)
+        | repairing_parser(improvement_suggestion_parser),
     )
@@ -0,0 +1,16 @@
+output_fix_prompt = """
+The output below was meant to follow the JSON format described further down, but it can not be parsed.
+Return the same content as valid JSON in that format. Keep every value as it is, only fix the formatting, and do not add any text around the JSON.
+
+{format_instructions}
+
+Please note that JSON does not support comments.
+
+Parsing error:
+
+{error}
+
+Output to fix:
+
+{output}
+"""
@@ -0,0 +1,187 @@
+from json import loads
+from typing import Any, Callable, get_args, get_origin, Optional
+
+import re
+
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel
+
+from codepass import trace
+
+FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL)
+NUMBER_PATTERN = re.compile(r"-?\d+(?:[.,]\d+)?")
+TRUE_WORDS = {"true", "yes", "y", "1"}
+FALSE_WORDS = {"false", "no", "n", "0"}
+
+
+class MalformedOutputError(OutputParserException):
+    """
+    Model output which can not be parsed even after local repair. Holds
+    what a request to fix the output alone needs: the output, the format
+    it should follow and how a fixed output becomes the chain result.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        llm_output: str,
+        format_instructions: str,
+        parse_fixed: Callable[[str], Any],
+    ):
+        super().__init__(message, llm_output=llm_output)
+        self.format_instructions = format_instructions
+        self.parse_fixed = parse_fixed
+
+
+def strip_fences(text: str) -> str:
+    match = FENCE_PATTERN.search(text)
+    if match is not None:
+        text = match.group(1)
+
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    return text[min(starts) :] if starts else text
+
+
+def drop_trailing_comma(characters: list):
+    while characters and characters[-1].isspace():
+        characters.pop()
+    if characters and characters[-1] == ",":
+        characters.pop()
+
+
+def repair_json(text: str) -> str:
+    """
+    Fixes what models commonly get wrong in JSON without changing a value:
+    code fences and text around the JSON, comments, trailing commas and
+    brackets left open by an answer which was cut off.
+    """
+    text = strip_fences(text)
+    characters = []
+    closers = []
+    (is_in_string, is_escaped) = (False, False)
+    index = 0
+
+    while index < len(text):
+        char = text[index]
+        if is_in_string:
+            if is_escaped:
+                is_escaped = False
+            elif char == "\\":
+                is_escaped = True
+            elif char == '"':
+                is_in_string = False
+        elif text.startswith("//", index):
+            line_end = text.find("\n", index)
+            index = len(text) if line_end < 0 else line_end
+            continue
+        elif text.startswith("/*", index):
+            comment_end = text.find("*/", index + 2)
+            index = len(text) if comment_end < 0 else comment_end + 2
+            continue
+        elif char == '"':
+            is_in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]":
+            drop_trailing_comma(characters)
+            if closers:
+                closers.pop()
+        characters.append(char)
+        index += 1
+
+    if is_in_string:
+        characters.append('"')
+    if closers:
+        drop_trailing_comma(characters)
+        characters += reversed(closers)
+
+    return "".join(characters)
+
+
+def coerce_value(value: Any, annotation) -> Any:
+    if isinstance(value, str) and annotation in (float, int):
+        match = NUMBER_PATTERN.search(value)
+        if match is None:
+            return value
+        number = float(match.group(0).replace(",", "."))
+        return int(number) if annotation is int else number
+
+    if isinstance(value, str) and annotation is bool:
+        word = value.strip().lower()
+        if word in TRUE_WORDS:
+            return True
+        if word in FALSE_WORDS:
+            return False
+        return value
+
+    if isinstance(value, dict) and isinstance(annotation, type):
+        if issubclass(annotation, BaseModel):
+            return coerce_values(value, annotation)
+
+    if isinstance(value, list) and get_origin(annotation) is list:
+        (item_annotation,) = get_args(annotation) or (Any,)
+        return [coerce_value(item, item_annotation) for item in value]
+
+    return value
+
+
+def coerce_values(data: dict, model_class) -> dict:
+    """
+    Turns strings holding a number or a yes/no into the type of the
+    field, like "0.3 (low)" or "Yes", which validation rejects.
+    """
+    return {
+        key: (
+            coerce_value(value, model_class.model_fields[key].annotation)
+            if key in model_class.model_fields
+            else value
+        )
+        for key, value in data.items()
+    }
+
+
+def validate_repaired(text: str, model_class) -> BaseModel:
+    """
+    Raises ValueError, pydantic ValidationError is one as well, when the
+    repaired text is still not valid.
+    """
+    data = loads(repair_json(text))
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+    return model_class.model_validate(coerce_values(data, model_class))
+
+
+def validate_with_repair(text: str, model_class) -> Optional[BaseModel]:
+    try:
+        return validate_repaired(text, model_class)
+    except ValueError:
+        return None
+
+
+def parse_with_repair(
+    parser, text: str, build_output: Callable[[Any], Any] = lambda output: output
+) -> Any:
+    """
+    Parses model output into the pydantic object of parser, repairing it
+    locally when it is malformed. The lenient parsing of parser itself is
+    not used, it silently drops whatever follows a broken part. Raises
+    MalformedOutputError when repair does not help.
+    """
+    try:
+        with trace.span(trace.PARSE):
+            output = validate_repaired(text, parser.pydantic_object)
+    except ValueError as e:
+        raise MalformedOutputError(
+            f"Failed to parse {parser.pydantic_object.__name__}: {e}",
+            text,
+            parser.get_format_instructions(),
+            lambda fixed_text: parse_with_repair(parser, fixed_text, build_output),
+        )
+
+    return build_output(output)
+
+
+def repairing_parser(parser):
+    from langchain_core.runnables import RunnableLambda
+
+    return RunnableLambda(lambda message: parse_with_repair(parser, message.content))
@@ -0,0 +1,137 @@
+from dataclasses import dataclass, field
+from typing import Any, List
+
+
+class FunctionListScanner:
+    """
+    Finds the entries of a JSON list field in text arriving piece by piece,
+    every entry is returned as soon as its closing brace arrives. Entries
+    are cut out by brace depth outside of strings, the rest of the output
+    may be broken or missing.
+    """
+
+    def __init__(self, list_field: str):
+        self.marker = f'"{list_field}"'
+        self.text = ""
+        self.position = 0
+        self.is_in_list = False
+        self.is_list_closed = False
+        self.depth = 0
+        self.is_in_string = False
+        self.is_escaped = False
+        self.entry_start = None
+
+    def feed(self, text: str) -> List[str]:
+        self.text += text
+        entries = []
+
+        if self.is_list_closed:
+            return entries
+
+        if not self.is_in_list:
+            marker_index = self.text.find(self.marker)
+            if marker_index < 0:
+                return entries
+            list_index = self.text.find("[", marker_index + len(self.marker))
+            if list_index < 0:
+                return entries
+            self.is_in_list = True
+            self.position = list_index + 1
+
+        while self.position < len(self.text):
+            char = self.text[self.position]
+            self.position += 1
+
+            if self.is_in_string:
+                if self.is_escaped:
+                    self.is_escaped = False
+                elif char == "\\":
+                    self.is_escaped = True
+                elif char == '"':
+                    self.is_in_string = False
+            elif char == '"':
+                self.is_in_string = True
+            elif char == "{":
+                if self.depth == 0:
+                    self.entry_start = self.position - 1
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0 and self.entry_start is not None:
+                    entries.append(self.text[self.entry_start : self.position])
+                    self.entry_start = None
+            elif char == "]" and self.depth == 0:
+                # later text is not looked at
+                self.is_list_closed = True
+                break
+
+        return entries
+
+
+@dataclass
+class StreamedFunctions:
+    functions: List[Any] = field(default_factory=list)
+    # the whole output was parsed and nothing is missing
+    is_complete: bool = False
+    error_message: str = ""
+
+
+def stream_functions(
+    chain, inputs: dict, list_field: str, function_class, file_parser
+) -> StreamedFunctions:
+    """
+    Streams the answer of chain, a prompt piped into a chat model, and
+    keeps every well formed function entry. A connection error or timeout
+    after the first entries arrived keeps what was received, otherwise it
+    is raised as usual.
+    """
+    from openai import APIConnectionError, APITimeoutError
+    from codepass.llm.output_repair import (
+        MalformedOutputError,
+        parse_with_repair,
+        validate_with_repair,
+    )
+
+    scanner = FunctionListScanner(list_field)
+    streamed = StreamedFunctions()
+    malformed_count = 0
+    finish_reason = None
+
+    try:
+        for chunk in chain.stream(inputs):
+            finish_reason = chunk.response_metadata.get("finish_reason", finish_reason)
+            for entry in scanner.feed(chunk.content):
+                function = validate_with_repair(entry, function_class)
+                if function is None:
+                    malformed_count += 1
+                else:
+                    streamed.functions.append(function)
+    except (APIConnectionError, APITimeoutError) as e:
+        if len(streamed.functions) == 0:
+            raise
+        streamed.error_message = str(e)
+        return streamed
+
+    # closing the brackets of a cut off answer would drop the functions
+    # which did not make it, they are asked for again instead
+    if finish_reason == "length" and len(streamed.functions) > 0:
+        streamed.error_message = "Answer was cut off at the output token limit"
+        return streamed
+
+    try:
+        return parse_with_repair(
+            file_parser,
+            scanner.text,
+            lambda file_evaluation: StreamedFunctions(
+                functions=getattr(file_evaluation, list_field), is_complete=True
+            ),
+        )
+    except MalformedOutputError as e:
+        if len(streamed.functions) == 0:
+            raise
+        streamed.error_message = (
+            f"{malformed_count} malformed entries, output was cut or broken"
+            if malformed_count > 0
+            else str(e)
+        )
+        return streamed
@@ -1,25 +1,57 @@
 from importlib.metadata import version
 from codepass.read_code_files import read_files, CodeFile
-
-from codepass.token_budget_estimator import TokenBudgetEstimator
-from codepass.scores.evaluate_a_score import evaluate_a_score
+from codepass.discover_files import create_file_discovery, normalize_path
+from codepass.fail_fast import FailFastGate
+from codepass.spend_limit import mark_stale, plan_spend
+from codepass.scheduler import Simulation, plan_dispatch
+from codepass.deadline import Deadline
+from codepass.deduplicate import fan_out_results, group_by_hash
+from codepass.score_index import DirectoryRollup
+
+from codepass.endpoint_pool import create_endpoint_pool
+from codepass.scores.evaluate_a_score import evaluate_a_score, AScoreEvaluationResult
 from codepass.scores.evaluate_b_score import evaluate_b_score
-from codepass.scores.suggest_improvements import suggest_improvements
+from codepass.scores.suggest_improvements import (
+    suggest_improvements,
+    ImprovementSuggestionResult,
+)
 from codepass.file_report import FileReport
+from codepass.llm.model import (
+    configure_http_client,
+    get_open_ai_api_key,
+    warm_up_endpoints,
+)
 from codepass.parallel_runtime import ParallelRuntime
+from codepass.batch_runtime import (
+    BatchRuntime,
+    A_SCORE,
+    B_SCORE,
+    IMPROVEMENT_SUGGESTION,
+)
 from codepass.utils import partition
-from codepass.get_report_file import get_report_files
-
-import asyncio
+from codepass import trace
+from codepass.shard import select_shard
+from codepass.get_report_file import get_report_files, PrevReport
 
 from colorama import Fore
 
 import time
 
-from codepass.get_config import get_config, CodepassConfig
+from codepass.get_config import get_config, enabled_score_names, CodepassConfig
 import time
-from typing import Dict, List
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+from collections import Counter
 from json import dumps
+from sys import argv
+
+if TYPE_CHECKING:
+    from codepass.function_store import FunctionStore
+
+
+# below that reading files is quicker than importing the model libraries,
+# connections are opened by the first requests instead
+WARM_UP_MIN_FILES = 1000
 
 
 def score_absolute_difference(a: float, b: float) -> float:
@@ -44,102 +76,278 @@ def combine_report_and_files(
         lambda file: file.token_count < config.max_context_size,
     )
 
-    (_, changed_files) = partition(
-        accepted_files,
-        lambda file: file.path in report_files
-        and report_files[file.path].hash == file.hash
-        and not config.clear,
-    )
+    def is_unchanged(file: CodeFile) -> bool:
+        with trace.span(trace.REPORT_LOOKUP, file.path):
+            return (
+                file.path in report_files
+                and report_files[file.path].hash == file.hash
+                and not config.clear
+            )
+
+    (_, changed_files) = partition(accepted_files, is_unchanged)
     return (changed_files, large_files)
 
 
-def run_evaluation(
-    token_budget_estimator, changed_files: List[CodeFile], config: CodepassConfig
+def plan_score_requests(
+    config: CodepassConfig, endpoint_pool, changed_files: List[CodeFile]
+) -> Tuple[List[Tuple[Callable, CodeFile]], Simulation]:
+    """
+    Score requests of the changed files in the dispatch order with the
+    shortest predicted wall time under the endpoint token budgets.
+    """
+    requests = []
+    if config.a_score_enabled:
+        requests += [(evaluate_a_score, code_file) for code_file in changed_files]
+    if config.b_score_enabled:
+        requests += [(evaluate_b_score, code_file) for code_file in changed_files]
+
+    (order, simulation) = plan_dispatch(
+        [code_file for _, code_file in requests],
+        [
+            endpoint.token_budget_estimator.token_budget
+            for endpoint in endpoint_pool.endpoints
+        ],
+        config.sample_count,
+    )
+    return ([requests[index] for index in order], simulation)
+
+
+def print_dry_run(config: CodepassConfig, endpoint_pool, changed_files):
+    (evaluated_files, _) = group_by_hash(changed_files)
+    (_, simulation) = plan_score_requests(config, endpoint_pool, evaluated_files)
+    print(
+        Fore.GREEN + "Dry run:",
+        f"{simulation.request_count} score requests,",
+        f"about {simulation.tokens} tokens",
+    )
+    print(
+        Fore.GREEN + "Predicted wall time:",
+        f"{round(simulation.wall_seconds, 1)}s,",
+        f"{simulation.order_name} order",
+    )
+    if (
+        config.deadline_seconds is not None
+        and simulation.wall_seconds > config.deadline_seconds
+    ):
+        print(
+            Fore.YELLOW + "The deadline is likely to be missed,",
+            "files which are not evaluated in time keep their previous scores",
+        )
+    if config.improvement_suggestions_enabled or config.escalation_model_name:
+        print(
+            Fore.YELLOW
+            + "Suggestions and escalations depend on the scores and are not included"
+        )
+
+
+def print_deadline_skips(
+    changed_files: List[CodeFile], report_files: Dict[str, FileReport]
 ):
-    parallel_runtime = ParallelRuntime(token_budget_estimator)
+    skipped_count = sum(
+        1
+        for code_file in changed_files
+        if getattr(report_files.get(code_file.path), "stale", False)
+    )
+    if skipped_count > 0:
+        print(
+            Fore.YELLOW + "Deadline:",
+            f"{skipped_count} changed files could not be evaluated in time",
+            "and keep their previous scores",
+        )
 
-    analyze_files = changed_files.copy()
 
-    analyze_files.sort(key=lambda file: file.token_count, reverse=True)
+def print_timeouts(endpoint_pool):
+    timeouts = endpoint_pool.timeouts
+    if timeouts.timeout_count > 0:
+        print(
+            Fore.YELLOW + "Request timeouts:",
+            f"{timeouts.timeout_count}, {timeouts.retried_count} retried",
+            f"with a longer timeout, {timeouts.failed_count} gave up",
+        )
 
-    if config.a_score_enabled:
-        for code_file in analyze_files:
-            parallel_runtime.add_task(
-                code_file.token_count,
-                evaluate_a_score,
-                code_file,
-                config.model_name,
-                token_budget_estimator,
-            )
 
-    if config.b_score_enabled:
-        for code_file in analyze_files:
-            parallel_runtime.add_task(
-                code_file.token_count,
-                evaluate_b_score,
-                code_file,
-                config.model_name,
-                token_budget_estimator,
-            )
+def run_evaluation(
+    endpoint_pool,
+    changed_files: List[CodeFile],
+    config: CodepassConfig,
+    fail_fast_gate: Optional[FailFastGate] = None,
+    function_store: Optional["FunctionStore"] = None,
+    on_final_result: Optional[Callable[[Any], None]] = None,
+    show_progress: bool = True,
+):
+    """
+    Evaluates the changed files and returns every result. on_final_result
+    is called with each result as soon as it arrives, except for scores
+    which are evaluated again by the escalation model, only the escalated
+    score is passed on. It is not called in batch mode.
+    """
+    if len(changed_files) == 0:
+        return []
+
+    # fail before scheduling anything instead of once per file
+    for endpoint in endpoint_pool.endpoints:
+        get_open_ai_api_key(endpoint.api_key_env)
+
+    if config.batch_enabled:
+        return run_batch_evaluation(endpoint_pool, changed_files, config)
+
+    parallel_runtime = ParallelRuntime(endpoint_pool, show_progress)
+
+    (requests, _) = plan_score_requests(config, endpoint_pool, changed_files)
+    for evaluate_score, code_file in requests:
+        parallel_runtime.add_task(
+            code_file.token_count,
+            evaluate_score,
+            code_file,
+            config.model_name,
+            endpoint_pool,
+            config.sample_count,
+            function_store,
+        )
 
-    return parallel_runtime.run_tasks()
+    on_result = on_final_result
+    if config.improvement_suggestions_enabled:
+        on_result = schedule_suggestion_improvement(
+            config, endpoint_pool, parallel_runtime, changed_files, on_result
+        )
 
+    if config.escalation_model_name is not None:
+        on_result = schedule_escalation(
+            config,
+            endpoint_pool,
+            parallel_runtime,
+            changed_files,
+            on_result,
+            function_store,
+        )
 
-def combine_report_files(
-    config, complexity_result, changed_files, large_files, report_files
+    if fail_fast_gate is not None:
+        on_result = fail_fast_gate.wrap(parallel_runtime, on_result)
+
+    return parallel_runtime.run_tasks(on_result)
+
+
+def run_batch_evaluation(
+    endpoint_pool, changed_files: List[CodeFile], config: CodepassConfig
 ):
-    new_report_files: Dict[str, FileReport] = {
-        result.path: FileReport(result.path, result.hash) for result in changed_files
-    }
+    # batch jobs are not limited by the token rate, any endpoint will do
+    endpoint = endpoint_pool.endpoints[0]
+    code_files = {file.path: file for file in changed_files}
 
-    for large_file in large_files:
-        if large_file.path not in report_files:
-            report_files[large_file.path] = FileReport(large_file.path, large_file.hash)
-        report_files[large_file.path].mark_as_large(large_file, config)
+    batch_runtime = BatchRuntime(
+        endpoint, config.batch_poll_interval, config.sample_count
+    )
+    for code_file in changed_files:
+        if config.a_score_enabled:
+            batch_runtime.add_task(A_SCORE, code_file, config.model_name)
+        if config.b_score_enabled:
+            batch_runtime.add_task(B_SCORE, code_file, config.model_name)
 
-    for result in complexity_result:
-        new_report_files[result.file_path].add_data(result, config)
+    results = batch_runtime.run_tasks()
 
-    report_files.update(new_report_files)
+    if config.escalation_model_name is not None:
+        escalation_runtime = BatchRuntime(
+            endpoint, config.batch_poll_interval, config.sample_count
+        )
+        for result in results:
+            if is_escalation_needed(config, result):
+                escalation_runtime.add_task(
+                    A_SCORE if isinstance(result, AScoreEvaluationResult) else B_SCORE,
+                    code_files[result.file_path],
+                    config.escalation_model_name,
+                )
+        results += escalation_runtime.run_tasks()
 
-    return list(report_files.values())
+    if config.improvement_suggestions_enabled:
+        (final_results, _) = split_screening_results(config, results)
+        need_improvements_file_names = dict.fromkeys(
+            result.file_path
+            for result in final_results
+            if is_improvement_needed(config, result)
+        )
+
+        suggestion_runtime = BatchRuntime(endpoint, config.batch_poll_interval)
+        for file_name in need_improvements_file_names:
+            suggestion_runtime.add_task(
+                IMPROVEMENT_SUGGESTION, code_files[file_name], config.model_name
+            )
+        results += suggestion_runtime.run_tasks()
 
+    return results
 
-def aggregate_a_score(report_files_list: List[FileReport]):
-    total_lines = sum(
-        [
-            f.line_count
-            for f in report_files_list
-            if (hasattr(f, "a_score") and f.a_score > 0)
-        ]
+
+def split_screening_results(config, complexity_result):
+    if config.escalation_model_name is None:
+        return (complexity_result, [])
+
+    def is_escalated(result):
+        return result.model_name == config.escalation_model_name
+
+    escalated_results = set(
+        (type(result), result.file_path)
+        for result in complexity_result
+        if is_escalated(result)
     )
 
-    if total_lines == 0:
-        return 0
+    return partition(
+        complexity_result,
+        lambda result: is_escalated(result)
+        or (type(result), result.file_path) not in escalated_results,
+    )
 
-    total_a_score = sum([f.a_score * f.line_count for f in report_files_list])
-    return round(total_a_score / total_lines, 1)
 
+def combine_report_files(
+    config, complexity_result, changed_files, large_files, report_files
+):
+    (complexity_result, screening_result) = split_screening_results(
+        config, complexity_result
+    )
 
-def aggregate_b_score(report_files_list: List[FileReport]):
-    total_lines = sum(
-        [
-            f.line_count
-            for f in report_files_list
-            if (hasattr(f, "b_score") and f.b_score > 0)
-        ]
+    # files missing a score, e.g. cancelled by --fail-fast or --deadline,
+    # keep their previous entry and hash, so the next run evaluates them again
+    result_counts = Counter(result.file_path for result in complexity_result)
+    new_report_files: Dict[str, FileReport] = {
+        file.path: FileReport(file.path, file.hash)
+        for file in changed_files
+        if result_counts[file.path] == len(enabled_score_names(config))
+    }
+    complexity_result = [
+        result for result in complexity_result if result.file_path in new_report_files
+    ]
+    screening_result = [
+        result for result in screening_result if result.file_path in new_report_files
+    ]
+
+    mark_stale(
+        [file for file in changed_files if file.path not in new_report_files],
+        report_files,
     )
 
-    if total_lines == 0:
-        return 0
+    for large_file in large_files:
+        with trace.span(trace.REPORT_MERGE, large_file.path):
+            if large_file.path not in report_files:
+                report_files[large_file.path] = FileReport(
+                    large_file.path, large_file.hash
+                )
+            report_files[large_file.path].mark_as_large(large_file, config)
 
-    total_b_score = sum([f.b_score * f.line_count for f in report_files_list])
-    return round(total_b_score / total_lines, 1)
+    for result in complexity_result:
+        with trace.span(trace.REPORT_MERGE, result.file_path):
+            new_report_files[result.file_path].add_data(result, config)
+
+    for result in screening_result:
+        with trace.span(trace.REPORT_MERGE, result.file_path):
+            new_report_files[result.file_path].add_screening_data(result)
+
+    report_files.update(new_report_files)
+
+    return list(report_files.values())
 
 
 def aggregate_report(
     report_files_list: List[FileReport],
     config: CodepassConfig,
+    directory_rollup: Optional[DirectoryRollup] = None,
 ):
     file_count = len(report_files_list)
     report = {
@@ -147,16 +355,18 @@ def aggregate_report(
         "version": version("codepass"),
     }
 
-    if config.a_score_enabled:
-        report["a_score"] = aggregate_a_score(report_files_list)
+    if directory_rollup is None:
+        directory_rollup = DirectoryRollup.from_report_files(report_files_list)
 
-    if config.b_score_enabled:
-        report["b_score"] = aggregate_b_score(report_files_list)
+    for score_name in enabled_score_names(config):
+        report[score_name] = directory_rollup.total.score(score_name)
 
     report["recommendation_count"] = sum(
         1 for f in report_files_list if hasattr(f, "improvement_suggestion")
     )
 
+    report["directories"] = directory_rollup.to_dict(enabled_score_names(config))
+
     report["files"] = [file.__dict__ for file in report_files_list]
 
     return report
@@ -180,42 +390,215 @@ def is_improvement_needed(config, result) -> bool:
     return False
 
 
-def generate_suggestion_improvement(
-    config, token_budget_estimator, complexity_result, changed_files, report_files
+def schedule_suggestion_improvement(
+    config, endpoint_pool, parallel_runtime, changed_files, on_result=None
 ):
-    need_improvements_file_names = set(
-        result.file_path
-        for result in complexity_result
-        if is_improvement_needed(config, result)
-    )
-    need_improvements_files = [
-        file for file in changed_files if file.path in need_improvements_file_names
-    ]
+    code_files = {file.path: file for file in changed_files}
+    scheduled_file_names = set()
+    scheduled_file_names_lock = Lock()
 
-    if len(need_improvements_files) == 0:
-        return
+    def on_score_result(result):
+        if on_result is not None:
+            on_result(result)
+
+        if isinstance(result, ImprovementSuggestionResult):
+            return
 
-    print("Generating improvement suggestions")
+        if not is_improvement_needed(config, result):
+            return
 
-    parallel_runtime = ParallelRuntime(token_budget_estimator)
+        with scheduled_file_names_lock:
+            if result.file_path in scheduled_file_names:
+                return
+            scheduled_file_names.add(result.file_path)
 
-    for code_file in need_improvements_files:
+        code_file = code_files[result.file_path]
         parallel_runtime.add_task(
             code_file.token_count,
             suggest_improvements,
             code_file,
             config.model_name,
-            token_budget_estimator,
+            endpoint_pool,
+        )
+
+    return on_score_result
+
+
+def is_escalation_needed(config, result) -> bool:
+    if isinstance(result, ImprovementSuggestionResult):
+        return False
+
+    if result.model_name == config.escalation_model_name:
+        return False
+
+    if result.error_message:
+        return True
+
+    if isinstance(result, AScoreEvaluationResult):
+        return (
+            score_absolute_difference(result.a_score, config.a_score_threshold)
+            <= config.escalation_margin
         )
 
-    suggestion_improvements = parallel_runtime.run_tasks()
+    return (
+        score_absolute_difference(result.b_score, config.b_score_threshold)
+        <= config.escalation_margin
+    )
+
+
+def schedule_escalation(
+    config,
+    endpoint_pool,
+    parallel_runtime,
+    changed_files,
+    on_result,
+    function_store: Optional["FunctionStore"] = None,
+):
+    code_files = {file.path: file for file in changed_files}
+
+    def on_screening_result(result):
+        if not is_escalation_needed(config, result):
+            if on_result is not None:
+                on_result(result)
+            return
+
+        evaluate_score = (
+            evaluate_a_score
+            if isinstance(result, AScoreEvaluationResult)
+            else evaluate_b_score
+        )
+        code_file = code_files[result.file_path]
+        parallel_runtime.add_task(
+            code_file.token_count,
+            evaluate_score,
+            code_file,
+            config.escalation_model_name,
+            endpoint_pool,
+            config.sample_count,
+            function_store,
+        )
+
+    return on_screening_result
+
 
+def add_suggestion_improvements(suggestion_improvements, report_files):
     for suggestion in suggestion_improvements:
-        report_files[suggestion.file_path].add_improvement_suggestions(suggestion)
+        if suggestion.file_path in report_files:
+            report_files[suggestion.file_path].add_improvement_suggestions(suggestion)
+
+
+def evaluate_changed_files(
+    config,
+    endpoint_pool,
+    changed_files,
+    large_files,
+    report_files,
+    fail_fast_gate: Optional[FailFastGate] = None,
+    function_store: Optional["FunctionStore"] = None,
+):
+    # identical files are evaluated once and share the results
+    (evaluated_files, twin_paths) = group_by_hash(changed_files)
+    duplicate_count = len(changed_files) - len(evaluated_files)
+    if duplicate_count > 0:
+        print(Fore.GREEN + "Identical files evaluated once:", duplicate_count)
+
+    evaluation_result = fan_out_results(
+        run_evaluation(
+            endpoint_pool, evaluated_files, config, fail_fast_gate, function_store
+        ),
+        twin_paths,
+    )
+    # a file edited while it was evaluated lost its hash, the identical
+    # files got the scores of its new source, too
+    edited_paths = set(
+        twin_path
+        for code_file in evaluated_files
+        if code_file.hash == ""
+        for twin_path in twin_paths[code_file.path]
+    )
+    for code_file in changed_files:
+        if code_file.path in edited_paths:
+            code_file.hash = ""
+
+    (suggestion_improvements, complexity_result) = partition(
+        evaluation_result,
+        lambda result: isinstance(result, ImprovementSuggestionResult),
+    )
+
+    report_files_list = combine_report_files(
+        config,
+        complexity_result,
+        changed_files,
+        large_files,
+        report_files,
+    )
+
+    add_suggestion_improvements(suggestion_improvements, report_files)
 
+    return report_files_list
 
-def save_report(report):
-    with open("codepass.report.json", "w") as f:
+
+def keep_shard_files(config, code_files, changed_files, large_files, report_files):
+    (shard_changed_files, owned_paths) = select_shard(
+        config.shard, code_files, changed_files
+    )
+
+    for file_path in list(report_files):
+        if file_path not in owned_paths:
+            del report_files[file_path]
+
+    shard_large_files = [file for file in large_files if file.path in owned_paths]
+
+    return (shard_changed_files, shard_large_files)
+
+
+def is_gate_passed(config: CodepassConfig, report: dict) -> bool:
+    thresholds = {
+        "a_score": config.a_score_threshold,
+        "b_score": config.b_score_threshold,
+    }
+    directories = report.get("directories", {})
+
+    is_passed = True
+    for gate_path in config.gate_paths:
+        directory = directories.get(normalize_path(gate_path))
+        if directory is None:
+            print(Fore.YELLOW + f"No evaluated files in {gate_path}")
+            continue
+
+        for score_name in enabled_score_names(config):
+            score = directory.get(score_name, 0)
+            label = "A score" if score_name == "a_score" else "B score"
+            if score > thresholds[score_name]:
+                print(Fore.RED + f"{label} of {gate_path} is too high: {score}")
+                is_passed = False
+            else:
+                print(Fore.GREEN + f"{label} of {gate_path}:", score)
+
+    return is_passed
+
+
+def check_thresholds(config: CodepassConfig, report: dict):
+    """
+    Exits with 1 when a score of the report, or of a gate path when any is
+    given, is above its threshold.
+    """
+    if len(config.gate_paths) > 0:
+        if not is_gate_passed(config, report):
+            exit(1)
+        return
+
+    if config.a_score_enabled and report.get("a_score", 0) > config.a_score_threshold:
+        print(Fore.RED + "A score is too high")
+        exit(1)
+
+    if config.b_score_enabled and report.get("b_score", 0) > config.b_score_threshold:
+        print(Fore.RED + "B score is too high")
+        exit(1)
+
+
+def save_report(report, report_path: str = "codepass.report.json"):
+    with open(report_path, "w") as f:
         f.write(
             dumps(
                 report,
@@ -273,57 +656,7 @@ def print_errors(report_files_list):
             print()
 
 
-async def main():
-    start = time.time()
-    config = get_config()
-
-    if config.print_version:
-        print(version("codepass"))
-        exit(0)
-
-    if validate_config(config):
-        print("No analysis enabled")
-        return
-
-    code_files = read_files(config.paths, config.ignore_files)
-    previous_report = get_report_files(code_files)
-
-    report_files = previous_report.files
-
-    (changed_files, large_files) = combine_report_and_files(
-        config, code_files, report_files
-    )
-
-    print(Fore.GREEN + "Analyzing files:", len(code_files))
-    print(Fore.GREEN + "Changed files:", len(changed_files))
-    print(
-        Fore.GREEN + f"Estimated token count: {upper_estimate_token_count(code_files)}"
-    )
-    print("Evaluate scores")
-    token_budget_estimator = TokenBudgetEstimator(config.token_rate_limit)
-    complexity_result = run_evaluation(token_budget_estimator, changed_files, config)
-
-    report_files_list = combine_report_files(
-        config,
-        complexity_result,
-        changed_files,
-        large_files,
-        report_files,
-    )
-
-    if config.improvement_suggestions_enabled:
-        generate_suggestion_improvement(
-            config,
-            token_budget_estimator,
-            complexity_result,
-            changed_files,
-            report_files,
-        )
-
-    end = time.time()
-
-    report = aggregate_report(report_files_list, config)
-
+def print_scores(report, previous_report: PrevReport):
     print()
     if report.get("a_score", 0) > 0:
         if (
@@ -370,10 +703,113 @@ async def main():
         else:
             print(Fore.GREEN + "B score:", report["b_score"])
 
+
+def main(args: List[str]):
+    start = time.time()
+    config = get_config(args)
+
+    if config.print_version:
+        print(version("codepass"))
+        exit(0)
+
+    if validate_config(config):
+        print("No analysis enabled")
+        return
+
+    if config.trace_path is not None:
+        trace.start_tracing()
+
+    file_paths = create_file_discovery(config).discover()
+    endpoint_pool = create_endpoint_pool(config)
+    configure_http_client(config.http_connections)
+    if len(file_paths) >= WARM_UP_MIN_FILES and not config.dry_run:
+        warm_up_endpoints(endpoint_pool.endpoints)
+
+    code_files = read_files(file_paths)
+    with trace.span(trace.REPORT_LOAD):
+        previous_report = get_report_files(code_files)
+
+    report_files = previous_report.files
+
+    (changed_files, large_files) = combine_report_and_files(
+        config, code_files, report_files
+    )
+
+    if config.shard is not None:
+        (changed_files, large_files) = keep_shard_files(
+            config, code_files, changed_files, large_files, report_files
+        )
+
+    if config.max_tokens is not None or config.max_cost is not None:
+        try:
+            (changed_files, stale_files) = plan_spend(
+                config, changed_files, report_files
+            )
+        except ValueError as e:
+            print(Fore.RED + str(e))
+            exit(2)
+        mark_stale(stale_files, report_files)
+
+    print(Fore.GREEN + "Analyzing files:", len(code_files))
+    print(Fore.GREEN + "Changed files:", len(changed_files))
+    print(
+        Fore.GREEN + f"Estimated token count: {upper_estimate_token_count(code_files)}"
+    )
+    fail_fast_gate = None
+    if config.fail_fast and config.shard is None and len(config.gate_paths) == 0:
+        fail_fast_gate = FailFastGate(config, changed_files, large_files, report_files)
+
+    if config.dry_run:
+        print_dry_run(config, endpoint_pool, changed_files)
+        return
+
+    if config.deadline_seconds is not None:
+        endpoint_pool.set_deadline(
+            Deadline(start + config.deadline_seconds, config.sample_count)
+        )
+
+    print("Evaluate scores")
+    function_store = None
+    if config.function_reuse_enabled:
+        from codepass.function_store import create_function_store
+
+        function_store = create_function_store(config)
+
+    report_files_list = evaluate_changed_files(
+        config,
+        endpoint_pool,
+        changed_files,
+        large_files,
+        report_files,
+        fail_fast_gate,
+        function_store,
+    )
+    if function_store is not None:
+        function_store.save()
+
+    end = time.time()
+
+    if config.deadline_seconds is not None:
+        print_deadline_skips(changed_files, report_files)
+    print_timeouts(endpoint_pool)
+
+    report = aggregate_report(report_files_list, config)
+
+    print_scores(report, previous_report)
+
     print(Fore.GREEN + f"Done:", f"{str(round(end - start, 1))}s")
 
     save_report(report)
 
+    if config.trace_path is not None:
+        trace.stop_tracing(config.trace_path)
+        print(Fore.GREEN + "Trace saved to", config.trace_path)
+
+    if config.history_path is not None and config.shard is None:
+        from codepass.history import record_history
+
+        record_history(config.history_path, report)
+
     if (
         config.print_improvement_suggestions
         and report.get("recommendation_count", 0) > 0
@@ -383,14 +819,41 @@ async def main():
     if config.error_info_enabled:
         print_errors(report_files_list)
 
-    if config.a_score_enabled and report.get("a_score", 0) > config.a_score_threshold:
-        print(Fore.RED + "A score is too high")
-        exit(1)
+    if config.shard is not None:
+        # a shard only sees part of the files, codepass merge gates on the
+        # merged report
+        return
 
-    if config.b_score_enabled and report.get("b_score", 0) > config.b_score_threshold:
-        print(Fore.RED + "B score is too high")
-        exit(1)
+    if fail_fast_gate is not None and fail_fast_gate.verdict is not None:
+        # cancelled files still hold their previous scores in the report,
+        # the verdict is taken from the bounds instead
+        if fail_fast_gate.verdict is False:
+            failed_score_name = fail_fast_gate.failed_score_name
+            label = "A score" if failed_score_name == "a_score" else "B score"
+            print(Fore.RED + f"{label} is too high")
+            exit(1)
+        return
+
+    check_thresholds(config, report)
 
 
 def run_main():
-    asyncio.run(main())
+    if argv[1:2] == ["watch"]:
+        from codepass.watch import run_watch
+
+        run_watch(argv[2:])
+        return
+
+    if argv[1:2] == ["history"]:
+        from codepass.history import run_history
+
+        run_history(argv[2:])
+        return
+
+    if argv[1:2] == ["merge"]:
+        from codepass.merge_reports import run_merge
+
+        run_merge(argv[2:])
+        return
+
+    main(argv[1:])
@@ -0,0 +1,128 @@
+from argparse import ArgumentParser
+from dataclasses import replace
+from importlib.metadata import version
+from json import loads
+from typing import List
+
+from colorama import Fore
+
+from codepass.file_report import FileReport
+from codepass.get_config import CodepassConfig, get_config, load_config_file
+from codepass.main import check_thresholds, save_report
+from codepass.score_index import DirectoryRollup
+
+
+def load_report(report_path: str) -> dict:
+    with open(report_path) as f:
+        return loads(f.read())
+
+
+def merge_reports(reports: List[dict]) -> dict:
+    files = {}
+    for report in reports:
+        for file in report.get("files", []):
+            files[file.get("file_path", "")] = FileReport.load_from_dict(file)
+
+    report_files_list = [files[file_path] for file_path in sorted(files)]
+
+    merged_report = {
+        "file_count": len(report_files_list),
+        "version": version("codepass"),
+    }
+
+    directory_rollup = DirectoryRollup.from_report_files(report_files_list)
+    score_names = [
+        score_name
+        for score_name in ["a_score", "b_score"]
+        if any(score_name in report for report in reports)
+    ]
+    for score_name in score_names:
+        merged_report[score_name] = directory_rollup.total.score(score_name)
+
+    merged_report["recommendation_count"] = sum(
+        1 for f in report_files_list if hasattr(f, "improvement_suggestion")
+    )
+
+    merged_report["directories"] = directory_rollup.to_dict(score_names)
+
+    merged_report["files"] = [file.__dict__ for file in report_files_list]
+
+    return merged_report
+
+
+def merge_config(merge_args, default_config: dict, report: dict) -> CodepassConfig:
+    # the scores of the shards are checked, whichever they had enabled
+    return replace(
+        get_config([]),
+        a_score_enabled="a_score" in report,
+        b_score_enabled="b_score" in report,
+        a_score_threshold=merge_args.a_score_threshold,
+        b_score_threshold=merge_args.b_score_threshold,
+        gate_paths=merge_args.gate_path or default_config.get("gate_paths", []),
+    )
+
+
+def run_merge(args: List[str]):
+    parser = ArgumentParser(
+        prog="codepass merge",
+        description="Merge reports of sharded runs and recompute the aggregates",
+    )
+    parser.add_argument("reports", nargs="+", type=str)
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Path of the merged report",
+        type=str,
+        default="codepass.report.json",
+    )
+    parser.add_argument(
+        "-hi",
+        "--history",
+        help="Append the merged scores to a history directory keyed by the current commit",
+        type=str,
+        nargs="?",
+        const="codepass.history",
+        default=None,
+    )
+    default_config = load_config_file()
+    parser.add_argument(
+        "-at",
+        "--a-score-threshold",
+        help="Threshold for A score",
+        type=float,
+        default=default_config.get("a_score_threshold", 3),
+    )
+    parser.add_argument(
+        "-bt",
+        "--b-score-threshold",
+        help="Threshold for B score",
+        type=float,
+        default=default_config.get("b_score_threshold", 2),
+    )
+    parser.add_argument(
+        "-g",
+        "--gate-path",
+        help="Apply the score thresholds to a directory instead of the whole project, can be repeated",
+        type=str,
+        action="append",
+        default=None,
+    )
+    merge_args = parser.parse_args(args)
+
+    report = merge_reports([load_report(path) for path in merge_args.reports])
+    save_report(report, merge_args.output)
+
+    if merge_args.history is not None:
+        from codepass.history import record_history
+
+        record_history(merge_args.history, report)
+
+    print(Fore.GREEN + "Merged reports:", len(merge_args.reports))
+    print(Fore.GREEN + "Files:", report["file_count"])
+    if "a_score" in report:
+        print("A score:", report["a_score"])
+    if "b_score" in report:
+        print(Fore.GREEN + "B score:", report["b_score"])
+
+    # shards skip the threshold check, the merged report is the whole project
+    check_thresholds(merge_config(merge_args, default_config, report), report)
@@ -1,12 +1,19 @@
 import concurrent.futures
 import time
 import sys
-from typing import List
+from typing import Callable, List, Optional
 from threading import Thread
 from dataclasses import dataclass
-from time import sleep
-import sys
-from threading import Lock
+from threading import Condition, Lock
+
+from codepass.endpoint_pool import EvaluationCancelled
+from codepass.progress import (
+    LOG_INTERVAL_SECONDS,
+    REFRESH_SECONDS,
+    SPINNER,
+    ProgressSnapshot,
+    progress_text,
+)
 
 
 @dataclass
@@ -14,97 +21,170 @@ class Task:
     task: callable
     args: List[any]
     budget: int
+    priority: int
+
+    def run(self, executor: concurrent.futures.ThreadPoolExecutor, endpoint_pool):
+        return executor.submit(self._run_prioritized, endpoint_pool)
 
-    def run(self, executor: concurrent.futures.ThreadPoolExecutor):
-        return executor.submit(self.task, *self.args)
+    def _run_prioritized(self, endpoint_pool):
+        with endpoint_pool.prioritized(self.priority):
+            return self.task(*self.args)
 
 
 class ParallelRuntime:
-    def __init__(self, token_budget_estimator):
+    def __init__(self, endpoint_pool, show_progress: bool = True):
         self._tasks = []
         self._results = []
-        self.token_budget_estimator = token_budget_estimator
+        self._executor = None
+        self._on_result = None
+        self.endpoint_pool = endpoint_pool
         self.lock = Lock()
+        self.finished = Condition(self.lock)
         self.finished_budget = 0
+        self.finished_count = 0
+        self.total_budget = 0
+        self._progress_width = 0
+        self.show_progress = show_progress
 
-    def _handle_result(self, budget):
+    def _handle_result(self, budget, on_result):
         def callback(future):
-            with self.lock:
-                self.finished_budget += budget
-                self._results.append(future.result())
+            result = None
+            try:
+                result = future.result()
+                # follow-up tasks are registered before this one is counted
+                # as finished, so run_tasks can not return in between
+                if on_result is not None:
+                    on_result(result)
+            except EvaluationCancelled:
+                pass
+            finally:
+                with self.lock:
+                    self.finished_budget += budget
+                    self.finished_count += 1
+                    if result is not None:
+                        self._results.append(result)
+                    self.finished.notify_all()
 
         return callback
 
-    def add_task(self, budget: int, task: callable, *args: List[any]):
-        self._tasks.append(Task(task, args, budget))
+    def _submit(self, task: Task, on_result):
+        future = task.run(self._executor, self.endpoint_pool)
+        future.add_done_callback(self._handle_result(task.budget, on_result))
 
-    def run_tasks(self):
+    def add_task(self, budget: int, task: callable, *args: List[any]):
+        """
+        Register a task. Tasks are dispatched in the order they are added.
+        Tasks added while run_tasks is in progress, e.g. from an on_result
+        callback, are dispatched immediately ahead of the queued ones, as
+        their results are waited for already.
+        """
+        with self.lock:
+            priority = -1 if self._executor is not None else len(self._tasks)
+            new_task = Task(task, args, budget, priority)
+            self._tasks.append(new_task)
+            self.total_budget += budget
+            executor = self._executor
+            on_result = self._on_result if executor is not None else None
+
+        if executor is not None:
+            self._submit(new_task, on_result)
+
+    def run_tasks(self, on_result: Optional[Callable[[any], None]] = None):
         if len(self._tasks) == 0:
             return []
 
-        futures = []
-        animation_thread = self._print_progress()
+        animation_thread = self._print_progress() if self.show_progress else None
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1000) as executor:
-            for task in self._tasks:
-                future = task.run(executor)
-                future.add_done_callback(self._handle_result(task.budget))
-                futures.append(future)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1000)
+        with self.lock:
+            self._executor = executor
+            self._on_result = on_result
+            pending_tasks = list(self._tasks)
 
-        concurrent.futures.wait(futures)
-        animation_thread.join()
-        return self._results
+        for task in pending_tasks:
+            self._submit(task, on_result)
 
-    def _print_progress(self):
-        def animation():
-            token_submitted_animation = "|/-\\"
-            no_tokens_animation = "..."
-            char_index = 0
+        with self.finished:
+            while self.finished_count < len(self._tasks):
+                self.finished.wait()
+            self._executor = None
 
-            while True:
-                if char_index == sys.maxsize:
-                    char_index = 0
-                else:
-                    char_index += 1
+        executor.shutdown(wait=True)
+        if animation_thread is not None:
+            animation_thread.join()
+        self.endpoint_pool.resume()
+        return self._results
 
-                result_count = len(self._results)
-                task_count = len(self._tasks)
+    def cancel_pending(self):
+        """
+        Drops tasks which have not sent their request yet, run_tasks returns
+        once the requests in flight are answered.
+        """
+        self.endpoint_pool.cancel()
+
+    def _progress_snapshot(self) -> ProgressSnapshot:
+        endpoint_pool = self.endpoint_pool
+        (window_used, window_limit) = endpoint_pool.window_usage()
+        with self.lock:
+            (finished_count, task_count) = (self.finished_count, len(self._tasks))
+            (finished_budget, total_budget) = (self.finished_budget, self.total_budget)
+
+        return ProgressSnapshot(
+            finished_count=finished_count,
+            task_count=task_count,
+            finished_budget=finished_budget,
+            total_budget=total_budget,
+            window_used=window_used,
+            window_limit=window_limit,
+            in_flight_count=endpoint_pool.in_flight_count,
+            queued_count=endpoint_pool.queued_count(),
+            retry_count=endpoint_pool.retry_count,
+            mean_latency=endpoint_pool.mean_latency(),
+        )
 
-                is_finished = result_count == task_count
+    def _print_progress(self):
+        """
+        Redraws one progress line in a terminal, prints a line every
+        LOG_INTERVAL_SECONDS otherwise, e.g. in CI logs.
+        """
+        is_terminal = sys.stdout.isatty()
+        interval = REFRESH_SECONDS if is_terminal else LOG_INTERVAL_SECONDS
 
+        def animation():
+            tick = 0
+            while True:
+                redraw_at = time.time() + interval
+                with self.finished:
+                    # finished tasks wake the wait, the line is kept steady
+                    while (
+                        self.finished_count < len(self._tasks)
+                        and time.time() < redraw_at
+                    ):
+                        self.finished.wait(redraw_at - time.time())
+                    is_finished = self.finished_count == len(self._tasks)
+
+                text = progress_text(self._progress_snapshot())
                 if is_finished:
-                    self._print_progress_text("Progress 100%    \n")
+                    self._print_progress_text(text, is_terminal, is_last=True)
                     break
 
-                progress_percentage = (
-                    self.finished_budget
-                    / sum([task.budget for task in self._tasks])
-                    * 100
-                )
-
-                progress_text = f"Progress {round(progress_percentage, 1)}%"
-
-                if self.token_budget_estimator.has_tasks_in_progress():
-                    progress_text += (
-                        " " + token_submitted_animation[char_index % 3] + " "
-                    )
-                else:
-                    point_count = char_index % 4
-                    empty_extra_space = 3 - point_count
-                    progress_text += (
-                        no_tokens_animation[0 : char_index % 4]
-                        + " " * empty_extra_space
-                    )
-
-                self._print_progress_text(progress_text)
-
-                sleep(0.1)
+                if is_terminal:
+                    text += " " + SPINNER[tick % len(SPINNER)]
+                    tick += 1
+                self._print_progress_text(text, is_terminal)
 
         animation_thread = Thread(target=animation)
         animation_thread.start()
 
         return animation_thread
 
-    def _print_progress_text(self, text):
-        sys.stdout.write(f"\r{text}")
+    def _print_progress_text(self, text, is_terminal: bool, is_last: bool = False):
+        if not is_terminal:
+            print(text, flush=True)
+            return
+
+        # spaces wipe the rest of a longer previous line
+        padding = " " * max(self._progress_width - len(text), 0)
+        self._progress_width = len(text)
+        sys.stdout.write(f"\r{text}{padding}" + ("\n" if is_last else ""))
         sys.stdout.flush()
@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from codepass.scheduler import REQUEST_OVERHEAD_SECONDS
+
+# refresh rate of the progress line in a terminal
+REFRESH_SECONDS = 0.2
+# log lines in CI and other output which is not a terminal
+LOG_INTERVAL_SECONDS = 10
+SPINNER = "|/-\\"
+
+
+@dataclass
+class ProgressSnapshot:
+    finished_count: int
+    task_count: int
+    # budget units, characters of the code like the limiter counts them
+    finished_budget: int
+    total_budget: int
+    window_used: int
+    window_limit: int
+    in_flight_count: int
+    queued_count: int
+    retry_count: int
+    mean_latency: Optional[float]
+
+
+def estimate_remaining_seconds(snapshot: ProgressSnapshot) -> Optional[float]:
+    """
+    Time until the remaining budget is answered: the limiter lets the
+    limit through per minute, less what is still in the window, and the
+    last requests take the latency observed so far.
+    """
+    remaining = snapshot.total_budget - snapshot.finished_budget
+    if remaining <= 0:
+        return 0
+    if snapshot.window_limit <= 0:
+        return None
+
+    headroom = max(snapshot.window_limit - snapshot.window_used, 0)
+    limiter_seconds = max(remaining - headroom, 0) / snapshot.window_limit * 60
+    latency = (
+        snapshot.mean_latency
+        if snapshot.mean_latency is not None
+        else REQUEST_OVERHEAD_SECONDS
+    )
+    return limiter_seconds + latency
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--"
+    seconds = round(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+
+def format_tokens(count: int) -> str:
+    if count >= 1_000_000:
+        return f"{round(count / 1_000_000, 1)}M"
+    if count >= 1000:
+        return f"{round(count / 1000, 1)}k"
+    return str(count)
+
+
+def progress_text(snapshot: ProgressSnapshot) -> str:
+    percentage = snapshot.finished_budget / max(snapshot.total_budget, 1) * 100
+    return " | ".join(
+        [
+            f"Progress {round(percentage, 1)}%"
+            f" ({snapshot.finished_count}/{snapshot.task_count})",
+            f"{format_tokens(snapshot.window_used)}"
+            f"/{format_tokens(snapshot.window_limit)} tokens/min",
+            f"{snapshot.in_flight_count} in flight, {snapshot.queued_count} queued",
+            f"{snapshot.retry_count} retries",
+            f"ETA {format_duration(estimate_remaining_seconds(snapshot))}",
+        ]
+    )
@@ -2,6 +2,8 @@ from typing import List
 from dataclasses import dataclass
 import hashlib
 
+from codepass import trace
+
 
 def add_line_numbers(code: str) -> str:
     return "\n".join(
@@ -17,34 +19,92 @@ def estimate_token_count(text: str) -> int:
 
 @dataclass
 class CodeFile:
+    """
+    Compact record of a source file, the code itself is read again only
+    when a request is about to be sent, so large repositories are scanned
+    without holding every file in memory.
+    """
+
+    __slots__ = ("path", "size", "hash", "line_count")
+
     path: str
-    code: str
-    token_count: int
+    # characters of the file
+    size: int
     hash: str
+    # lines of the file, a trailing newline starts an empty last line
+    line_count: int
+
+    @property
+    def token_count(self) -> int:
+        return self.size
+
+    def load_source(self) -> str:
+        """
+        Source of the file as it is now. When it was edited since the record
+        was made, the hash is cleared: the scores of the new source are kept
+        and the next run evaluates the file again.
+        """
+        with open(self.path) as f:
+            source = f.read()
+        if hashlib.md5(source.encode()).hexdigest() != self.hash:
+            self.hash = ""
+        return source
+
+    def load_code(self) -> str:
+        """
+        Line numbered code of the file, not kept by the record.
+        """
+        return add_line_numbers(self.load_source())
+
+
+@dataclass
+class SourceCodeFile(CodeFile):
+    """
+    Code file held in memory, e.g. passed to the library API, it is never
+    read from disk.
+    """
 
+    __slots__ = ("source",)
 
-def read_files(file_paths: List[str], ignore_files: List[str]) -> List[CodeFile]:
-    ignore_set = set(ignore_files)
+    source: str
 
+    def load_source(self) -> str:
+        return self.source
+
+
+def source_code_file(file_path: str, source: str) -> SourceCodeFile:
+    return SourceCodeFile(
+        path=file_path,
+        size=estimate_token_count(source),
+        hash=hashlib.md5(source.encode()).hexdigest(),
+        line_count=source.count("\n") + 1,
+        source=source,
+    )
+
+
+def read_files(file_paths: List[str]) -> List[CodeFile]:
     file_contents = []
     for file_path in file_paths:
-        if file_path in ignore_set:
-            continue
+        with trace.span(trace.READ, file_path), open(file_path) as f:
+            try:
+                file_code = f.read()
+            except UnicodeDecodeError:
+                # binary files found while walking directories
+                continue
 
-        with open(file_path) as f:
-            file_code = f.read()
+        if len(file_code) == 0:
+            continue
 
-            if len(file_code) == 0:
-                continue
+        with trace.span(trace.HASH, file_path):
+            file_hash = hashlib.md5(file_code.encode()).hexdigest()
 
-            code_with_line_numbers = add_line_numbers(file_code)
-            file_contents.append(
-                CodeFile(
-                    path=file_path,
-                    code=code_with_line_numbers,
-                    hash=hashlib.md5(file_code.encode()).hexdigest(),
-                    token_count=estimate_token_count(file_code),
-                )
+        file_contents.append(
+            CodeFile(
+                path=file_path,
+                size=estimate_token_count(file_code),
+                hash=file_hash,
+                line_count=file_code.count("\n") + 1,
             )
+        )
 
     return file_contents
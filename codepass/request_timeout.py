@@ -0,0 +1,85 @@
+from bisect import bisect_left, insort
+from collections import deque
+from threading import Lock
+from typing import Deque, List
+
+from codepass.llm.model import MAX_REQUEST_TIMEOUT
+from codepass.read_code_files import CodeFile
+from codepass.scheduler import OUTPUT_TOKENS_PER_SECOND, REQUEST_OVERHEAD_SECONDS
+from codepass.spend_limit import estimate_request
+
+# small requests keep MAX_REQUEST_TIMEOUT of the client, large ones wait
+# at most this long
+LONGEST_REQUEST_TIMEOUT = 600
+# prompt tokens are read many times faster than output tokens are generated
+PROMPT_TOKEN_WEIGHT = 1 / 30
+# a request may take this many times its expected duration
+TIMEOUT_MARGIN = 3
+# every retry after a timeout waits this many times longer
+TIMEOUT_GROWTH = 2
+MAX_TIMEOUT_RETRIES = 2
+# throughput varies, the slow end of the observed one is expected
+THROUGHPUT_PERCENTILE = 0.1
+# the throughput is taken from this many of the latest requests
+THROUGHPUT_WINDOW = 200
+
+
+def request_work(code_file: CodeFile, sample_count: int) -> float:
+    # output tokens and prompt tokens weighted by how long they take
+    estimate = estimate_request(code_file, sample_count)
+    return estimate.output_tokens + estimate.input_tokens * PROMPT_TOKEN_WEIGHT
+
+
+class RequestTimeouts:
+    """
+    Timeouts of single requests, scaled by the estimated size of the
+    request and the throughput of the latest requests, growing with every
+    retry after a timeout. Counts timeouts for the run summary.
+    """
+
+    def __init__(self, sample_count: int = 1):
+        self.sample_count = sample_count
+        self.lock = Lock()
+        # latest observations in arrival order and, the same ones, sorted
+        self.tokens_per_second: Deque[float] = deque()
+        self.sorted_tokens_per_second: List[float] = []
+        self.timeout_count = 0
+        self.retried_count = 0
+        self.failed_count = 0
+
+    def observe(self, code_file: CodeFile, seconds: float):
+        generation_seconds = max(seconds - REQUEST_OVERHEAD_SECONDS, 0.1)
+        tokens_per_second = (
+            request_work(code_file, self.sample_count) / generation_seconds
+        )
+        with self.lock:
+            if len(self.tokens_per_second) == THROUGHPUT_WINDOW:
+                oldest = self.tokens_per_second.popleft()
+                del self.sorted_tokens_per_second[
+                    bisect_left(self.sorted_tokens_per_second, oldest)
+                ]
+            self.tokens_per_second.append(tokens_per_second)
+            insort(self.sorted_tokens_per_second, tokens_per_second)
+
+    def throughput(self) -> float:
+        with self.lock:
+            observed = self.sorted_tokens_per_second
+            if len(observed) == 0:
+                return OUTPUT_TOKENS_PER_SECOND
+            return observed[int((len(observed) - 1) * THROUGHPUT_PERCENTILE)]
+
+    def timeout_seconds(self, code_file: CodeFile, retry: int = 0) -> float:
+        expected_seconds = (
+            REQUEST_OVERHEAD_SECONDS
+            + request_work(code_file, self.sample_count) / self.throughput()
+        )
+        timeout = max(expected_seconds * TIMEOUT_MARGIN, MAX_REQUEST_TIMEOUT)
+        return min(timeout * TIMEOUT_GROWTH**retry, LONGEST_REQUEST_TIMEOUT)
+
+    def record_timeout(self, is_retried: bool):
+        with self.lock:
+            self.timeout_count += 1
+            if is_retried:
+                self.retried_count += 1
+            else:
+                self.failed_count += 1
@@ -0,0 +1,162 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+
+from codepass.read_code_files import CodeFile
+from codepass.spend_limit import estimate_request
+
+# the token budget estimator counts what was sent over the last minute
+WINDOW_SECONDS = 60
+# rough latency of a completion: fixed request overhead and generation speed
+REQUEST_OVERHEAD_SECONDS = 1.0
+OUTPUT_TOKENS_PER_SECOND = 60
+
+
+@dataclass
+class Simulation:
+    order_name: str
+    request_count: int
+    # limiter units, the estimator counts code characters
+    budget: int
+    # tokens which are likely to be charged
+    tokens: int
+    wall_seconds: float
+
+
+def request_seconds(code_file: CodeFile, sample_count: int) -> float:
+    output_tokens = estimate_request(code_file, sample_count).output_tokens
+    return REQUEST_OVERHEAD_SECONDS + output_tokens / OUTPUT_TOKENS_PER_SECOND
+
+
+def earliest_dispatch(
+    window: deque, used: int, budget: int, token_budget: int, start: float
+) -> float:
+    """
+    First moment from start on at which a request of budget fits into the
+    sliding window of an endpoint, the same way TokenBudgetEstimator grants
+    it. A request larger than the whole budget waits for an empty window.
+    """
+    time = start
+    for sent_at, sent_budget in window:
+        if sent_at + WINDOW_SECONDS <= time:
+            used -= sent_budget
+            continue
+        if token_budget - used - budget > 0 or used == 0:
+            return time
+        time = sent_at + WINDOW_SECONDS
+        used -= sent_budget
+
+    return time
+
+
+def simulate(
+    order_name: str,
+    code_files: List[CodeFile],
+    token_budgets: List[int],
+    sample_count: int = 1,
+) -> Simulation:
+    """
+    Replays requests in dispatch order against one sliding window per
+    endpoint. A request is sent as soon as any endpoint has budget for it,
+    but never before the request ahead of it, as EndpointPool grants budget
+    in order.
+    """
+    windows = [deque() for _ in token_budgets]
+    used = [0 for _ in token_budgets]
+    (time, wall_seconds, tokens) = (0.0, 0.0, 0)
+
+    for code_file in code_files:
+        budget = code_file.token_count
+        dispatches = [
+            earliest_dispatch(windows[index], used[index], budget, token_budget, time)
+            for index, token_budget in enumerate(token_budgets)
+        ]
+        index = min(range(len(dispatches)), key=lambda i: dispatches[i])
+        time = dispatches[index]
+
+        window = windows[index]
+        while len(window) > 0 and window[0][0] + WINDOW_SECONDS <= time:
+            used[index] -= window.popleft()[1]
+        window.append((time, budget))
+        used[index] += budget
+
+        finished_at = time + request_seconds(code_file, sample_count)
+        wall_seconds = max(wall_seconds, finished_at)
+        tokens += estimate_request(code_file, sample_count).tokens()
+
+    return Simulation(
+        order_name=order_name,
+        request_count=len(code_files),
+        budget=sum(code_file.token_count for code_file in code_files),
+        tokens=tokens,
+        wall_seconds=wall_seconds,
+    )
+
+
+def largest_first(code_files: List[CodeFile], token_budget: int) -> List[int]:
+    return sorted(
+        range(len(code_files)),
+        key=lambda index: (-code_files[index].token_count, code_files[index].path),
+    )
+
+
+def window_packed(code_files: List[CodeFile], token_budget: int) -> List[int]:
+    """
+    First fit decreasing of the requests into windows of one minute of
+    budget, so every window is sent as full as possible. Within a window the
+    largest and the smallest remaining request alternate: long running
+    requests start early and small files are answered in between instead of
+    queueing behind all large ones.
+    """
+    windows: List[List[int]] = []
+    loads: List[int] = []
+    for index in largest_first(code_files, token_budget):
+        budget = code_files[index].token_count
+        for window_index, load in enumerate(loads):
+            if load + budget < token_budget:
+                windows[window_index].append(index)
+                loads[window_index] += budget
+                break
+        else:
+            windows.append([index])
+            loads.append(budget)
+
+    order = []
+    for window in windows:
+        (low, high) = (0, len(window) - 1)
+        while low <= high:
+            order.append(window[low])
+            if low != high:
+                order.append(window[high])
+            (low, high) = (low + 1, high - 1)
+    return order
+
+
+ORDERS: Dict[str, Callable[[List[CodeFile], int], List[int]]] = {
+    "largest first": largest_first,
+    "window packed": window_packed,
+}
+
+
+def plan_dispatch(
+    code_files: List[CodeFile], token_budgets: List[int], sample_count: int = 1
+) -> Tuple[List[int], Simulation]:
+    """
+    Simulates every known dispatch order of the requests, one code file per
+    request, and returns the indices of the order with the shortest
+    predicted wall time together with its simulation.
+    """
+    best = None
+    best_order = None
+    for order_name, order_requests in ORDERS.items():
+        order = order_requests(code_files, sum(token_budgets))
+        simulation = simulate(
+            order_name,
+            [code_files[index] for index in order],
+            token_budgets,
+            sample_count,
+        )
+        if best is None or simulation.wall_seconds < best.wall_seconds:
+            (best, best_order) = (simulation, order)
+
+    return (best_order, best)
@@ -0,0 +1,194 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import posixpath
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+    from codepass.file_report import FileReport
+
+SCORE_NAMES = ["a_score", "b_score"]
+# below it importing numpy takes longer than summing the files one by one
+VECTORIZED_MIN_FILES = 5000
+
+
+@dataclass
+class ScoreColumns:
+    file_paths: List[str]
+    line_counts: "ndarray"
+    scores: Dict[str, "ndarray"]
+
+
+def score_columns(report_files_list: List["FileReport"]) -> ScoreColumns:
+    """
+    Columnar view of the report: one float array per score, files without
+    the score hold NaN, which fails the `> 0` check like a zero score.
+    """
+    import numpy as np
+
+    return ScoreColumns(
+        file_paths=[f.file_path for f in report_files_list],
+        line_counts=np.fromiter(
+            (f.line_count for f in report_files_list),
+            dtype=np.float64,
+            count=len(report_files_list),
+        ),
+        scores={
+            score_name: np.fromiter(
+                (getattr(f, score_name, np.nan) for f in report_files_list),
+                dtype=np.float64,
+                count=len(report_files_list),
+            )
+            for score_name in SCORE_NAMES
+        },
+    )
+
+
+def directory_and_parents(directory: str) -> List[str]:
+    directories = [directory]
+    while directory not in (".", "/"):
+        directory = posixpath.dirname(directory) or "."
+        directories.append(directory)
+    return directories
+
+
+def file_directory(file_path: str) -> str:
+    return posixpath.dirname(posixpath.normpath(file_path)) or "."
+
+
+@dataclass
+class DirectoryScores:
+    file_count: int = 0
+    line_count: float = 0
+    a_score_line_count: float = 0
+    a_score_line_sum: float = 0
+    b_score_line_count: float = 0
+    b_score_line_sum: float = 0
+
+    def score(self, score_name: str) -> float:
+        total_lines = getattr(self, f"{score_name}_line_count")
+        if total_lines == 0:
+            return 0
+        return round(getattr(self, f"{score_name}_line_sum") / total_lines, 1)
+
+    def add(self, contribution: "DirectoryScores", sign: int = 1):
+        for field in self.__dataclass_fields__:
+            setattr(
+                self, field, getattr(self, field) + sign * getattr(contribution, field)
+            )
+
+    def to_dict(self, score_names: List[str]) -> dict:
+        return {
+            "file_count": self.file_count,
+            "line_count": round(self.line_count),
+            **{score_name: self.score(score_name) for score_name in score_names},
+        }
+
+
+def file_contribution(file_report: "FileReport") -> DirectoryScores:
+    contribution = DirectoryScores(file_count=1, line_count=file_report.line_count)
+    for score_name in SCORE_NAMES:
+        score = getattr(file_report, score_name, 0)
+        if score > 0:
+            setattr(contribution, f"{score_name}_line_count", file_report.line_count)
+            setattr(
+                contribution, f"{score_name}_line_sum", score * file_report.line_count
+            )
+    return contribution
+
+
+class DirectoryRollup:
+    """
+    Line weighted scores of every directory, each file counts towards all of
+    its parent directories. It is built once with vectorized sums per
+    directory and kept up to date by applying the difference of a changed
+    file to its parents only.
+    """
+
+    def __init__(self):
+        self.total = DirectoryScores()
+        self.directories: Dict[str, DirectoryScores] = {}
+
+    @staticmethod
+    def from_report_files(report_files_list: List["FileReport"]) -> "DirectoryRollup":
+        if len(report_files_list) >= VECTORIZED_MIN_FILES:
+            return DirectoryRollup.from_columns(score_columns(report_files_list))
+
+        rollup = DirectoryRollup()
+        for file_report in report_files_list:
+            rollup.update(file_report.file_path, None, file_contribution(file_report))
+        return rollup
+
+    @staticmethod
+    def from_columns(columns: ScoreColumns) -> "DirectoryRollup":
+        import numpy as np
+
+        file_directories = [
+            file_directory(file_path) for file_path in columns.file_paths
+        ]
+        (directory_names, directory_index) = np.unique(
+            np.array(file_directories, dtype=object), return_inverse=True
+        )
+
+        def directory_sums(weights) -> "ndarray":
+            return np.bincount(
+                directory_index, weights=weights, minlength=len(directory_names)
+            )
+
+        sums = {
+            "file_count": np.bincount(directory_index, minlength=len(directory_names)),
+            "line_count": directory_sums(columns.line_counts),
+        }
+        for score_name, scores in columns.scores.items():
+            scored_lines = np.where(scores > 0, columns.line_counts, 0)
+            sums[f"{score_name}_line_count"] = directory_sums(scored_lines)
+            sums[f"{score_name}_line_sum"] = directory_sums(
+                np.where(scores > 0, scores * columns.line_counts, 0)
+            )
+
+        rollup = DirectoryRollup()
+        rollup.total = DirectoryScores(
+            **{field: sums[field].sum().item() for field in sums}
+        )
+        for index, directory_name in enumerate(directory_names):
+            contribution = DirectoryScores(
+                **{field: sums[field][index].item() for field in sums}
+            )
+            for directory in directory_and_parents(directory_name):
+                rollup._add(directory, contribution, 1)
+
+        return rollup
+
+    def _add(self, directory: str, contribution: DirectoryScores, sign: int):
+        scores = self.directories.setdefault(directory, DirectoryScores())
+        scores.add(contribution, sign)
+
+        if scores.file_count <= 0:
+            del self.directories[directory]
+
+    def update(
+        self,
+        file_path: str,
+        previous_contribution: Optional[DirectoryScores],
+        contribution: Optional[DirectoryScores],
+    ):
+        """
+        Moves a file from its previous contribution to the new one, None
+        stands for a file which did not exist before or was removed.
+        """
+        directories = directory_and_parents(file_directory(file_path))
+        for file_contribution, sign in [(previous_contribution, -1), (contribution, 1)]:
+            if file_contribution is None:
+                continue
+            self.total.add(file_contribution, sign)
+            for directory in directories:
+                self._add(directory, file_contribution, sign)
+
+    def subtree(self, directory: str) -> Optional[DirectoryScores]:
+        return self.directories.get(posixpath.normpath(directory))
+
+    def to_dict(self, score_names: List[str]) -> dict:
+        return {
+            directory: self.directories[directory].to_dict(score_names)
+            for directory in sorted(self.directories)
+        }
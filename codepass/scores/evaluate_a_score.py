@@ -1,13 +1,47 @@
-from codepass.llm.a_score_parser import FileAScoreEvaluation, FunctionAScoreEvaluation
-from codepass.llm.model import file_a_score_model
-from codepass.token_budget_estimator import TokenBudgetEstimator
+from codepass.llm.model import file_a_score_model, file_a_score_stream_model
+from codepass.endpoint_pool import EndpointPool
+from codepass.llm.invoke_model import invoke_model, ModelInvocationError
 from dataclasses import dataclass, field
 from typing import List, Dict, Any
 from codepass.read_code_files import CodeFile
-from langchain_core.exceptions import OutputParserException
-from openai import RateLimitError, APITimeoutError
+from codepass.scores.sample_aggregation import (
+    group_function_samples,
+    median_function,
+    score_spread,
+)
+from codepass.scores.function_reuse import (
+    ScoreFunctions,
+    complete_evaluation,
+    plan_function_reuse,
+    reused_functions,
+    reused_lines,
+)
+from codepass.scores.streamed_evaluation import invoke_streamed_model
+from functools import partial
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from codepass.llm.a_score_parser import (
+        FileAScoreEvaluation,
+        FunctionAScoreEvaluation,
+    )
+
+
+A_SCORE_FACTORS = [
+    "readability_score",
+    "cognitive_complexity_score",
+    "project_specific_knowledge_score",
+    "technical_domain_knowledge_score",
+    "advanced_code_techniques_score",
+]
 
-MAX_RETRIES = 7
+
+A_SCORE_FUNCTIONS = ScoreFunctions(
+    score_name="a_score",
+    list_field="function_complexities",
+    score_fields=A_SCORE_FACTORS,
+    flag_fields=["is_setup_of_declaration"],
+)
 
 
 @dataclass
@@ -20,8 +54,10 @@ class AScoreEvaluationResult:
 
     details: Dict[str, Dict[Any, Any]] = field(default_factory=dict)
 
+    model_name: str = ""
+
 
-def file_line_count(function_complexities: List[FunctionAScoreEvaluation]) -> int:
+def file_line_count(function_complexities: List["FunctionAScoreEvaluation"]) -> int:
     return sum(
         [
             function_complexity.line_count()
@@ -31,7 +67,7 @@ def file_line_count(function_complexities: List[FunctionAScoreEvaluation]) -> in
 
 
 def compute_file_a_score(
-    function_complexities: List[FunctionAScoreEvaluation],
+    function_complexities: List["FunctionAScoreEvaluation"],
 ) -> float:
     return sum(
         [
@@ -42,7 +78,7 @@ def compute_file_a_score(
 
 
 def compute_function_a_score(
-    function_complexity: FunctionAScoreEvaluation,
+    function_complexity: "FunctionAScoreEvaluation",
 ) -> float:
     line_count = function_complexity.line_count()
     if line_count == 0:
@@ -53,71 +89,148 @@ def compute_function_a_score(
 def evaluate_a_score(
     code_file: CodeFile,
     model_name: str,
-    token_budget_estimator: TokenBudgetEstimator,
+    endpoint_pool: EndpointPool,
+    sample_count: int = 1,
+    function_store=None,
 ) -> AScoreEvaluationResult:
-    error_recovery_instructions = ""
-    for _ in range(MAX_RETRIES):
-        try:
-            token_budget_estimator.await_budget(code_file)
-            file_evaluation: FileAScoreEvaluation = file_a_score_model(
-                model_name
-            ).invoke(
-                {
-                    "code": code_file.code,
-                    "error_recovery_instructions": error_recovery_instructions,
-                }
-            )
+    result = _evaluate_a_score(
+        code_file, model_name, endpoint_pool, sample_count, function_store
+    )
+    result.model_name = model_name
+    return result
 
-            number_of_lines = file_line_count(file_evaluation.function_complexities)
 
-            if number_of_lines == 0:
-                return AScoreEvaluationResult(
-                    file_path=code_file.path,
-                    line_count=0,
-                    a_score=0,
-                )
-
-            complexity_score = compute_file_a_score(
-                file_evaluation.function_complexities
-            )
-            a_score = round(complexity_score / number_of_lines, 1)
-
-            return AScoreEvaluationResult(
-                line_count=number_of_lines,
-                a_score=a_score,
-                file_path=code_file.path,
-                details={
-                    function_complexity.function_name: {
-                        "line_count": function_complexity.line_count(),
-                        "score": compute_function_a_score(function_complexity),
-                    }
-                    for function_complexity in file_evaluation.function_complexities
-                },
-            )
-        except OutputParserException as e:
-            if error_recovery_instructions == "":
-                error_recovery_instructions = "Be very careful in output formatting!"
-            else:
-                error_recovery_instructions = f"Parsing of output formatting already due to {str(e)}, please, avoid this issue again!"
-        except RateLimitError as e:
-            token_budget_estimator.push_external_costs(code_file.token_count)
-        except APITimeoutError as e:
-            return AScoreEvaluationResult(
-                file_path=code_file.path,
-                line_count=0,
-                a_score=0,
-                error_message="Timeout error. API is not available or file is to complex to analyse",
-            )
-        except Exception as e:
-            return AScoreEvaluationResult(
-                file_path=code_file.path,
-                line_count=0,
-                a_score=0,
-                error_message=str(e),
-            )
+def a_score_error_result(
+    code_file: CodeFile, error_message: str
+) -> AScoreEvaluationResult:
     return AScoreEvaluationResult(
         file_path=code_file.path,
         line_count=0,
         a_score=0,
-        error_message=error_recovery_instructions,
+        error_message=error_message,
+    )
+
+
+def a_score_evaluation_result(
+    code_file: CodeFile, file_evaluation: "FileAScoreEvaluation"
+) -> AScoreEvaluationResult:
+    number_of_lines = file_line_count(file_evaluation.function_complexities)
+
+    if number_of_lines == 0:
+        return AScoreEvaluationResult(
+            file_path=code_file.path,
+            line_count=0,
+            a_score=0,
+        )
+
+    complexity_score = compute_file_a_score(file_evaluation.function_complexities)
+    a_score = round(complexity_score / number_of_lines, 1)
+
+    return AScoreEvaluationResult(
+        line_count=number_of_lines,
+        a_score=a_score,
+        file_path=code_file.path,
+        details={
+            function_complexity.function_name: {
+                "line_count": function_complexity.line_count(),
+                "score": compute_function_a_score(function_complexity),
+            }
+            for function_complexity in file_evaluation.function_complexities
+        },
+    )
+
+
+def a_score_samples_result(
+    code_file: CodeFile, file_evaluations: List["FileAScoreEvaluation"]
+) -> AScoreEvaluationResult:
+    function_samples = group_function_samples(
+        [file_evaluation.function_complexities for file_evaluation in file_evaluations]
+    )
+    median_functions = [
+        median_function(functions, A_SCORE_FACTORS, ["is_setup_of_declaration"])
+        for functions in function_samples
+    ]
+
+    result = a_score_evaluation_result(
+        code_file,
+        file_evaluations[0].model_copy(
+            update={"function_complexities": median_functions}
+        ),
+    )
+    for functions, function in zip(function_samples, median_functions):
+        # files whose functions span no lines get no details
+        details = result.details.get(function.function_name)
+        if details is None:
+            continue
+        details["samples"] = len(functions)
+        details["score_spread"] = score_spread(
+            [compute_function_a_score(sample) for sample in functions]
+        )
+
+    return result
+
+
+def _evaluate_a_score(
+    code_file: CodeFile,
+    model_name: str,
+    endpoint_pool: EndpointPool,
+    sample_count: int,
+    function_store,
+) -> AScoreEvaluationResult:
+    from codepass.llm.a_score_parser import (
+        FileAScoreEvaluation,
+        FunctionAScoreEvaluation,
     )
+
+    # functions known from earlier evaluations are not sent again
+    reuse = plan_function_reuse(
+        function_store, code_file, model_name, A_SCORE_FUNCTIONS
+    )
+    if reuse is not None and reuse.code is None:
+        return a_score_evaluation_result(
+            code_file,
+            FileAScoreEvaluation(
+                function_complexities=reused_functions(
+                    reuse, FunctionAScoreEvaluation
+                )
+            ),
+        )
+
+    code = reuse.code if reuse is not None else None
+    try:
+        if sample_count > 1:
+            file_evaluation = invoke_model(
+                code_file,
+                partial(file_a_score_model, sample_count=sample_count),
+                model_name,
+                endpoint_pool,
+                code,
+            )
+        else:
+            file_evaluation = invoke_streamed_model(
+                code_file,
+                file_a_score_stream_model,
+                model_name,
+                endpoint_pool,
+                A_SCORE_FUNCTIONS,
+                FileAScoreEvaluation,
+                code,
+                reused_lines(reuse) if reuse is not None else None,
+            )
+    except ModelInvocationError as e:
+        return a_score_error_result(code_file, str(e))
+
+    if reuse is not None:
+        file_evaluation = complete_evaluation(
+            function_store,
+            model_name,
+            A_SCORE_FUNCTIONS,
+            reuse,
+            file_evaluation,
+            FunctionAScoreEvaluation,
+        )
+
+    if sample_count > 1:
+        return a_score_samples_result(code_file, file_evaluation)
+
+    return a_score_evaluation_result(code_file, file_evaluation)
@@ -1,16 +1,47 @@
-from codepass.llm.b_score_parser import (
-    FileBScoreEvaluation,
-    FunctionBScoreEvaluation,
-)
-from codepass.llm.model import file_b_score_model
-from codepass.token_budget_estimator import TokenBudgetEstimator
+from codepass.llm.model import file_b_score_model, file_b_score_stream_model
+from codepass.endpoint_pool import EndpointPool
+from codepass.llm.invoke_model import invoke_model, ModelInvocationError
 from dataclasses import dataclass, field
 from typing import List, Dict, Any
 from codepass.read_code_files import CodeFile
-from openai import RateLimitError, APITimeoutError
-from langchain_core.exceptions import OutputParserException
+from codepass.scores.sample_aggregation import (
+    group_function_samples,
+    median_function,
+    score_spread,
+)
+from codepass.scores.function_reuse import (
+    ScoreFunctions,
+    complete_evaluation,
+    plan_function_reuse,
+    reused_functions,
+    reused_lines,
+)
+from codepass.scores.streamed_evaluation import invoke_streamed_model
+from functools import partial
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from codepass.llm.b_score_parser import (
+        FileBScoreEvaluation,
+        FunctionBScoreEvaluation,
+    )
+
+
+B_SCORE_FACTORS = [
+    "low_level_implementation_impact",
+    "technical_domain_logic_impact",
+    "business_logic_impact",
+    "project_specific_knowledge_impact",
+    "external_component_interfacing_impact",
+]
 
-MAX_RETRIES = 7
+
+B_SCORE_FUNCTIONS = ScoreFunctions(
+    score_name="b_score",
+    list_field="function_abstraction_level_evaluations",
+    score_fields=B_SCORE_FACTORS,
+    flag_fields=[],
+)
 
 
 @dataclass
@@ -23,8 +54,10 @@ class BScoreEvaluationResult:
 
     details: Dict[str, Dict[Any, Any]] = field(default_factory=dict)
 
+    model_name: str = ""
+
 
-def line_count(function_complexities: List[FunctionBScoreEvaluation]) -> int:
+def line_count(function_complexities: List["FunctionBScoreEvaluation"]) -> int:
     return sum(
         [
             function_complexity.line_count()
@@ -34,7 +67,7 @@ def line_count(function_complexities: List[FunctionBScoreEvaluation]) -> int:
 
 
 def compute_file_b_score(
-    function_complexities: List[FunctionBScoreEvaluation],
+    function_complexities: List["FunctionBScoreEvaluation"],
 ) -> float:
     return sum(
         [
@@ -45,7 +78,7 @@ def compute_file_b_score(
 
 
 def compute_function_b_score(
-    function_complexity: FunctionBScoreEvaluation,
+    function_complexity: "FunctionBScoreEvaluation",
 ) -> float:
     line_count = function_complexity.line_count()
     if line_count == 0:
@@ -56,73 +89,151 @@ def compute_function_b_score(
 def evaluate_b_score(
     code_file: CodeFile,
     model_name: str,
-    token_budget_estimator: TokenBudgetEstimator,
+    endpoint_pool: EndpointPool,
+    sample_count: int = 1,
+    function_store=None,
 ) -> BScoreEvaluationResult:
-    error_recovery_instructions = ""
-    for _ in range(MAX_RETRIES):
-        try:
-            token_budget_estimator.await_budget(code_file)
-            file_evaluation: FileBScoreEvaluation = file_b_score_model(
-                model_name
-            ).invoke(
-                {
-                    "code": code_file.code,
-                    "error_recovery_instructions": error_recovery_instructions,
-                }
-            )
-            number_of_lines = line_count(
-                file_evaluation.function_abstraction_level_evaluations
-            )
-
-            if number_of_lines == 0:
-                return BScoreEvaluationResult(
-                    file_path=code_file.path,
-                    line_count=0,
-                    b_score=0,
-                )
+    result = _evaluate_b_score(
+        code_file, model_name, endpoint_pool, sample_count, function_store
+    )
+    result.model_name = model_name
+    return result
 
-            abstraction_level = compute_file_b_score(
-                file_evaluation.function_abstraction_level_evaluations
-            )
 
-            b_score = round(abstraction_level / number_of_lines, 1)
-
-            return BScoreEvaluationResult(
-                line_count=number_of_lines,
-                b_score=b_score,
-                file_path=code_file.path,
-                details={
-                    function_complexity.function_name: {
-                        "line_count": function_complexity.line_count(),
-                        "score": compute_function_b_score(function_complexity),
-                    }
-                    for function_complexity in file_evaluation.function_abstraction_level_evaluations
-                },
-            )
-        except OutputParserException as e:
-            if error_recovery_instructions == "":
-                error_recovery_instructions = "Be very careful in output formatting!"
-            else:
-                error_recovery_instructions = f"Parsing of output formatting already due to {str(e)}, please, avoid this issue again!"
-        except RateLimitError as e:
-            token_budget_estimator.push_external_costs(code_file.token_count)
-        except APITimeoutError as e:
-            return BScoreEvaluationResult(
-                file_path=code_file.path,
-                line_count=0,
-                b_score=0,
-                error_message="Timeout error. API is not available or file is to complex to analyse",
-            )
-        except Exception as e:
-            return BScoreEvaluationResult(
-                file_path=code_file.path,
-                line_count=0,
-                b_score=0,
-                error_message=str(e),
-            )
+def b_score_error_result(
+    code_file: CodeFile, error_message: str
+) -> BScoreEvaluationResult:
     return BScoreEvaluationResult(
         file_path=code_file.path,
         line_count=0,
         b_score=0,
-        error_message=error_recovery_instructions,
+        error_message=error_message,
     )
+
+
+def b_score_evaluation_result(
+    code_file: CodeFile, file_evaluation: "FileBScoreEvaluation"
+) -> BScoreEvaluationResult:
+    number_of_lines = line_count(file_evaluation.function_abstraction_level_evaluations)
+
+    if number_of_lines == 0:
+        return BScoreEvaluationResult(
+            file_path=code_file.path,
+            line_count=0,
+            b_score=0,
+        )
+
+    abstraction_level = compute_file_b_score(
+        file_evaluation.function_abstraction_level_evaluations
+    )
+
+    b_score = round(abstraction_level / number_of_lines, 1)
+
+    return BScoreEvaluationResult(
+        line_count=number_of_lines,
+        b_score=b_score,
+        file_path=code_file.path,
+        details={
+            function_complexity.function_name: {
+                "line_count": function_complexity.line_count(),
+                "score": compute_function_b_score(function_complexity),
+            }
+            for function_complexity in file_evaluation.function_abstraction_level_evaluations
+        },
+    )
+
+
+def b_score_samples_result(
+    code_file: CodeFile, file_evaluations: List["FileBScoreEvaluation"]
+) -> BScoreEvaluationResult:
+    function_samples = group_function_samples(
+        [file_evaluation.function_abstraction_level_evaluations for file_evaluation in file_evaluations]
+    )
+    median_functions = [
+        median_function(functions, B_SCORE_FACTORS)
+        for functions in function_samples
+    ]
+
+    result = b_score_evaluation_result(
+        code_file,
+        file_evaluations[0].model_copy(
+            update={"function_abstraction_level_evaluations": median_functions}
+        ),
+    )
+    for functions, function in zip(function_samples, median_functions):
+        # files whose functions span no lines get no details
+        details = result.details.get(function.function_name)
+        if details is None:
+            continue
+        details["samples"] = len(functions)
+        details["score_spread"] = score_spread(
+            [compute_function_b_score(sample) for sample in functions]
+        )
+
+    return result
+
+
+def _evaluate_b_score(
+    code_file: CodeFile,
+    model_name: str,
+    endpoint_pool: EndpointPool,
+    sample_count: int,
+    function_store,
+) -> BScoreEvaluationResult:
+    from codepass.llm.b_score_parser import (
+        FileBScoreEvaluation,
+        FunctionBScoreEvaluation,
+    )
+
+    # functions known from earlier evaluations are not sent again
+    reuse = plan_function_reuse(
+        function_store, code_file, model_name, B_SCORE_FUNCTIONS
+    )
+    if reuse is not None and reuse.code is None:
+        return b_score_evaluation_result(
+            code_file,
+            FileBScoreEvaluation(
+                function_abstraction_level_evaluations=reused_functions(
+                    reuse, FunctionBScoreEvaluation
+                )
+            ),
+        )
+
+    code = reuse.code if reuse is not None else None
+    try:
+        if sample_count > 1:
+            file_evaluation = invoke_model(
+                code_file,
+                partial(file_b_score_model, sample_count=sample_count),
+                model_name,
+                endpoint_pool,
+                code,
+            )
+        else:
+            file_evaluation = invoke_streamed_model(
+                code_file,
+                file_b_score_stream_model,
+                model_name,
+                endpoint_pool,
+                B_SCORE_FUNCTIONS,
+                FileBScoreEvaluation,
+                code,
+                reused_lines(reuse) if reuse is not None else None,
+            )
+    except ModelInvocationError as e:
+        return b_score_error_result(code_file, str(e))
+
+    if reuse is not None:
+        file_evaluation = complete_evaluation(
+            function_store,
+            model_name,
+            B_SCORE_FUNCTIONS,
+            reuse,
+            file_evaluation,
+            FunctionBScoreEvaluation,
+        )
+
+    if sample_count > 1:
+        return b_score_samples_result(code_file, file_evaluation)
+
+    return b_score_evaluation_result(code_file, file_evaluation)
@@ -0,0 +1,183 @@
+from dataclasses import dataclass
+from typing import List, Optional, Set
+
+import ast
+import hashlib
+import re
+
+SIMHASH_BITS = 64
+# consecutive tokens of the normalised tree hashed together
+SHINGLE_SIZE = 4
+PLACEHOLDER = "_"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+@dataclass
+class FunctionSpan:
+    name: str
+    # first line of the decorators or the definition
+    start_line: int
+    end_line: int
+    fingerprint: str
+    simhash: int
+
+
+class NameNormalizer(ast.NodeTransformer):
+    """
+    Drops everything which differs between handlers, serializers or
+    fixtures written from the same template: identifiers, literals,
+    docstrings and type annotations. The shape of the code stays.
+    """
+
+    def _drop_docstring(self, node):
+        body = node.body
+        if (
+            len(body) > 0
+            and isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant)
+            and isinstance(body[0].value.value, str)
+        ):
+            node.body = body[1:] or [ast.Pass()]
+
+    def visit_FunctionDef(self, node):
+        self._drop_docstring(node)
+        node.name = PLACEHOLDER
+        node.returns = None
+        return self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self._drop_docstring(node)
+        node.name = PLACEHOLDER
+        return self.generic_visit(node)
+
+    def visit_arg(self, node):
+        node.arg = PLACEHOLDER
+        node.annotation = None
+        return node
+
+    def visit_Name(self, node):
+        node.id = PLACEHOLDER
+        return node
+
+    def visit_Attribute(self, node):
+        node.attr = PLACEHOLDER
+        return self.generic_visit(node)
+
+    def visit_keyword(self, node):
+        node.arg = PLACEHOLDER if node.arg is not None else None
+        return self.generic_visit(node)
+
+    def visit_Constant(self, node):
+        return ast.Constant(value=type(node.value).__name__)
+
+
+def simhash(tokens: List[str]) -> int:
+    shingles = [
+        " ".join(tokens[index : index + SHINGLE_SIZE])
+        for index in range(max(len(tokens) - SHINGLE_SIZE + 1, 1))
+    ]
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        shingle_hash = int.from_bytes(
+            hashlib.md5(shingle.encode()).digest()[: SIMHASH_BITS // 8], "big"
+        )
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if shingle_hash >> bit & 1 else -1
+
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def similarity(a: int, b: int) -> float:
+    return 1 - hamming_distance(a, b) / SIMHASH_BITS
+
+
+def first_line(node: ast.stmt) -> int:
+    decorator_lines = [d.lineno for d in getattr(node, "decorator_list", [])]
+    return min([node.lineno] + decorator_lines)
+
+
+def function_span(node) -> FunctionSpan:
+    (name, start_line) = (node.name, first_line(node))
+    normalized = ast.dump(
+        NameNormalizer().visit(node), annotate_fields=False, include_attributes=False
+    )
+    return FunctionSpan(
+        name=name,
+        start_line=start_line,
+        end_line=node.end_lineno,
+        fingerprint=hashlib.sha1(normalized.encode()).hexdigest()[:16],
+        simhash=simhash(TOKEN_PATTERN.findall(normalized)),
+    )
+
+
+def python_function_nodes(body: List[ast.stmt]) -> List[ast.stmt]:
+    # functions and methods, nested functions belong to their parent
+    nodes = []
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            nodes.append(node)
+        elif isinstance(node, ast.ClassDef):
+            nodes += python_function_nodes(node.body)
+    return nodes
+
+
+def trivial_lines(tree: ast.Module) -> Set[int]:
+    """
+    Lines outside of functions which carry no logic to score: imports,
+    docstrings and class headers.
+    """
+    lines = set()
+
+    def add_body(body: List[ast.stmt]):
+        for index, node in enumerate(body):
+            is_docstring = (
+                index == 0
+                and isinstance(node, ast.Expr)
+                and isinstance(node.value, ast.Constant)
+                and isinstance(node.value.value, str)
+            )
+            if is_docstring or isinstance(node, (ast.Import, ast.ImportFrom)):
+                lines.update(range(node.lineno, node.end_lineno + 1))
+            elif isinstance(node, ast.ClassDef):
+                lines.update(range(first_line(node), first_line(node.body[0])))
+                add_body(node.body)
+
+    add_body(tree.body)
+    return lines
+
+
+@dataclass
+class SourceFunctions:
+    spans: List[FunctionSpan]
+    trivial_lines: Set[int]
+
+
+def source_functions(file_path: str, source: str) -> Optional[SourceFunctions]:
+    """
+    Functions of a source file found without the model, only Python is
+    parsed. None when the file can not be split into functions.
+    """
+    if not file_path.endswith(".py"):
+        return None
+
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+    nodes = python_function_nodes(tree.body)
+    if len(nodes) == 0:
+        return None
+
+    # normalisation rewrites the nodes, lines are collected before
+    lines = trivial_lines(tree)
+    return SourceFunctions(
+        spans=[function_span(node) for node in nodes], trivial_lines=lines
+    )
@@ -0,0 +1,186 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+
+from codepass.read_code_files import CodeFile
+from codepass.scores.sample_aggregation import group_function_samples, median_function
+
+if TYPE_CHECKING:
+    from codepass.scores.function_fingerprint import FunctionSpan
+
+# share of both line ranges a model evaluation has to cover to be taken
+# for the locally found function
+MIN_LINE_OVERLAP = 0.8
+
+
+@dataclass
+class ScoreFunctions:
+    score_name: str
+    # field of the file evaluation holding the function evaluations
+    list_field: str
+    score_fields: List[str]
+    flag_fields: List[str]
+
+
+@dataclass
+class FunctionReuse:
+    """
+    Functions of a file split into the ones known from earlier evaluations
+    and the ones to send to the model. code is the line numbered code
+    without the known functions, None when nothing is left to evaluate.
+    """
+
+    reused: List[Tuple["FunctionSpan", Dict[str, Any]]]
+    new_spans: List["FunctionSpan"]
+    code: Optional[str]
+
+
+def span_lines(span: "FunctionSpan") -> range:
+    return range(span.start_line, span.end_line + 1)
+
+
+def remaining_code(
+    source: str, covered_lines: Set[int], trivial_lines: Set[int]
+) -> Optional[str]:
+    """
+    Line numbered code without the covered lines, None when only blank,
+    comment or trivial lines are left.
+    """
+    numbered_lines = [
+        (line_number, line)
+        for line_number, line in enumerate(source.split("\n"), start=1)
+        if line_number not in covered_lines
+    ]
+    has_code_left = any(
+        line.strip() != ""
+        and not line.strip().startswith("#")
+        and line_number not in trivial_lines
+        for line_number, line in numbered_lines
+    )
+    if not has_code_left:
+        return None
+
+    return "\n".join(f"{line_number} {line}" for line_number, line in numbered_lines)
+
+
+def plan_function_reuse(
+    function_store,
+    code_file: CodeFile,
+    model_name: str,
+    score_functions: ScoreFunctions,
+) -> Optional[FunctionReuse]:
+    if function_store is None:
+        return None
+
+    from codepass.scores.function_fingerprint import source_functions
+
+    try:
+        source = code_file.load_source()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    functions = source_functions(code_file.path, source)
+    if functions is None:
+        return None
+
+    (reused, new_spans) = ([], [])
+    for span in functions.spans:
+        factors = function_store.find(model_name, score_functions.score_name, span)
+        if factors is None:
+            new_spans.append(span)
+        else:
+            reused.append((span, factors))
+
+    code = remaining_code(
+        source,
+        set(line for span, _ in reused for line in span_lines(span)),
+        functions.trivial_lines,
+    )
+
+    return FunctionReuse(reused=reused, new_spans=new_spans, code=code)
+
+
+def reused_lines(reuse: FunctionReuse) -> Set[int]:
+    return set(line for span, _ in reuse.reused for line in span_lines(span))
+
+
+def reused_functions(reuse: FunctionReuse, function_class) -> List[Any]:
+    return [
+        function_class(
+            function_name=span.name,
+            start_line_number=span.start_line,
+            end_line_number=span.end_line,
+            **factors,
+        )
+        for span, factors in reuse.reused
+    ]
+
+
+def line_overlap(span: "FunctionSpan", function) -> float:
+    overlap = (
+        min(span.end_line, function.end_line_number)
+        - max(span.start_line, function.start_line_number)
+        + 1
+    )
+    longest = max(
+        span.end_line - span.start_line + 1,
+        function.end_line_number - function.start_line_number + 1,
+    )
+    return overlap / longest
+
+
+def record_functions(
+    function_store,
+    model_name: str,
+    score_functions: ScoreFunctions,
+    reuse: FunctionReuse,
+    functions: List[Any],
+):
+    fields = score_functions.score_fields + score_functions.flag_fields
+    for span in reuse.new_spans:
+        best = max(functions, key=lambda f: line_overlap(span, f), default=None)
+        if best is None or line_overlap(span, best) < MIN_LINE_OVERLAP:
+            continue
+        function_store.add(
+            model_name,
+            score_functions.score_name,
+            span,
+            {field: getattr(best, field) for field in fields},
+        )
+
+
+def complete_evaluation(
+    function_store,
+    model_name: str,
+    score_functions: ScoreFunctions,
+    reuse: FunctionReuse,
+    file_evaluation,
+    function_class,
+):
+    """
+    Records the functions the model evaluated for later runs and adds the
+    reused ones to the model output, to every sample when sampled.
+    """
+    list_field = score_functions.list_field
+    is_sampled = isinstance(file_evaluation, list)
+    samples = file_evaluation if is_sampled else [file_evaluation]
+
+    sample_functions = [getattr(sample, list_field) for sample in samples]
+    if len(samples) == 1:
+        functions = sample_functions[0]
+    else:
+        functions = [
+            median_function(
+                grouped, score_functions.score_fields, score_functions.flag_fields
+            )
+            for grouped in group_function_samples(sample_functions)
+        ]
+    record_functions(function_store, model_name, score_functions, reuse, functions)
+
+    extra_functions = reused_functions(reuse, function_class)
+    completed = [
+        sample.model_copy(
+            update={list_field: getattr(sample, list_field) + extra_functions}
+        )
+        for sample in samples
+    ]
+    return completed if is_sampled else completed[0]
@@ -0,0 +1,59 @@
+from statistics import median, median_low
+from typing import List, Optional, TypeVar
+
+T = TypeVar("T")
+
+LINE_NUMBER_FIELDS = ["start_line_number", "end_line_number"]
+
+
+def group_function_samples(samples: List[List[T]]) -> List[List[T]]:
+    """
+    Matches the functions of several evaluations of one file by name and
+    order of occurrence. The sample with the median number of functions
+    decides which functions the file consists of, functions missing from
+    it are dropped.
+    """
+    ordered_samples = sorted(samples, key=len)
+    skeleton = ordered_samples.pop(len(ordered_samples) // 2)
+
+    def key_functions(functions: List[T]) -> dict:
+        occurrences = {}
+        keyed_functions = {}
+        for function in functions:
+            occurrence = occurrences.get(function.function_name, 0)
+            occurrences[function.function_name] = occurrence + 1
+            keyed_functions[(function.function_name, occurrence)] = function
+        return keyed_functions
+
+    keyed_samples = [key_functions(functions) for functions in ordered_samples]
+    return [
+        [function]
+        + [
+            keyed_functions[key]
+            for keyed_functions in keyed_samples
+            if key in keyed_functions
+        ]
+        for key, function in key_functions(skeleton).items()
+    ]
+
+
+def median_function(
+    functions: List[T],
+    score_fields: List[str],
+    flag_fields: Optional[List[str]] = None,
+) -> T:
+    update = {
+        field: median(getattr(function, field) for function in functions)
+        for field in score_fields
+    }
+    for field in LINE_NUMBER_FIELDS:
+        update[field] = median_low(getattr(function, field) for function in functions)
+    for field in flag_fields or []:
+        update[field] = 2 * sum(getattr(function, field) for function in functions) > len(
+            functions
+        )
+    return functions[0].model_copy(update=update)
+
+
+def score_spread(scores: List[float]) -> float:
+    return round(max(scores) - min(scores), 1)
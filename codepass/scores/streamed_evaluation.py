@@ -0,0 +1,72 @@
+from typing import Any, Callable, List, Optional, Set
+
+from codepass.llm.invoke_model import invoke_model, load_source, ModelInvocationError
+from codepass.read_code_files import CodeFile
+from codepass.scores.function_reuse import ScoreFunctions, remaining_code
+
+# requests for one file, the first one included, before a file which keeps
+# being cut off is given up
+MAX_SALVAGE_REQUESTS = 4
+
+
+def function_lines(functions: List[Any]) -> Set[int]:
+    return set(
+        line
+        for function in functions
+        for line in range(function.start_line_number, function.end_line_number + 1)
+    )
+
+
+def source_trivial_lines(code_file: CodeFile, source: str) -> Set[int]:
+    from codepass.scores.function_fingerprint import source_functions
+
+    functions = source_functions(code_file.path, source)
+    return functions.trivial_lines if functions is not None else set()
+
+
+def invoke_streamed_model(
+    code_file: CodeFile,
+    build_stream_model: Callable,
+    model_name: str,
+    endpoint_pool,
+    score_functions: ScoreFunctions,
+    file_class,
+    code: Optional[str] = None,
+    covered_lines: Optional[Set[int]] = None,
+) -> Any:
+    """
+    Streams the evaluation of the code file and keeps every well formed
+    function entry of an answer which was cut off or broken. Only the code
+    outside of the functions evaluated so far is sent again, the answers
+    are merged into one file evaluation. covered_lines are the lines left
+    out of code by the caller.
+    """
+    list_field = score_functions.list_field
+    covered_lines = set(covered_lines or [])
+    functions = []
+    (source, trivial_lines) = (None, None)
+
+    for _ in range(MAX_SALVAGE_REQUESTS):
+        streamed = invoke_model(
+            code_file, build_stream_model, model_name, endpoint_pool, code
+        )
+        # a function may be evaluated again when its entry was cut in two
+        functions += [
+            function
+            for function in streamed.functions
+            if function.start_line_number not in covered_lines
+        ]
+        if streamed.is_complete:
+            return file_class(**{list_field: functions})
+
+        if source is None:
+            source = load_source(code_file)
+            trivial_lines = source_trivial_lines(code_file, source)
+        covered_lines |= function_lines(functions)
+        code = remaining_code(source, covered_lines, trivial_lines)
+        if code is None:
+            return file_class(**{list_field: functions})
+
+    raise ModelInvocationError(
+        f"Answer was incomplete {MAX_SALVAGE_REQUESTS} times: {streamed.error_message}"
+    )
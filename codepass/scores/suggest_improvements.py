@@ -1,12 +1,12 @@
-from codepass.llm.improvement_suggestion_parser import ImprovementSuggestion
 from codepass.llm.model import improvement_suggestion_model
-from codepass.token_budget_estimator import TokenBudgetEstimator
+from codepass.endpoint_pool import EndpointPool
+from codepass.llm.invoke_model import invoke_model, ModelInvocationError
 from dataclasses import dataclass
 from codepass.read_code_files import CodeFile
-from langchain_core.exceptions import OutputParserException
-from openai import RateLimitError, APITimeoutError
+from typing import TYPE_CHECKING
 
-MAX_RETRIES = 7
+if TYPE_CHECKING:
+    from codepass.llm.improvement_suggestion_parser import ImprovementSuggestion
 
 
 @dataclass
@@ -19,46 +19,40 @@ class ImprovementSuggestionResult:
     error_message: str = ""
 
 
-def suggest_improvements(
-    code_file: CodeFile,
-    model_name: str,
-    token_budget_estimator: TokenBudgetEstimator,
+def improvement_suggestion_error_result(
+    code_file: CodeFile, error_message: str
 ) -> ImprovementSuggestionResult:
-    error_recovery_instructions = ""
-    for _ in range(MAX_RETRIES):
-        try:
-            token_budget_estimator.await_budget(code_file)
-            improvement_suggestion: (
-                ImprovementSuggestion
-            ) = improvement_suggestion_model(model_name).invoke(
-                {
-                    "code": code_file.code,
-                    "error_recovery_instructions": error_recovery_instructions,
-                }
-            )
+    return ImprovementSuggestionResult(
+        file_path=code_file.path,
+        start_line=0,
+        end_line=0,
+        improvement_suggestion="",
+        error_message=error_message,
+    )
 
-            return ImprovementSuggestionResult(
-                file_path=code_file.path,
-                start_line=improvement_suggestion.start_line_number,
-                end_line=improvement_suggestion.end_line_number,
-                improvement_suggestion=improvement_suggestion.improvement_suggestion,
-                error_message="",
-            )
-        except OutputParserException as e:
-            if error_recovery_instructions == "":
-                error_recovery_instructions = "Be very careful in output formatting!"
-            else:
-                error_recovery_instructions = f"Parsing of output formatting already due to {str(e)}, please, avoid this issue again!"
-        except RateLimitError as e:
-            token_budget_estimator.push_external_costs(code_file.token_count)
-        except APITimeoutError as e:
-            return ImprovementSuggestionResult(
-                file_path=code_file.path,
-                improvement_suggestions="",
-                error_message="Timeout error",
-            )
+
+def improvement_suggestion_result(
+    code_file: CodeFile, improvement_suggestion: "ImprovementSuggestion"
+) -> ImprovementSuggestionResult:
     return ImprovementSuggestionResult(
         file_path=code_file.path,
-        improvement_suggestions="",
-        error_message=error_recovery_instructions,
+        start_line=improvement_suggestion.start_line_number,
+        end_line=improvement_suggestion.end_line_number,
+        improvement_suggestion=improvement_suggestion.improvement_suggestion,
+        error_message="",
     )
+
+
+def suggest_improvements(
+    code_file: CodeFile,
+    model_name: str,
+    endpoint_pool: EndpointPool,
+) -> ImprovementSuggestionResult:
+    try:
+        improvement_suggestion: "ImprovementSuggestion" = invoke_model(
+            code_file, improvement_suggestion_model, model_name, endpoint_pool
+        )
+    except ModelInvocationError as e:
+        return improvement_suggestion_error_result(code_file, str(e))
+
+    return improvement_suggestion_result(code_file, improvement_suggestion)
@@ -0,0 +1,78 @@
+from argparse import ArgumentTypeError
+from typing import List, Set, Tuple
+
+from codepass.deduplicate import group_by_hash
+from codepass.read_code_files import CodeFile
+
+import hashlib
+import heapq
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    try:
+        (index, count) = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ArgumentTypeError(f"Shard should be in i/n format, got {value}")
+
+    if count < 1 or index < 1 or index > count:
+        raise ArgumentTypeError(f"Shard index should be between 1 and {count}")
+
+    return (index, count)
+
+
+def partition_by_weight(
+    code_files: List[CodeFile], shard_count: int
+) -> List[List[CodeFile]]:
+    """
+    Greedy longest-processing-time partition: the heaviest remaining file
+    goes to the least loaded shard, so shards end up with about the same
+    token weight. Ties are broken by path and shard index, which keeps the
+    result identical on every CI node.
+    """
+    shards = [[] for _ in range(shard_count)]
+    loads = [(0, shard_index) for shard_index in range(shard_count)]
+
+    for code_file in sorted(code_files, key=lambda file: (-file.token_count, file.path)):
+        (load, shard_index) = heapq.heappop(loads)
+        shards[shard_index].append(code_file)
+        heapq.heappush(loads, (load + code_file.token_count, shard_index))
+
+    return shards
+
+
+def path_shard_index(file_path: str, shard_count: int) -> int:
+    path_hash = hashlib.md5(file_path.encode()).hexdigest()
+    return int(path_hash, 16) % shard_count
+
+
+def select_shard(
+    shard: Tuple[int, int],
+    code_files: List[CodeFile],
+    changed_files: List[CodeFile],
+) -> Tuple[List[CodeFile], Set[str]]:
+    """
+    Returns the changed files to evaluate on this shard together with the
+    paths whose report entries this shard owns. Changed files are split by
+    weight, identical ones go to one shard and weigh as one file, which is
+    evaluated once. The cheap rest (unchanged and too large files) is split
+    by path hash.
+    """
+    (index, count) = shard
+    (evaluated_files, twin_paths) = group_by_hash(changed_files)
+    files_by_path = {file.path: file for file in changed_files}
+    shard_changed_files = [
+        files_by_path[path]
+        for code_file in partition_by_weight(evaluated_files, count)[index - 1]
+        for path in [code_file.path] + twin_paths[code_file.path]
+    ]
+
+    changed_paths = set(file.path for file in changed_files)
+    owned_paths = set(file.path for file in shard_changed_files)
+    owned_paths.update(
+        file.path
+        for file in code_files
+        if file.path not in changed_paths
+        and path_shard_index(file.path, count) == index - 1
+    )
+
+    return (shard_changed_files, owned_paths)
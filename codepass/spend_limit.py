@@ -0,0 +1,269 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from colorama import Fore
+
+from codepass.discover_files import normalize_path
+from codepass.file_report import FileReport
+from codepass.get_config import CodepassConfig, enabled_score_names
+from codepass.read_code_files import CodeFile
+
+import math
+import os
+import subprocess
+
+# USD per million input and output tokens
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "o4-mini": (1.10, 4.40),
+    "o3-mini": (1.10, 4.40),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+# instructions and format description sent along with every file
+PROMPT_TOKENS = 1500
+# code is tokenized less efficiently than prose, stay on the safe side
+CHARACTERS_PER_TOKEN = 3
+# evaluations list every function with its factors, about half the code size
+OUTPUT_TOKEN_SHARE = 0.5
+CHURN_SINCE = "90 days ago"
+
+
+@dataclass
+class RequestEstimate:
+    input_tokens: int
+    output_tokens: int
+
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def cost(self, price: Tuple[float, float]) -> float:
+        (input_price, output_price) = price
+        return (
+            self.input_tokens * input_price + self.output_tokens * output_price
+        ) / 1_000_000
+
+
+@dataclass
+class FileSpend:
+    code_file: CodeFile
+    tokens: int
+    cost: float
+
+
+def estimate_request(code_file: CodeFile, sample_count: int = 1) -> RequestEstimate:
+    code_tokens = math.ceil(code_file.token_count / CHARACTERS_PER_TOKEN)
+    return RequestEstimate(
+        input_tokens=PROMPT_TOKENS + code_tokens,
+        output_tokens=math.ceil(code_tokens * OUTPUT_TOKEN_SHARE) * sample_count,
+    )
+
+
+def model_price(config: CodepassConfig, model_name: str) -> Tuple[float, float]:
+    prices = {**MODEL_PRICES, **config.model_prices}
+    if model_name not in prices:
+        raise ValueError(
+            f"No price known for {model_name}, add it to model_prices"
+            " in codepass.config.yaml"
+        )
+    return prices[model_name]
+
+
+def file_spend_estimate(
+    config: CodepassConfig, code_file: CodeFile
+) -> Tuple[int, float]:
+    """
+    Tokens and cost the file may take at most: every enabled score with
+    the main model, then possibly an escalation of every score and an
+    improvement suggestion.
+    """
+    score_count = len(enabled_score_names(config))
+    score_request = estimate_request(code_file, config.sample_count)
+
+    requests = [(config.model_name, score_request)] * score_count
+    if config.escalation_model_name is not None:
+        requests += [(config.escalation_model_name, score_request)] * score_count
+    if config.improvement_suggestions_enabled:
+        requests.append((config.model_name, estimate_request(code_file)))
+
+    tokens = sum(request.tokens() for _, request in requests)
+    if config.max_cost is None:
+        return (tokens, 0)
+
+    cost = sum(
+        request.cost(model_price(config, model_name))
+        for model_name, request in requests
+    )
+    return (tokens, cost)
+
+
+def repository_paths(file_paths: List[str]) -> Dict[str, str]:
+    """
+    Paths relative to the root of the git repository, the way git log
+    prints them, by the given paths which are relative to the working
+    directory, like ./src/main.py, or absolute.
+    """
+    (toplevel, prefix) = subprocess.run(
+        ["git", "rev-parse", "--show-toplevel", "--show-prefix"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split("\n")[:2]
+
+    repository_paths = {}
+    for path in file_paths:
+        repository_path = (
+            os.path.relpath(path, toplevel)
+            if os.path.isabs(path)
+            else os.path.join(prefix, path)
+        )
+        repository_paths[normalize_path(repository_path)] = path
+    return repository_paths
+
+
+def file_churn(file_paths: List[str]) -> Dict[str, int]:
+    """
+    Lines added and removed per file in the recent git history, files which
+    change often are more likely to be touched again.
+    """
+    churn = {path: 0 for path in file_paths}
+    try:
+        paths = repository_paths(file_paths)
+        log = subprocess.run(
+            ["git", "log", f"--since={CHURN_SINCE}", "--numstat", "--format="],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return churn
+
+    for line in log.splitlines():
+        parts = line.split("\t")
+        if len(parts) != 3 or parts[2] not in paths:
+            continue
+        (added, removed, path) = parts
+        if added.isdigit() and removed.isdigit():
+            churn[paths[path]] += int(added) + int(removed)
+
+    return churn
+
+
+def threshold_closeness(
+    config: CodepassConfig, file_report: Optional[FileReport]
+) -> float:
+    """
+    1 for files without a previous score, closer to 0 the further the
+    previous scores are from their thresholds.
+    """
+    thresholds = {
+        "a_score": config.a_score_threshold,
+        "b_score": config.b_score_threshold,
+    }
+    closeness = 0
+    for score_name in enabled_score_names(config):
+        score = getattr(file_report, score_name, None)
+        if score is None or score == 0:
+            return 1
+        closeness = max(closeness, 1 / (1 + abs(score - thresholds[score_name])))
+    return closeness
+
+
+def file_impacts(
+    config: CodepassConfig,
+    changed_files: List[CodeFile],
+    report_files: Dict[str, FileReport],
+) -> Dict[str, float]:
+    """
+    Expected impact of re-evaluating a file on the verdict: its share of the
+    line weight, how close its previous score is to the threshold and how
+    much it churns.
+    """
+    churn = file_churn([code_file.path for code_file in changed_files])
+    max_churn = max(churn.values(), default=0)
+    line_counts = {code_file.path: code_file.line_count for code_file in changed_files}
+    total_lines = sum(line_counts.values())
+
+    return {
+        code_file.path: line_counts[code_file.path]
+        / total_lines
+        * (1 + threshold_closeness(config, report_files.get(code_file.path)))
+        * (1 + math.log1p(churn[code_file.path]) / math.log1p(max(max_churn, 1)))
+        for code_file in changed_files
+    }
+
+
+def plan_spend(
+    config: CodepassConfig,
+    changed_files: List[CodeFile],
+    report_files: Dict[str, FileReport],
+) -> Tuple[List[CodeFile], List[CodeFile]]:
+    """
+    Splits the changed files into the ones to evaluate within --max-tokens
+    and --max-cost and the ones left stale. Files are taken by expected
+    impact, ones which do not fit anymore are skipped in favour of smaller
+    ones further down the list.
+    """
+    spends = []
+    for code_file in changed_files:
+        (tokens, cost) = file_spend_estimate(config, code_file)
+        spends.append(FileSpend(code_file, tokens, cost))
+
+    # identical files are evaluated once
+    unique_spends = {spend.code_file.hash: spend for spend in spends}.values()
+    total_tokens = sum(spend.tokens for spend in unique_spends)
+    total_cost = sum(spend.cost for spend in unique_spends)
+    if (config.max_tokens is None or total_tokens <= config.max_tokens) and (
+        config.max_cost is None or total_cost <= config.max_cost
+    ):
+        return (changed_files, [])
+
+    impacts = file_impacts(config, changed_files, report_files)
+    spends.sort(
+        key=lambda spend: (-impacts[spend.code_file.path], spend.code_file.path)
+    )
+
+    (planned_files, stale_files) = ([], [])
+    (planned_tokens, planned_cost) = (0, 0.0)
+    planned_hashes = set()
+    for spend in spends:
+        if spend.code_file.hash in planned_hashes:
+            planned_files.append(spend.code_file)
+            continue
+
+        fits_tokens = (
+            config.max_tokens is None
+            or planned_tokens + spend.tokens <= config.max_tokens
+        )
+        fits_cost = (
+            config.max_cost is None or planned_cost + spend.cost <= config.max_cost
+        )
+        if fits_tokens and fits_cost:
+            planned_files.append(spend.code_file)
+            planned_hashes.add(spend.code_file.hash)
+            planned_tokens += spend.tokens
+            planned_cost += spend.cost
+        else:
+            stale_files.append(spend.code_file)
+
+    print(
+        Fore.YELLOW + "Spend limit:",
+        f"{len(planned_files)} of {len(changed_files)} changed files fit,",
+        f"about {planned_tokens} tokens"
+        + (f" / ${round(planned_cost, 4)}" if config.max_cost is not None else "")
+        + f", {len(stale_files)} keep their previous scores",
+    )
+
+    return (planned_files, stale_files)
+
+
+def mark_stale(stale_files: List[CodeFile], report_files: Dict[str, FileReport]):
+    for code_file in stale_files:
+        if code_file.path not in report_files:
+            # an empty hash makes the next run evaluate the file
+            report_files[code_file.path] = FileReport(code_file.path, "")
+        report_files[code_file.path].stale = True
@@ -1,7 +1,8 @@
+from collections import deque
 from dataclasses import dataclass
 import time
 from threading import Lock
-from typing import List
+from typing import Deque
 
 from codepass.read_code_files import CodeFile
 
@@ -15,83 +16,79 @@ class TokenUsage:
 def estimate_remaining_budget(
     token_count: int,
     token_budget: int,
-    tokens_used: List[TokenUsage],
+    window_total: int,
 ) -> int:
-    current_time = time.time()
-    last_item_timestamp_threshold = current_time - 60
-    last_minute_used_tokens = [
-        token.count
-        for token in tokens_used
-        if token.timestamp > last_item_timestamp_threshold
-    ]
-    last_minute_used_tokens_sum = sum(last_minute_used_tokens)
-
-    return token_budget - last_minute_used_tokens_sum - token_count
+    return token_budget - window_total - token_count
 
 
 def estimated_push_back_seconds(
     token_count: int,
     token_budget: int,
-    tokens_used: List[TokenUsage],
-) -> int:
+    window_total: int,
+    tokens_used: Deque[TokenUsage],
+) -> float:
     remaining_token_budget = estimate_remaining_budget(
-        token_count, token_budget, tokens_used
+        token_count, token_budget, window_total
     )
 
     if remaining_token_budget > 0:
         return 0
-    else:
-        current_time = time.time()
-        last_item_timestamp_threshold = current_time - 60
-        tokens_removed = 0
-
-        for token in tokens_used:
-            tokens_removed += token.count
-            if tokens_removed >= remaining_token_budget:
-                return token.timestamp - last_item_timestamp_threshold
 
+    if len(tokens_used) == 0:
         return 60
 
+    # the budget is checked again once the oldest usage leaves the window
+    last_item_timestamp_threshold = time.time() - 60
+    return tokens_used[0].timestamp - last_item_timestamp_threshold
 
-class TokenBudgetEstimator:
-    tokens_used: List[TokenUsage] = []
-    mutex = Lock()
 
+class TokenBudgetEstimator:
     def __init__(self, token_budget: int):
         self.token_budget = token_budget
+        self.tokens_used: Deque[TokenUsage] = deque()
+        # tokens of tokens_used, kept up to date instead of summed again
+        self.window_total = 0
+        self.mutex = Lock()
 
     def _remove_old_tokens(self):
         current_time = time.time()
         last_item_timestamp_threshold = current_time - 60
-        self.tokens_used = [
-            token
-            for token in self.tokens_used
-            if token.timestamp > last_item_timestamp_threshold
-        ]
+        while (
+            len(self.tokens_used) > 0
+            and self.tokens_used[0].timestamp <= last_item_timestamp_threshold
+        ):
+            self.window_total -= self.tokens_used.popleft().count
+
+    def _push(self, token_count: int):
+        self.tokens_used.append(TokenUsage(token_count, time.time()))
+        self.window_total += token_count
 
     def push_external_costs(self, token_count):
         with self.mutex:
-            current_time = time.time()
-            self.tokens_used.append(TokenUsage(token_count, current_time))
+            self._push(token_count)
 
     def reserveBudget(self, code: CodeFile) -> int:
         with self.mutex:
             self._remove_old_tokens()
-            last_minute_used_tokens = self.tokens_used
 
             push_back_seconds = estimated_push_back_seconds(
                 code.token_count,
                 self.token_budget,
-                last_minute_used_tokens,
+                self.window_total,
+                self.tokens_used,
             )
 
             if push_back_seconds == 0:
-                current_time = time.time()
-                self.tokens_used.append(TokenUsage(code.token_count, current_time))
+                self._push(code.token_count)
                 return 0
 
             return push_back_seconds
 
+    def remaining_budget(self) -> int:
+        with self.mutex:
+            self._remove_old_tokens()
+            return estimate_remaining_budget(0, self.token_budget, self.window_total)
+
     def await_budget(self, code: CodeFile) -> None:
         while True:
             delay = self.reserveBudget(code)
@@ -101,7 +98,10 @@ class TokenBudgetEstimator:
             else:
                 break
 
-    def has_tasks_in_progress(self) -> bool:
+    def window_usage(self) -> int:
+        """
+        Tokens sent over the last minute.
+        """
         with self.mutex:
             self._remove_old_tokens()
-            return len(self.tokens_used) > 0
+            return self.window_total
@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+from functools import cache
+from json import dump
+from threading import Lock, current_thread, local
+from typing import Any, Dict, List, Optional
+
+import os
+import time
+
+# names of the stages of a file, spans of one file share its path
+READ = "read"
+HASH = "hash"
+REPORT_LOAD = "report load"
+REPORT_LOOKUP = "report lookup"
+QUEUE_WAIT = "queue wait"
+PROMPT_BUILD = "prompt build"
+NETWORK = "network"
+PARSE = "parse"
+REQUEST = "request"
+RETRY = "retry"
+OUTPUT_FIX = "output fix"
+REPORT_MERGE = "report merge"
+
+
+class Tracer:
+    """
+    Spans of the stages every file goes through, kept as events of the
+    Chrome trace event format, so a run opens in chrome://tracing or
+    Perfetto with one row per worker thread.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.events: List[Dict[str, Any]] = []
+        self.thread_names: Dict[int, str] = {}
+        self.started_at = time.perf_counter()
+        self.pid = os.getpid()
+
+    def timestamp(self) -> float:
+        # microseconds since the start of the run
+        return (time.perf_counter() - self.started_at) * 1_000_000
+
+    def add_span(self, name: str, started_at: float, args: Dict[str, Any]):
+        thread = current_thread()
+        event = {
+            "name": name,
+            "cat": "codepass",
+            "ph": "X",
+            "ts": started_at,
+            "dur": self.timestamp() - started_at,
+            "pid": self.pid,
+            "tid": thread.ident,
+            "args": {key: value for key, value in args.items() if value is not None},
+        }
+        with self.lock:
+            self.events.append(event)
+            self.thread_names.setdefault(thread.ident, thread.name)
+
+    def save(self, path: str):
+        with self.lock:
+            thread_events = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": self.pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self.thread_names.items()
+            ]
+            events = thread_events + self.events
+
+        with open(path, "w") as f:
+            dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+# None unless --trace is given, spans cost a check of it otherwise
+tracer: Optional[Tracer] = None
+thread_file = local()
+
+
+def start_tracing() -> Tracer:
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+
+def stop_tracing(path: str):
+    global tracer
+    if tracer is not None:
+        tracer.save(path)
+    tracer = None
+
+
+@contextmanager
+def span(name: str, file_path: Optional[str] = None, **args):
+    """
+    Records the time spent in the block as a stage of the file, by default
+    the file the current thread works on, see traced_file.
+    """
+    if tracer is None:
+        yield
+        return
+
+    started_at = tracer.timestamp()
+    try:
+        yield
+    finally:
+        if tracer is not None:
+            file_path = file_path or getattr(thread_file, "path", None)
+            if file_path is not None:
+                args["file"] = file_path
+            tracer.add_span(name, started_at, args)
+
+
+@contextmanager
+def traced_file(file_path: str):
+    """
+    Makes the spans of the block, the ones recorded deep in the chains
+    included, belong to the file.
+    """
+    previous = getattr(thread_file, "path", None)
+    thread_file.path = file_path
+    try:
+        yield
+    finally:
+        thread_file.path = previous
+
+
+@cache
+def chain_tracer_class():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class ChainTracer(BaseCallbackHandler):
+        """
+        Records the prompt formatting and the model requests of one chain
+        invocation, model requests made inside of a chain step included.
+        """
+
+        def __init__(self):
+            self.started = {}
+
+        def _start(self, run_id, name: str):
+            if tracer is not None:
+                self.started[run_id] = (name, tracer.timestamp())
+
+        def _end(self, run_id, **args):
+            (name, started_at) = self.started.pop(run_id, (None, None))
+            if name is not None and tracer is not None:
+                file_path = getattr(thread_file, "path", None)
+                if file_path is not None:
+                    args["file"] = file_path
+                tracer.add_span(name, started_at, args)
+
+        def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+            if kwargs.get("name") == "ChatPromptTemplate":
+                self._start(run_id, PROMPT_BUILD)
+
+        def on_chain_end(self, outputs, *, run_id, **kwargs):
+            self._end(run_id)
+
+        def on_chain_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error=type(error).__name__)
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self._start(run_id, NETWORK)
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            self._end(run_id)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._end(run_id, error=type(error).__name__)
+
+    return ChainTracer
+
+
+def chain_config() -> Optional[dict]:
+    """
+    Config of a chain invocation which records its stages, None when not
+    tracing.
+    """
+    if tracer is None:
+        return None
+    return {"callbacks": [chain_tracer_class()()]}
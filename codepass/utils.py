@@ -1,7 +1,10 @@
+from argparse import ArgumentTypeError
 from typing import TypeVar, Tuple, List, Callable
 
 T = TypeVar("T")
 
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600}
+
 
 def partition(
     items: List[T], predicate: Callable[[T], bool]
@@ -16,3 +19,21 @@ def partition(
             bad.append(item)
 
     return (good, bad)
+
+
+def parse_duration(value: str) -> float:
+    unit = value[-1:].lower()
+    try:
+        if unit in DURATION_UNITS:
+            seconds = float(value[:-1]) * DURATION_UNITS[unit]
+        else:
+            seconds = float(value)
+    except ValueError:
+        raise ArgumentTypeError(
+            f"Duration should look like 90s, 10m or 1h, got {value}"
+        )
+
+    if seconds <= 0:
+        raise ArgumentTypeError(f"Duration should be positive, got {value}")
+
+    return seconds
@@ -0,0 +1,369 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Dict, List, Optional, Set
+
+from colorama import Fore
+
+from codepass.file_report import FileReport
+from codepass.get_config import CodepassConfig, get_config
+from codepass.get_report_file import PrevReport, get_report_files
+from codepass.main import (
+    aggregate_report,
+    combine_report_and_files,
+    evaluate_changed_files,
+    print_scores,
+    save_report,
+    validate_config,
+)
+from codepass.read_code_files import read_files
+from codepass.discover_files import (
+    FileDiscovery,
+    create_file_discovery,
+    normalize_path,
+)
+from codepass.endpoint_pool import create_endpoint_pool
+from codepass.function_store import create_function_store
+from codepass.llm.model import configure_http_client, warm_up_endpoints
+from codepass.score_index import DirectoryRollup, file_contribution
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+EVENT_HEADER = struct.Struct("iIII")
+POLLING_INTERVAL = 0.5
+
+
+class InotifyWatcher:
+    """
+    Watches every directory the file discovery walks through, directories
+    created or moved in later included. Known files are kept, so the ones
+    inside a directory moved away, or every one when the kernel dropped
+    events, are reported as changed.
+    """
+
+    def __init__(self, file_discovery: FileDiscovery, file_paths: Set[str]):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._file_discovery = file_discovery
+        self._file_paths = set(map(normalize_path, file_paths))
+        self._directories: Dict[int, str] = {}
+        self._watch_descriptors: Dict[str, int] = {}
+        for directory in file_discovery.watched_directories():
+            self._add_watch(directory)
+
+    def _add_watch(self, directory: str):
+        watch_descriptor = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory or "."), WATCH_MASK
+        )
+        if watch_descriptor >= 0:
+            self._directories[watch_descriptor] = directory
+            self._watch_descriptors[directory] = watch_descriptor
+
+    def _add_directory(self, directory: str) -> Set[str]:
+        """
+        Watches a new directory and the ones below it, returns the files
+        already saved in them.
+        """
+        if not self._file_discovery.enters(directory):
+            return set()
+
+        # watched before the walk, files saved meanwhile are not missed
+        self._add_watch(directory)
+        (directories, file_paths) = self._file_discovery.walk(directory)
+        for walked_directory in directories:
+            self._add_watch(walked_directory)
+        return set(file_paths)
+
+    def _remove_directory(self, directory: str) -> Set[str]:
+        """
+        Stops watching a directory gone and the ones below it, returns the
+        known files which were in them.
+        """
+        prefix = directory + "/"
+        for watched_directory in [
+            watched_directory
+            for watched_directory in self._watch_descriptors
+            if watched_directory == directory or watched_directory.startswith(prefix)
+        ]:
+            watch_descriptor = self._watch_descriptors.pop(watched_directory)
+            del self._directories[watch_descriptor]
+            self._libc.inotify_rm_watch(self._fd, watch_descriptor)
+        return {path for path in self._file_paths if path.startswith(prefix)}
+
+    def _rescan(self) -> Set[str]:
+        """
+        Events were dropped, watches every directory again and reports every
+        known and discovered file.
+        """
+        for directory in self._file_discovery.watched_directories():
+            if directory not in self._watch_descriptors:
+                self._add_watch(directory)
+        return self._file_paths | set(
+            map(normalize_path, self._file_discovery.discover())
+        )
+
+    def _read_changed_paths(self, buffer: bytes) -> Set[str]:
+        changed_paths = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            watch_descriptor, mask, _, name_length = EVENT_HEADER.unpack_from(
+                buffer, offset
+            )
+            offset += EVENT_HEADER.size
+            name = buffer[offset : offset + name_length].rstrip(b"\0")
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                changed_paths |= self._rescan()
+                continue
+
+            directory = self._directories.get(watch_descriptor)
+            if mask & IN_IGNORED and directory is not None:
+                # the directory itself is gone
+                del self._directories[watch_descriptor]
+                del self._watch_descriptors[directory]
+                continue
+            if directory is None or not name:
+                continue
+
+            path = normalize_path(os.path.join(directory, os.fsdecode(name)))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed_paths |= self._add_directory(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    changed_paths |= self._remove_directory(path)
+            else:
+                changed_paths.add(path)
+        return changed_paths
+
+    def read_events(self, timeout: Optional[float]) -> Set[str]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed_paths = self._read_changed_paths(os.read(self._fd, 64 * 1024))
+        for path in changed_paths:
+            if os.path.isfile(path) and self._file_discovery.includes(path):
+                self._file_paths.add(path)
+            else:
+                self._file_paths.discard(path)
+        return changed_paths
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    Compares the modification times of the discovered files, discovering
+    them again on every poll, so new files are seen, too.
+    """
+
+    def __init__(self, file_discovery: FileDiscovery):
+        self._file_discovery = file_discovery
+        self._modification_times = self._read_modification_times()
+
+    def _read_modification_times(self) -> Dict[str, float]:
+        modification_times = {}
+        for file_path in self._file_discovery.discover():
+            try:
+                modification_times[file_path] = os.stat(file_path).st_mtime
+            except FileNotFoundError:
+                pass
+        return modification_times
+
+    def read_events(self, timeout: Optional[float]) -> Set[str]:
+        started_at = time.time()
+        while True:
+            modification_times = self._read_modification_times()
+            changed_paths = {
+                file_path
+                for file_path in set(modification_times) | set(self._modification_times)
+                if modification_times.get(file_path)
+                != self._modification_times.get(file_path)
+            }
+            self._modification_times = modification_times
+
+            if changed_paths:
+                return changed_paths
+
+            if timeout is not None and time.time() - started_at >= timeout:
+                return set()
+
+            time.sleep(POLLING_INTERVAL)
+
+    def close(self):
+        pass
+
+
+def create_watcher(file_discovery: FileDiscovery, file_paths: Set[str]):
+    try:
+        return InotifyWatcher(file_discovery, file_paths)
+    except (OSError, AttributeError, TypeError):
+        # inotify is Linux only, fall back to polling modification times
+        return PollingWatcher(file_discovery)
+
+
+def wait_for_changes(watcher, debounce_seconds: float) -> Set[str]:
+    changed_paths = watcher.read_events(None)
+    while True:
+        more_changed_paths = watcher.read_events(debounce_seconds)
+        if not more_changed_paths:
+            return changed_paths
+        changed_paths |= more_changed_paths
+
+
+class WatchSession:
+    def __init__(self, config: CodepassConfig):
+        self.config = config
+        self.file_discovery = create_file_discovery(config)
+        self.file_paths = {
+            normalize_path(path): path for path in self.file_discovery.discover()
+        }
+        self.endpoint_pool = create_endpoint_pool(config)
+        # a session sends requests for a long time, connect right away
+        configure_http_client(config.http_connections)
+        warm_up_endpoints(self.endpoint_pool.endpoints)
+        self.function_store = create_function_store(config)
+
+    def start(self):
+        code_files = read_files(list(self.file_paths.values()))
+        self.previous_report = get_report_files(code_files)
+        self.report_files: Dict[str, FileReport] = self.previous_report.files
+        self.directory_rollup = DirectoryRollup.from_report_files(
+            list(self.report_files.values())
+        )
+
+        self._evaluate(code_files)
+
+    def _evaluate(self, code_files, has_removed_files: bool = False):
+        (changed_files, large_files) = combine_report_and_files(
+            self.config, code_files, self.report_files
+        )
+
+        if len(changed_files) == 0 and len(large_files) == 0 and not has_removed_files:
+            return
+
+        for code_file in changed_files:
+            print(Fore.GREEN + "Evaluate:", code_file.path)
+
+        # reports are updated in place, keep what the files contributed before
+        updated_paths = [code_file.path for code_file in changed_files + large_files]
+        previous_contributions = {
+            path: file_contribution(self.report_files[path])
+            for path in updated_paths
+            if path in self.report_files
+        }
+
+        report_files_list = evaluate_changed_files(
+            self.config,
+            self.endpoint_pool,
+            changed_files,
+            large_files,
+            self.report_files,
+            function_store=self.function_store,
+        )
+        if self.function_store is not None:
+            self.function_store.save()
+
+        for path in updated_paths:
+            if path in self.report_files:
+                self.directory_rollup.update(
+                    path,
+                    previous_contributions.get(path),
+                    file_contribution(self.report_files[path]),
+                )
+        report = aggregate_report(report_files_list, self.config, self.directory_rollup)
+
+        for code_file in changed_files:
+            self._print_file_scores(self.report_files[code_file.path])
+
+        print_scores(report, self.previous_report)
+        save_report(report)
+
+        self.previous_report = PrevReport(
+            a_score=report.get("a_score", None),
+            b_score=report.get("b_score", None),
+            files=self.report_files,
+        )
+
+    def _print_file_scores(self, file_report: FileReport):
+        scores = []
+        if hasattr(file_report, "a_score"):
+            scores.append(f"A score: {file_report.a_score}")
+        if hasattr(file_report, "b_score"):
+            scores.append(f"B score: {file_report.b_score}")
+        print(Fore.YELLOW + file_report.file_path, *scores)
+
+    def handle_changes(self, changed_paths: Set[str]):
+        # files created inside walked directories join the watched set
+        for path in map(normalize_path, changed_paths):
+            if (
+                path not in self.file_paths
+                and os.path.isfile(path)
+                and self.file_discovery.includes(path)
+            ):
+                self.file_paths[path] = path
+
+        touched_paths = [
+            self.file_paths[path]
+            for path in map(normalize_path, changed_paths)
+            if path in self.file_paths
+        ]
+        if len(touched_paths) == 0:
+            return
+
+        existing_paths = [path for path in touched_paths if os.path.exists(path)]
+        removed_paths = set(touched_paths) - set(existing_paths)
+        for removed_path in removed_paths:
+            removed_report = self.report_files.pop(removed_path, None)
+            if removed_report is not None:
+                self.directory_rollup.update(
+                    removed_path, file_contribution(removed_report), None
+                )
+
+        code_files = read_files(existing_paths)
+        self._evaluate(code_files, len(removed_paths) > 0)
+
+
+def run_watch(args: List[str]):
+    config = get_config(args)
+
+    if validate_config(config):
+        print("No analysis enabled")
+        return
+
+    session = WatchSession(config)
+    # subscribe before the initial evaluation, so saves made meanwhile are seen
+    watcher = create_watcher(session.file_discovery, set(session.file_paths))
+
+    print(Fore.GREEN + "Watching files:", len(session.file_paths))
+    try:
+        session.start()
+        while True:
+            changed_paths = wait_for_changes(watcher, config.watch_debounce)
+            session.handle_changes(changed_paths)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
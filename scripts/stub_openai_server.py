@@ -0,0 +1,396 @@
+"""
+Minimal stand-in for the OpenAI chat completions and batch APIs, meant for
+trying codepass against one or several local endpoints without spending
+tokens. It answers every prompt with a well formed evaluation of every
+Python definition, or of the whole file, and can inject latency and server
+errors. Streamed answers can be cut off part way to try partial results,
+answers can be malformed to try output repair.
+Batch jobs are processed in the background right after they are created.
+
+    python scripts/stub_openai_server.py --port 8001 --failure-rate 0.5
+
+and point an endpoint at it with `base_url: http://127.0.0.1:8001/v1`.
+"""
+
+from argparse import ArgumentParser
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from threading import Lock, Thread
+
+import random
+import re
+import time
+import uuid
+
+CODE_MARKER = "Code to evaluate:"
+FIX_MARKER = "Output to fix:"
+# a field name only a fix request puts right
+BROKEN_FIELD = ('"function_name":', '"name":')
+
+
+def function_ranges(code: str):
+    """
+    Splits numbered code at Python definitions, code without any is
+    evaluated as one function.
+    """
+    line_numbers = [int(n) for n in re.findall(r"^(\d+) ", code, re.MULTILINE)]
+    if len(line_numbers) == 0:
+        return [("stub", 1, 1)]
+
+    definitions = re.findall(
+        r"^(\d+) \s*(?:async )?def (\w+)", code, re.MULTILINE
+    )
+    if len(definitions) == 0:
+        return [("stub", line_numbers[0], line_numbers[-1])]
+
+    starts = [int(line) for line, _ in definitions]
+    ends = [
+        max(line for line in line_numbers if line < next_start)
+        for next_start in starts[1:]
+    ] + [line_numbers[-1]]
+    return [
+        (name, start, end) for (_, name), start, end in zip(definitions, starts, ends)
+    ]
+
+
+def evaluate_prompt(prompt: str) -> dict:
+    instructions, _, code = prompt.partition(CODE_MARKER)
+    last_line = max((end for _, _, end in function_ranges(code)), default=1)
+
+    if "function_complexities" in instructions:
+        return {
+            "function_complexities": [
+                {
+                    "function_name": name,
+                    "is_setup_of_declaration": False,
+                    "readability_score": 0.3,
+                    "cognitive_complexity_score": 0.4,
+                    "project_specific_knowledge_score": 0.3,
+                    "technical_domain_knowledge_score": 0.2,
+                    "advanced_code_techniques_score": 0.1,
+                    "start_line_number": start,
+                    "end_line_number": end,
+                }
+                for name, start, end in function_ranges(code)
+            ]
+        }
+
+    if "function_abstraction_level_evaluations" in instructions:
+        return {
+            "function_abstraction_level_evaluations": [
+                {
+                    "function_name": name,
+                    "low_level_implementation_impact": 0.2,
+                    "technical_domain_logic_impact": 0.6,
+                    "business_logic_impact": 0.7,
+                    "project_specific_knowledge_impact": 0.3,
+                    "external_component_interfacing_impact": 0.1,
+                    "start_line_number": start,
+                    "end_line_number": end,
+                }
+                for name, start, end in function_ranges(code)
+            ]
+        }
+
+    return {
+        "improvement_suggestion": "Split the file into smaller functions.",
+        "start_line_number": 1,
+        "end_line_number": last_line,
+    }
+
+
+def malform(content: str) -> str:
+    """
+    Half of the malformed answers can be repaired locally, the other half
+    has a wrong field name.
+    """
+    if random.random() < 0.5:
+        return content.replace(*BROKEN_FIELD)
+    content = re.sub(r": (\d\.\d+)", r': "\1"', content)
+    content = content.replace("}]", "},]", 1)
+    return f"Here is the evaluation:\n```json\n// evaluation\n{content}\n```"
+
+
+def answer(request: dict, malformed_rate: float) -> str:
+    prompt = "\n".join(str(message["content"]) for message in request["messages"])
+    if FIX_MARKER in prompt:
+        return prompt.partition(FIX_MARKER)[2].strip().replace(*reversed(BROKEN_FIELD))
+
+    content = dumps(evaluate_prompt(prompt))
+    if random.random() < malformed_rate:
+        content = malform(content)
+    return content
+
+
+def chat_completion(request: dict, malformed_rate: float = 0.0) -> dict:
+    prompt = "\n".join(str(message["content"]) for message in request["messages"])
+    content = answer(request, malformed_rate)
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(content) // 4
+
+    return {
+        "id": f"chatcmpl-stub-{random.getrandbits(32)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "stub"),
+        "choices": [
+            {
+                "index": index,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+            for index in range(request.get("n") or 1)
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def completion_chunks(
+    request: dict, truncation_rate: float, malformed_rate: float, chunk_size: int = 40
+):
+    """
+    Server sent events of a streamed chat completion, cut at a random point
+    when the answer is truncated.
+    """
+    content = answer(request, malformed_rate)
+    finish_reason = "stop"
+    if random.random() < truncation_rate:
+        content = content[: random.randint(1, len(content) - 1)]
+        finish_reason = "length"
+
+    chunk_id = f"chatcmpl-stub-{random.getrandbits(32)}"
+    pieces = [content[i : i + chunk_size] for i in range(0, len(content), chunk_size)]
+    events = [
+        {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": piece},
+                    "finish_reason": None if index < len(pieces) - 1 else finish_reason,
+                }
+            ],
+        }
+        for index, piece in enumerate(pieces)
+    ]
+    return "".join(f"data: {dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+
+
+class BatchStore:
+    def __init__(self):
+        self.files = {}
+        self.batches = {}
+        self.lock = Lock()
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> dict:
+        file = {
+            "id": f"file-{uuid.uuid4().hex}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[file["id"]] = (file, content)
+        return file
+
+    def add_batch(self, request: dict, latency: float, failure_rate: float) -> dict:
+        with self.lock:
+            (_, content) = self.files[request["input_file_id"]]
+
+        requests = [loads(line) for line in content.decode().splitlines() if line]
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": request["endpoint"],
+            "input_file_id": request["input_file_id"],
+            "completion_window": request["completion_window"],
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": len(requests), "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+
+        Thread(
+            target=self._process_batch,
+            args=(batch, requests, latency, failure_rate),
+            daemon=True,
+        ).start()
+        return batch
+
+    def _process_batch(self, batch, requests, latency, failure_rate):
+        outputs = []
+        errors = []
+        for request in requests:
+            time.sleep(latency / 10)
+            if random.random() < failure_rate:
+                errors.append(
+                    {
+                        "custom_id": request["custom_id"],
+                        "response": None,
+                        "error": {"code": "server_error", "message": "Stub failure"},
+                    }
+                )
+                batch["request_counts"]["failed"] += 1
+                continue
+
+            outputs.append(
+                {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": chat_completion(request["body"]),
+                    },
+                    "error": None,
+                }
+            )
+            batch["request_counts"]["completed"] += 1
+
+        output_file = self.add_file(
+            "".join(dumps(output) + "\n" for output in outputs).encode(),
+            "output.jsonl",
+            "batch_output",
+        )
+        batch["output_file_id"] = output_file["id"]
+        if errors:
+            error_file = self.add_file(
+                "".join(dumps(error) + "\n" for error in errors).encode(),
+                "errors.jsonl",
+                "batch_output",
+            )
+            batch["error_file_id"] = error_file["id"]
+        batch["status"] = "completed"
+
+
+def parse_multipart(content_type: str, body: bytes) -> dict:
+    message = BytesParser().parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    fields = {}
+    for part in message.get_payload():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (
+            part.get_filename(),
+            part.get_payload(decode=True),
+        )
+    return fields
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep connections alive like the real API does
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    failure_rate = 0.0
+    truncation_rate = 0.0
+    malformed_rate = 0.0
+    batch_store = BatchStore()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> dict:
+        return loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        store = self.batch_store
+
+        if len(parts) == 3 and parts[1] == "batches" and parts[2] in store.batches:
+            self._send_json(200, store.batches[parts[2]])
+            return
+
+        if len(parts) == 4 and parts[1] == "files" and parts[3] == "content":
+            (_, content) = store.files[parts[2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+
+        self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        if self.path.endswith("/files"):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            fields = parse_multipart(self.headers["Content-Type"], body)
+            (filename, content) = fields["file"]
+            purpose = fields["purpose"][1].decode()
+            self._send_json(200, self.batch_store.add_file(content, filename, purpose))
+            return
+
+        if self.path.endswith("/batches"):
+            batch = self.batch_store.add_batch(
+                self._read_json(), self.latency, self.failure_rate
+            )
+            self._send_json(200, batch)
+            return
+
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        request = self._read_json()
+        time.sleep(self.latency)
+
+        if random.random() < self.failure_rate:
+            self._send_json(500, {"error": {"message": "Stub failure"}})
+            return
+
+        if request.get("stream"):
+            data = completion_chunks(
+                request, self.truncation_rate, self.malformed_rate
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self._send_json(200, chat_completion(request, self.malformed_rate))
+
+
+def main():
+    parser = ArgumentParser(description="Stub OpenAI compatible endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--truncation-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.failure_rate = args.failure_rate
+    StubHandler.truncation_rate = args.truncation_rate
+    StubHandler.malformed_rate = args.malformed_rate
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub OpenAI endpoint listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()